@@ -23,59 +23,97 @@
 #
 
 from itertools import chain
-import select, socket, time
+import asyncio, time
 
 class IrcClient:
-    """Non-blocking abstraction over the IRC protocol"""
+    """asyncio abstraction over the IRC protocol"""
     serverHname = serverPort = None;
     clientNick = clientIdent = clientGecos = None;
-    clientSocket = clientSocketFile = None;
-    clientNextTimeout = None; clientQueue = None;
+    clientReader = clientWriter = None;
+    clientQueue = clientQueueTask = None; clientTimers = None;
+    clientPingPending = None; clientPingTimeout = 120;
+    clientFloodPenalty = 2; clientFloodTime = None; clientFloodWindow = 10;
 
-    # {{{ close(self): Close connection to server
+    # {{{ _unqueue(self): Send queued lines to server as they are queued, honouring flood control
+    async def _unqueue(self):
+        while True:
+            msg = await self.clientQueue.get()
+            timeNow = time.monotonic()
+            if self.clientFloodTime < timeNow:
+                self.clientFloodTime = timeNow
+            elif (self.clientFloodTime - timeNow) > self.clientFloodWindow:
+                await asyncio.sleep(self.clientFloodTime - timeNow - self.clientFloodWindow)
+            self.clientFloodTime += self.clientFloodPenalty
+            self.clientWriter.write(msg)
+            try:
+                await self.clientWriter.drain()
+            except ConnectionError:
+                break
+    # }}}
+
+    # {{{ close(self): Close connection to server and cancel sender task and timers
     def close(self):
-        if self.clientSocket != None:
-            self.clientSocket.close()
-        self.clientSocket = self.clientSocketFile = None;
+        if self.clientQueueTask != None:
+            self.clientQueueTask.cancel()
+        if self.clientTimers != None:
+            for timerHandle in self.clientTimers:
+                timerHandle.cancel()
+        if self.clientWriter != None:
+            self.clientWriter.close()
+        self.clientReader = self.clientWriter = None;
+        self.clientQueue = self.clientQueueTask = None; self.clientTimers = None;
     # }}}
     # {{{ connect(self, timeout=None): Connect to server and register w/ optional timeout
-    def connect(self, timeout=None):
-        self.clientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.clientSocket.setblocking(0)
+    async def connect(self, timeout=None):
         try:
-            self.clientSocket.connect((self.serverHname, int(self.serverPort)))
-        except BlockingIOError:
-            pass
-        if timeout:
-            readySet = select.select([], [self.clientSocket.fileno()], [], timeout)
-            if len(readySet[1]) == 0:
-                self.close(); return False;
-        else:
-            select.select([], [self.clientSocket.fileno()], [])
-        self.clientSocketFile = self.clientSocket.makefile(encoding="utf-8", errors="replace")
-        self.clientQueue = []
+            self.clientReader, self.clientWriter = await asyncio.wait_for(  \
+                asyncio.open_connection(self.serverHname, int(self.serverPort)), timeout)
+        except (asyncio.TimeoutError, OSError):
+            self.close(); return False;
+        self.clientQueue = asyncio.Queue(); self.clientTimers = [];
+        self.clientFloodTime = time.monotonic(); self.clientPingPending = False;
+        self.clientQueueTask = asyncio.ensure_future(self._unqueue())
         self.queue("NICK", self.clientNick)
         self.queue("USER", self.clientIdent, "0", "0", self.clientGecos)
         return True
     # }}}
-    # {{{ readline(self): Read and parse single line from server into canonicalised list, honouring timers
-    def readline(self):
-        if self.clientNextTimeout:
-            timeNow = time.time()
-            if self.clientNextTimeout <= timeNow:
-                return ""
+    # {{{ queue(self, *args): Parse and queue single line to server from list; PING and PONG bypass the queue and flood control
+    def queue(self, *args):
+        if self.clientQueue == None:
+            return
+        msg = ""; argNumMax = len(args);
+        for argNum in range(argNumMax):
+            if argNum == (argNumMax - 1):
+                msg += ":" + args[argNum]
             else:
-                readySet = select.select([self.clientSocket.fileno()], [], [], self.clientNextTimeout - timeNow)
-        else:
-            readySet = select.select([self.clientSocket.fileno()], [], [])
-        msg = self.clientSocketFile.readline()
-        if len(msg):
-            msg = msg.rstrip("\r\n")
+                msg += args[argNum] + " "
+        if args[0] in ("PING", "PONG"):
+            self.clientWriter.write((msg + "\r\n").encode())
         else:
-            if len(readySet[0]) == 0:
+            self.clientQueue.put_nowait((msg + "\r\n").encode())
+    # }}}
+    # {{{ readline(self): Read and parse single line from server into canonicalised list, PINGing the server once if idle
+    async def readline(self):
+        while True:
+            try:
+                msg = await asyncio.wait_for(self.clientReader.readline(), self.clientPingTimeout)
+            except asyncio.TimeoutError:
+                if self.clientPingPending:
+                    return None
+                else:
+                    self.clientPingPending = True; self.queue("PING", self.serverHname); continue;
+            except ValueError:
                 return ""
-            else:
+            except ConnectionError:
                 return None
+            break
+        self.clientPingPending = False
+        if len(msg):
+            msg = msg.decode("utf-8", errors="replace").rstrip("\r\n")
+            if not len(msg):
+                return ""
+        else:
+            return None
         msg = msg.split(" :", 1)
         if len(msg) == 1:
             msg = list(chain.from_iterable(m.split(" ") for m in msg))
@@ -87,34 +125,13 @@ class IrcClient:
             msg = [""] + msg[0:]
         return msg
     # }}}
-    # {{{ queue(self, *args): Parse and queue single line to server from list
-    def queue(self, *args):
-        msg = ""; argNumMax = len(args);
-        for argNum in range(argNumMax):
-            if argNum == (argNumMax - 1):
-                msg += ":" + args[argNum]
-            else:
-                msg += args[argNum] + " "
-        self.clientQueue.append((msg + "\r\n").encode())
-    # }}}
-    # {{{ unqueue(self): Send all queued lines to server, honouring timers
-    def unqueue(self):
-        while self.clientQueue:
-            msg = self.clientQueue[0]; msgLen = len(msg); msgBytesSent = 0;
-            while msgBytesSent < msgLen:
-                if self.clientNextTimeout:
-                    timeNow = time.time()
-                    if self.clientNextTimeout <= timeNow:
-                        self.clientQueue[0] = msg; return;
-                    else:
-                        readySet = select.select([], [self.clientSocket.fileno()], [], self.clientNextTimeout - timeNow)
-                        if len(readySet[1]) == 0:
-                            self.clientQueue[0] = msg; return;
-                else:
-                    readySet = select.select([], [self.clientSocket.fileno()], [])
-                msgBytesSent = self.clientSocket.send(msg)
-                msg = msg[msgBytesSent:]; msgLen -= msgBytesSent;
-            del self.clientQueue[0]
+    # {{{ timer(self, delay, callback, *args): Call callback w/ args after delay seconds unless cancelled or closed first
+    def timer(self, delay, callback, *args):
+        clientLoop = asyncio.get_event_loop()
+        self.clientTimers = [h for h in self.clientTimers if not h.cancelled() and h.when() > clientLoop.time()]
+        timerHandle = clientLoop.call_later(delay, callback, *args)
+        self.clientTimers.append(timerHandle)
+        return timerHandle
     # }}}
 
     #
@@ -22,18 +22,19 @@
 # SOFTWARE.
 #
 
-import base64
-import os, sys, time
-import json
+import asyncio, getopt, io, os, sys, tempfile, time
 import IrcClient
-import requests, urllib.request
+import urllib.request
+from MiRCARTCanvasCache import MiRCARTCanvasCache
+from MiRCARTCanvasExportStore import MiRCARTCanvasExportStore
 from MiRCARTCanvasImportStore import MiRCARTCanvasImportStore
 from MiRCARTToPngFile import MiRCARTToPngFile
 
 class IrcMiRCARTBot(IrcClient.IrcClient):
     """IRC<->MiRC2png bot"""
     clientChannelLastMessage = clientChannelOps = clientChannel = None
-    clientChannelRejoin = None
+    clientCanvasCache = clientChannelRejoin = clientExportStore = clientRequest = None
+    clientRejoinDelay = 15
 
     # {{{ ContentTooLargeException(Exception): Raised by _urlretrieveReportHook() given download size > 1 MB
     class ContentTooLargeException(Exception):
@@ -57,15 +58,18 @@ class IrcMiRCARTBot(IrcClient.IrcClient):
     # }}}
     # {{{ _dispatchJoin(self, message): Dispatch single JOIN message from server
     def _dispatchJoin(self, message):
-        self._log("Joined {} on {}:{}.".format(message[2].lower(), self.serverHname, self.serverPort))
-        self.clientNextTimeout = None; self.clientChannelRejoin = False;
+        if  message[0].split("!")[0].lower() == self.clientNick.lower()     \
+        and message[2].lower() == self.clientChannel.lower():
+            self._log("Joined {} on {}:{}.".format(message[2].lower(), self.serverHname, self.serverPort))
+            if self.clientChannelRejoin != None:
+                self.clientChannelRejoin.cancel(); self.clientChannelRejoin = None;
     # }}}
     # {{{ _dispatchKick(self, message): Dispatch single KICK message from server
     def _dispatchKick(self, message):
         if  message[2].lower() == self.clientChannel.lower()                    \
         and message[3].lower() == self.clientNick.lower():
-            self._log("Kicked from {} by {}, rejoining in 15 seconds".format(message[2].lower(), message[0]))
-            self.clientNextTimeout = time.time() + 15; self.clientChannelRejoin = True;
+            self._log("Kicked from {} by {}, rejoining in {} seconds".format(message[2].lower(), message[0], self.clientRejoinDelay))
+            self.clientChannelRejoin = self.timer(self.clientRejoinDelay, self._dispatchTimer)
     # }}}
     # {{{ _dispatchMode(self, message): Dispatch single MODE message from server
     def _dispatchMode(self, message):
@@ -108,7 +112,10 @@ class IrcMiRCARTBot(IrcClient.IrcClient):
     def _dispatchPrivmsg(self, message):
         if  message[2].lower() == self.clientChannel.lower()           \
         and message[3].startswith("!pngbot "):
-            if (int(time.time()) - self.clientLastMessage) < 30:
+            if self.clientRequest != None:
+                self._log("Ignoring request on {} from {} due to pending request: {}".format(message[2].lower(), message[0], message[3]))
+                return
+            elif (int(time.time()) - self.clientLastMessage) < 30:
                 self._log("Ignoring request on {} from {} due to rate limit: {}".format(message[2].lower(), message[0], message[3]))
                 return
             elif message[0].split("!")[0].lower() not in self.clientChannelOps:
@@ -116,113 +123,90 @@ class IrcMiRCARTBot(IrcClient.IrcClient):
                 return
             else:
                 self._log("Processing request on {} from {}: {}".format(message[2].lower(), message[0], message[3]))
-            asciiUrl = message[3].split(" ")[1]
-            asciiTmpFilePath = "tmp.txt"; imgTmpFilePath = "tmp.png";
-            if os.path.isfile(asciiTmpFilePath):
-                os.remove(asciiTmpFilePath)
-            if os.path.isfile(imgTmpFilePath):
-                os.remove(imgTmpFilePath)
+            self.clientRequest = asyncio.ensure_future(self._processRequest(message[2], message[3].split(" ")[1]))
+    # }}}
+    # {{{ _dispatchTimer(self): Dispatch single rejoin timer expiration, rearming it until joined
+    def _dispatchTimer(self):
+        self._log("Attempting to join {} on {}:{}...".format(self.clientChannel, self.serverHname, self.serverPort))
+        self.queue("JOIN", self.clientChannel)
+        self.clientChannelRejoin = self.timer(self.clientRejoinDelay, self._dispatchTimer)
+    # }}}
+    # {{{ _log(self, msg): Log single message to stdout w/ timestamp
+    def _log(self, msg):
+        print(time.strftime("%Y/%m/%d %H:%M:%S") + " " + msg)
+    # }}}
+    # {{{ _processRequest(self, channel, asciiUrl): Process single request in the default executor and reply on channel w/o blocking the event loop
+    async def _processRequest(self, channel, asciiUrl):
+        try:
+            requestStatus, requestText = await asyncio.get_event_loop().run_in_executor(None, self._processUrl, asciiUrl)
+            self._log(requestText)
+            if requestStatus:
+                self.queue("PRIVMSG", channel, "8/!\\ {}".format(requestText))
+                self.clientLastMessage = int(time.time())
+            else:
+                self.queue("PRIVMSG", channel, "4/!\\ {}!".format(requestText.rstrip("!")))
+        except Exception as err:
+            self._log("Request failed: {}".format(err))
+            self.queue("PRIVMSG", channel, "4/!\\ Request failed: {}!".format(str(err).rstrip("!")))
+        finally:
+            self.clientRequest = None
+    # }}}
+    # {{{ _processUrl(self, asciiUrl): Download, render, and upload single MiRCART file in executor thread, returning [success, message]
+    def _processUrl(self, asciiUrl):
+        asciiTmpFileFd, asciiTmpFilePath = tempfile.mkstemp(prefix="IrcMiRCARTBot", suffix=".txt"); os.close(asciiTmpFileFd);
+        try:
             try:
                 urllib.request.urlretrieve(asciiUrl, asciiTmpFilePath, IrcMiRCARTBot._urlretrieveReportHook)
             except IrcMiRCARTBot.ContentTooLargeException:
-                self._log("Download size exceeds quota of 1 MB!")
-                self.queue("PRIVMSG", message[2], "4/!\\ Download size exceeds quota of 1 MB!")
-                return
+                return [False, "Download size exceeds quota of 1 MB!"]
             except urllib.error.HTTPError as err:
-                self._log("Download failed with HTTP status code {}".format(err.code))
-                self.queue("PRIVMSG", message[2], "4/!\\ Download failed with HTTP status code {}!".format(err.code))
-                return
-            except urllib.error.URLError as err:
-                self._log("Invalid URL specified!")
-                self.queue("PRIVMSG", message[2], "4/!\\ Invalid URL specified!")
-                return
-            except ValueError as err:
-                self._log("Unknown URL type specified!")
-                self.queue("PRIVMSG", message[2], "4/!\\ Unknown URL type specified!")
-                return
+                return [False, "Download failed with HTTP status code {}".format(err.code)]
+            except urllib.error.URLError:
+                return [False, "Invalid URL specified!"]
+            except ValueError:
+                return [False, "Unknown URL type specified!"]
 
-            canvasStore = MiRCARTCanvasImportStore(inFile=asciiTmpFilePath)
-            numRowCols = 0
-            for numRow in range(len(canvasStore.outMap)):
-                numRowCols = max(numRowCols, len(canvasStore.outMap[numRow]))
-            for numRow in range(len(canvasStore.outMap)):
-                if len(canvasStore.outMap[numRow]) != numRowCols:
-                    for numColOff in range(numRowCols - len(canvasStore.outMap[numRow])):
-                        canvasStore.outMap[numRow].append([1, 1, 0, " "])
-                canvasStore.outMap[numRow].insert(0, [1, 1, 0, " "])
-                canvasStore.outMap[numRow].append([1, 1, 0, " "])
-            canvasStore.outMap.insert(0, [[1, 1, 0, " "]] * len(canvasStore.outMap[0]))
-            canvasStore.outMap.append([[1, 1, 0, " "]] * len(canvasStore.outMap[0]))
-            MiRCARTToPngFile(canvasStore.outMap, "DejaVuSansMono.ttf", 11).export(imgTmpFilePath)
-            imgurResponse = self._uploadToImgur(imgTmpFilePath, "MiRCART image", "MiRCART image", "c9a6efb3d7932fd")
+            canvasStore = MiRCARTCanvasImportStore(canvasCache=self.clientCanvasCache); imgFile = io.BytesIO();
+            MiRCARTToPngFile(None, "DejaVuSansMono.ttf", 11, outMode="P").exportBands(imgFile,   \
+                canvasStore.getTextFileSize(asciiTmpFilePath), canvasStore.iterTextFile(asciiTmpFilePath), inMargin=1)
+            imgFile.seek(0)
+            imgurResponse = self.clientExportStore.exportFileToImgur("c9a6efb3d7932fd", "MiRCART image", "MiRCART image", imgFile)
             if imgurResponse[0] == 200:
-                    self._log("Uploaded as: {}".format(imgurResponse[1]))
-                    self.queue("PRIVMSG", message[2], "8/!\\ Uploaded as: {}".format(imgurResponse[1]))
-                    self.clientLastMessage = int(time.time())
+                return [True, "Uploaded as: {}".format(imgurResponse[1])]
             else:
-                    self._log("Upload failed with HTTP status code {}".format(imgurResponse[0]))
-                    self.queue("PRIVMSG", message[2], "4/!\\ Upload failed with HTTP status code {}!".format(imgurResponse[0]))
+                return [False, "Upload failed with HTTP status code {}".format(imgurResponse[0])]
+        finally:
             if os.path.isfile(asciiTmpFilePath):
                 os.remove(asciiTmpFilePath)
-            if os.path.isfile(imgTmpFilePath):
-                os.remove(imgTmpFilePath)
-    # }}}
-    # {{{ _dispatchTimer(self): Dispatch single client timer expiration
-    def _dispatchTimer(self):
-        if self.clientChannelRejoin:
-            self._log("Attempting to join {} on {}:{}...".format(self.clientChannel, self.serverHname, self.serverPort))
-            self.queue("JOIN", self.clientChannel)
-            self.clientNextTimeout = time.time() + 15; self.clientChannelRejoin = True;
-    # }}}
-    # {{{ _log(self, msg): Log single message to stdout w/ timestamp
-    def _log(self, msg):
-        print(time.strftime("%Y/%m/%d %H:%M:%S") + " " + msg)
-    # }}}
-    # {{{ _uploadToImgur(self, imgFilePath, imgName, imgTitle, apiKey): Upload single file to Imgur
-    def _uploadToImgur(self, imgFilePath, imgName, imgTitle, apiKey):
-        with open(imgFilePath, "rb") as requestImage:
-            requestImageData = requestImage.read()
-        requestData = {                                     \
-            "image": base64.b64encode(requestImageData),    \
-            "key":   apiKey,                                \
-            "name":  imgName,                               \
-            "title": imgTitle,                              \
-            "type":  "base64"}
-        requestHeaders = {                                  \
-            "Authorization": "Client-ID " + apiKey}
-        responseHttp = requests.post("https://api.imgur.com/3/upload.json", data=requestData, headers=requestHeaders)
-        responseDict = json.loads(responseHttp.text)
-        if responseHttp.status_code == 200:
-                return [200, responseDict.get("data").get("link")]
-        else:
-                return [responseHttp.status_code]
     # }}}
     # {{{ _urlretrieveReportHook(count, blockSize, totalSize): Limit downloads to 1 MB
     def _urlretrieveReportHook(count, blockSize, totalSize):
         if (totalSize > pow(2,20)):
             raise IrcMiRCARTBot.ContentTooLargeException
     # }}}
+    # {{{ close(self): Close connection to server and cancel pending request, if any
+    def close(self):
+        if self.clientRequest != None:
+            self.clientRequest.cancel(); self.clientRequest = None;
+        self.clientChannelRejoin = None
+        super().close()
+    # }}}
     # {{{ connect(self, timeout=None): Connect to server and (re)initialise w/ optional timeout
-    def connect(self, timeout=None):
+    async def connect(self, timeout=None):
         self._log("Connecting to {}:{}...".format(self.serverHname, self.serverPort))
-        if super().connect(timeout):
+        if await super().connect(timeout):
                 self._log("Connected to {}:{}.".format(self.serverHname, self.serverPort))
                 self._log("Registering on {}:{} as {}, {}, {}...".format(self.serverHname, self.serverPort, self.clientNick, self.clientIdent, self.clientGecos))
                 self.clientLastMessage = 0; self.clientChannelOps = [];
-                self.clientChannelRejoin = False
+                self.clientChannelRejoin = self.clientRequest = None;
                 return True
         else:
                 return False
     # }}}
-    # {{{ dispatch(self): Read, parse, and dispatch single line from server
-    def dispatch(self):
+    # {{{ dispatch(self): Read, parse, and dispatch lines from server until disconnected
+    async def dispatch(self):
         while True:
-            if self.clientNextTimeout:
-                timeNow = time.time()
-                if self.clientNextTimeout <= timeNow:
-                    self._dispatchTimer()
-            self.unqueue()
-            serverMessage = self.readline()
+            serverMessage = await self.readline()
             if serverMessage == None:
                 self._dispatchNone(); break;
             elif serverMessage == "":
@@ -242,27 +226,36 @@ class IrcMiRCARTBot(IrcClient.IrcClient):
             elif serverMessage[1] == "PRIVMSG":
                 self._dispatchPrivmsg(serverMessage)
     # }}}
+    # {{{ run(self): Connect, dispatch, and reconnect after 15 seconds forever
+    async def run(self):
+        while True:
+            if await self.connect(15):
+                await self.dispatch()
+                self.close()
+            await asyncio.sleep(15)
+    # }}}
 
     #
-    # __init__(self, serverHname, serverPort="6667", clientNick="pngbot", clientIdent="pngbot", clientGecos="pngbot", clientChannel="#MiRCART"): initialisation method
-    def __init__(self, serverHname, serverPort="6667", clientNick="pngbot", clientIdent="pngbot", clientGecos="pngbot", clientChannel="#MiRCART"):
+    # __init__(self, serverHname, serverPort="6667", clientNick="pngbot", clientIdent="pngbot", clientGecos="pngbot", clientChannel="#MiRCART", cacheEnabled=False): initialisation method
+    def __init__(self, serverHname, serverPort="6667", clientNick="pngbot", clientIdent="pngbot", clientGecos="pngbot", clientChannel="#MiRCART", cacheEnabled=False):
         super().__init__(serverHname, serverPort, clientNick, clientIdent, clientGecos)
         self.clientChannel = clientChannel
+        self.clientCanvasCache = MiRCARTCanvasCache() if cacheEnabled else None
+        self.clientExportStore = MiRCARTCanvasExportStore(None)
 
 #
 # Entry point
 def main(*argv):
-    _IrcMiRCARTBot = IrcMiRCARTBot(*argv[1:])
-    while True:
-        if _IrcMiRCARTBot.connect(15):
-            _IrcMiRCARTBot.dispatch()
-            _IrcMiRCARTBot.close()
-        time.sleep(15)
+    optList, argv = getopt.getopt(argv[1:], "C"); optDict = dict(optList);
+    _IrcMiRCARTBot = IrcMiRCARTBot(*argv, cacheEnabled=("-C" in optDict))
+    asyncio.run(_IrcMiRCARTBot.run())
 
 if __name__ == "__main__":
-    if ((len(sys.argv) - 1) < 1)\
-    or ((len(sys.argv) - 1) > 4):
+    optList, optArgs = getopt.getopt(sys.argv[1:], "C")
+    if (len(optArgs) < 1)\
+    or (len(optArgs) > 4):
         print("usage: {} "                                                  \
+            "[-C] "                                                         \
             "<IRC server hostname> "                                        \
             "[<IRC server port; defaults to 6667>] "                        \
             "[<IRC bot nick name; defaults to pngbot>] "                    \
@@ -23,19 +23,24 @@
 #
 
 from MiRCARTFrame import MiRCARTFrame
-import sys, wx
+import getopt, sys, wx
 
 #
 # Entry point
 def main(*argv):
+    optList, argv = getopt.getopt(argv[1:], "Cj"); optDict = dict(optList);
     wxApp = wx.App(False)
-    appFrame = MiRCARTFrame(None)
-    if  len(argv) > 1    \
-    and len(argv[1]) > 0:
-        appFrame.panelCanvas.canvasInterface.canvasPathName = argv[1]
-        appFrame.panelCanvas.canvasImportStore.importTextFile(argv[1])
-        appFrame.panelCanvas.canvasImportStore.importIntoPanel()
-        appFrame.onCanvasUpdate(pathName=argv[1], undoLevel=-1)
+    appFrame = MiRCARTFrame(None, logEnabled=("-j" in optDict), cacheEnabled=("-C" in optDict))
+    if  len(argv) > 0    \
+    and len(argv[0]) > 0:
+        appFrame.panelCanvas.canvasInterface.canvasPathName = argv[0]
+        if appFrame.panelCanvas.restoreLog(argv[0]):
+            undoLevel = appFrame.panelCanvas.canvasModel.canvasJournal.patchesUndoLevel
+        else:
+            appFrame.panelCanvas.canvasImportStore.importFileIntoPanel(argv[0])
+            appFrame.panelCanvas.canvasModel.attachLog(argv[0])
+            undoLevel = -1
+        appFrame.onCanvasUpdate(pathName=argv[0], undoLevel=undoLevel)
     wxApp.MainLoop()
 if __name__ == "__main__":
     main(*sys.argv)
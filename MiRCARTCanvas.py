@@ -23,53 +23,81 @@
 #
 
 from MiRCARTCanvasBackend import MiRCARTCanvasBackend
-from MiRCARTCanvasJournal import MiRCARTCanvasJournal
+from MiRCARTCanvasCache import MiRCARTCanvasCache
 from MiRCARTCanvasExportStore import MiRCARTCanvasExportStore, haveMiRCARTToPngFile, haveUrllib
 from MiRCARTCanvasImportStore import MiRCARTCanvasImportStore
 from MiRCARTCanvasInterface import MiRCARTCanvasInterface
+from MiRCARTCanvasModel import MiRCARTCanvasModel
 import wx
 
-class MiRCARTCanvas(wx.Panel):
+class MiRCARTCanvas(wx.ScrolledWindow):
     """XXX"""
     parentFrame = None
     defaultCanvasPos = defaultCanvasSize = defaultCellSize = None
-    canvasMap = canvasPos = canvasSize = None
-    brushColours = brushPos = brushSize = None
-    canvasBackend = canvasJournal = None
+    canvasPos = None
+    canvasBackend = canvasModel = None
     canvasExportStore = canvasImportStore = None
     canvasInterface = None
 
-    # {{{ _commitPatch(self, patch): XXX
-    def _commitPatch(self, patch):
-        self.canvasMap[patch[1]][patch[0]] = patch[2:]
-    # }}}
-    # {{{ _dispatchDeltaPatches(self, deltaPatches): XXX
-    def _dispatchDeltaPatches(self, deltaPatches):
-        eventDc = self.canvasBackend.getDeviceContext(self)
-        for patch in deltaPatches:
-            if self.canvasBackend.drawPatch(eventDc, patch):
-                self._commitPatch(patch)
-        self.parentFrame.onCanvasUpdate(undoLevel=self.canvasJournal.patchesUndoLevel)
-    # }}}
-    # {{{ _dispatchPatch(self, eventDc, isCursor, patch): XXX
-    def _dispatchPatch(self, eventDc, isCursor, patch):
-        if not self._canvasDirtyCursor:
-            self.canvasBackend.drawCursorMaskWithJournal(   \
-                self.canvasJournal, eventDc)
-            self._canvasDirtyCursor = True
-        if self.canvasBackend.drawPatch(eventDc, patch):
-            patchDeltaCell = self.canvasMap[patch[1]][patch[0]]
-            patchDelta = [*patch[0:2], *patchDeltaCell]
-            if isCursor:
-                self.canvasJournal.pushCursor(patchDelta)
-            else:
-                if not self._canvasDirty:
-                    self.canvasJournal.pushDeltas([], [])
-                    self._canvasDirty = True
-                self.canvasJournal.updateCurrentDeltas(patchDelta, patch)
-                self._commitPatch(patch)
+    # {{{ _getVisibleRect(self): return [x, y, w, h] cell rectangle currently scrolled into view
+    def _getVisibleRect(self):
+        viewStart = self.CalcUnscrolledPosition(0, 0)
+        clientSize = self.GetClientSize()
+        return [viewStart[0] // self.canvasBackend.cellSize[0],             \
+                viewStart[1] // self.canvasBackend.cellSize[1],             \
+                (clientSize[0] // self.canvasBackend.cellSize[0]) + 2,      \
+                (clientSize[1] // self.canvasBackend.cellSize[1]) + 2]
+    # }}}
+    # {{{ _onModelReset(self, undoLevel, redraw=True): resize backend and window to canvasModel and redraw it, entirely if redraw
+    def _onModelReset(self, undoLevel, redraw=True):
+        newCanvasSize = self.canvasModel.canvasSize
+        self.SetVirtualSize([a*b for a,b in zip(newCanvasSize, self.canvasBackend.cellSize)])
+        self.canvasBackend.resize(newCanvasSize, self.canvasBackend.cellSize)
+        self.canvasBackend.updateViewport(self.canvasModel.canvasMap, self._getVisibleRect(), redraw=redraw)
+        self.Refresh(False)
+        self.parentFrame.onCanvasUpdate(                                    \
+            renderTime=self.canvasBackend.lastRenderTime, size=newCanvasSize, undoLevel=undoLevel)
+        wx.SafeYield()
+    # }}}
+    # {{{ _onPanelInput(self, event, eventDc): XXX
+    def _onPanelInput(self, event, eventDc):
+        eventType = event.GetEventType()
+        tool = self.canvasInterface.canvasTool
+        if eventType == wx.wxEVT_CHAR:
+            mapPoint = self.canvasModel.brushPos
+            doSkip = self.canvasModel.dispatchKeyboardEvent(                \
+                tool, event, chr(event.GetUnicodeKey()), eventDc)
+            if doSkip:
+                event.Skip(); return;
+        else:
+            mapPoint = self.canvasBackend.xlateEventPoint(event, self)
+            if not self.canvasModel.dispatchMouseEvent(                     \
+                    tool, event, mapPoint, event.Dragging(),                \
+                    event.LeftIsDown(), event.RightIsDown(), eventDc):
+                return
+        if self.canvasModel.canvasDirty:
+            self.parentFrame.onCanvasUpdate(cellPos=self.canvasModel.brushPos,  \
+                undoLevel=self.canvasModel.canvasJournal.patchesUndoLevel)
+        if eventType == wx.wxEVT_MOTION:
+            self.parentFrame.onCanvasUpdate(cellPos=mapPoint)
     # }}}
 
+    # {{{ drawPatch(self, eventDc, patch): draw patch committed or previewed by canvasModel
+    def drawPatch(self, eventDc, patch):
+        self.canvasBackend.drawPatch(eventDc, patch)
+    # }}}
+    # {{{ onModelResize(self, eventDc, newCanvasSize): resize backend and window after canvasModel was resized, drawing only newly visible cells
+    def onModelResize(self, eventDc, newCanvasSize):
+        self.canvasBackend.endDamage(eventDc, self)
+        self.SetVirtualSize([a*b for a,b in zip(newCanvasSize, self.canvasBackend.cellSize)])
+        self.canvasBackend.resize(newCanvasSize, self.canvasBackend.cellSize)
+        self.canvasBackend.updateViewport(self.canvasModel.canvasMap, self._getVisibleRect())
+        self.Refresh(False)
+        wx.SafeYield()
+        self.parentFrame.onCanvasUpdate(size=newCanvasSize,                 \
+            undoLevel=self.canvasModel.canvasJournal.patchesUndoLevel)
+        self.canvasBackend.beginDamage()
+    # }}}
     # {{{ onPanelClose(self, event): XXX
     def onPanelClose(self, event):
         self.Destroy()
@@ -80,130 +108,77 @@ class MiRCARTCanvas(wx.Panel):
     # }}}
     # {{{ onPanelInput(self, event): XXX
     def onPanelInput(self, event):
-        eventDc = self.canvasBackend.getDeviceContext(self)
-        eventType = event.GetEventType()
-        self._canvasDirty = self._canvasDirtyCursor = False
-        tool = self.canvasInterface.canvasTool
-        if eventType == wx.wxEVT_CHAR:
-            mapPoint = self.brushPos
-            doSkip = tool.onKeyboardEvent(                                  \
-                event, mapPoint, self.brushColours, self.brushSize,         \
-                chr(event.GetUnicodeKey()), self._dispatchPatch, eventDc)
-            if doSkip:
-                event.Skip(); return;
-        else:
-            mapPoint = self.canvasBackend.xlateEventPoint(event, eventDc)
-            if mapPoint[0] >= self.canvasSize[0]                            \
-            or mapPoint[1] >= self.canvasSize[1]:
-                return
-            self.brushPos = mapPoint
-            tool.onMouseEvent(                                              \
-                event, mapPoint, self.brushColours, self.brushSize,         \
-                event.Dragging(), event.LeftIsDown(), event.RightIsDown(),  \
-                self._dispatchPatch, eventDc)
-        if self._canvasDirty:
-            self.parentFrame.onCanvasUpdate(cellPos=self.brushPos,          \
-                undoLevel=self.canvasJournal.patchesUndoLevel)
-        if eventType == wx.wxEVT_MOTION:
-            self.parentFrame.onCanvasUpdate(cellPos=mapPoint)
+        eventDc = self.canvasBackend.beginDamage()
+        self._onPanelInput(event, eventDc)
+        self.canvasBackend.endDamage(eventDc, self)
     # }}}
     # {{{ onPanelLeaveWindow(self, event): XXX
     def onPanelLeaveWindow(self, event):
-        eventDc = self.canvasBackend.getDeviceContext(self)
-        self.canvasBackend.drawCursorMaskWithJournal(  \
-            self.canvasJournal, eventDc)
+        eventDc = self.canvasBackend.beginDamage()
+        self.canvasModel.restoreCursor(eventDc)
+        self.canvasBackend.endDamage(eventDc, self)
     # }}}
     # {{{ onPanelPaint(self, event): XXX
     def onPanelPaint(self, event):
+        self.canvasBackend.updateViewport(self.canvasModel.canvasMap, self._getVisibleRect())
         self.canvasBackend.onPanelPaintEvent(self, event)
     # }}}
+    # {{{ onStoreRows(self, inRows): append rows parsed by canvasImportStore and display them
+    def onStoreRows(self, inRows):
+        self.canvasModel.appendRows(inRows)
+        self._onModelReset(undoLevel=-1, redraw=False)
+    # }}}
     # {{{ onStoreUpdate(self, newCanvasSize, newCanvas=None): XXX
     def onStoreUpdate(self, newCanvasSize, newCanvas=None):
-        self.resize(newCanvasSize=newCanvasSize)
-        eventDc = self.canvasBackend.getDeviceContext(self)
-        for numRow in range(self.canvasSize[1]):
-            for numCol in range(self.canvasSize[0]):
-                if  newCanvas != None                   \
-                and numRow < len(newCanvas)             \
-                and numCol < len(newCanvas[numRow]):
-                    self._commitPatch([                 \
-                        numCol, numRow, *newCanvas[numRow][numCol]])
-                self.canvasBackend.drawPatch(eventDc,   \
-                    [numCol, numRow,                    \
-                    *self.canvasMap[numRow][numCol]])
-        wx.SafeYield()
+        self.canvasModel.reset(newCanvasSize, newCanvas)
+        self._onModelReset(undoLevel=-1)
     # }}}
-    # {{{ resize(self, newCanvasSize): XXX
-    def resize(self, newCanvasSize):
-        if newCanvasSize != self.canvasSize:
-            if self.canvasMap == None:
-                self.canvasMap = []; oldCanvasSize = [0, 0];
-            else:
-                oldCanvasSize = self.canvasSize
-            deltaCanvasSize = [b-a for a,b in zip(oldCanvasSize, newCanvasSize)]
-
-            newWinSize = [a*b for a,b in zip(newCanvasSize, self.canvasBackend.cellSize)]
-            self.SetMinSize(newWinSize)
-            self.SetSize(wx.DefaultCoord, wx.DefaultCoord, *newWinSize)
-            curWindow = self
-            while curWindow != None:
-                curWindow.Layout()
-                curWindow = curWindow.GetParent()
-
-            self.canvasBackend.resize(newCanvasSize, self.canvasBackend.cellSize)
-            eventDc = self.canvasBackend.getDeviceContext(self)
-            self.canvasJournal.resetCursor(); self.canvasJournal.resetUndo();
-
-            if deltaCanvasSize[0] < 0:
-                for numRow in range(oldCanvasSize[1]):
-                    del self.canvasMap[numRow][-1:(deltaCanvasSize[0]-1):-1]
-            else:
-                for numRow in range(oldCanvasSize[1]):
-                    self.canvasMap[numRow].extend(              \
-                            [[1, 1, 0, " "]] * deltaCanvasSize[0])
-                    for numNewCol in range(oldCanvasSize[0], newCanvasSize[0]):
-                        self.canvasBackend.drawPatch(           \
-                            eventDc, [numNewCol, numRow,        \
-                            *self.canvasMap[numRow][-1]])
-            if deltaCanvasSize[1] < 0:
-                del self.canvasMap[-1:(deltaCanvasSize[1]-1):-1]
-            else:
-                for numNewRow in range(oldCanvasSize[1], newCanvasSize[1]):
-                    self.canvasMap.extend(                      \
-                                [[[1, 1, 0, " "]] * newCanvasSize[0]])
-                    for numNewCol in range(newCanvasSize[0]):
-                        self.canvasBackend.drawPatch(           \
-                            eventDc, [numNewCol, numNewRow,     \
-                            *self.canvasMap[-1][-1]])
-
-            self.canvasSize = newCanvasSize
-            wx.SafeYield()
-            self.parentFrame.onCanvasUpdate(size=newCanvasSize, undoLevel=-1)
+    # {{{ redo(self): XXX
+    def redo(self):
+        eventDc = self.canvasBackend.beginDamage()
+        self.canvasModel.redo(eventDc)
+        self.canvasBackend.endDamage(eventDc, self)
+        self.parentFrame.onCanvasUpdate(undoLevel=self.canvasModel.canvasJournal.patchesUndoLevel)
     # }}}
-
-    # {{{ __del__(self): destructor method
-    def __del__(self):
-        if self.canvasMap != None:
-            self.canvasMap.clear(); self.canvasMap = None;
+    # {{{ restoreLog(self, pathName): restore canvas and undo history of pathName from its write-ahead log; returns False if missing or stale
+    def restoreLog(self, pathName):
+        if self.canvasModel.restoreLog(pathName):
+            self._onModelReset(undoLevel=self.canvasModel.canvasJournal.patchesUndoLevel)
+            return True
+        else:
+            return False
+    # }}}
+    # {{{ resize(self, newCanvasSize, commitUndo=True): resize canvas, recording cropped cells in the journal
+    def resize(self, newCanvasSize, commitUndo=True):
+        eventDc = self.canvasBackend.beginDamage()
+        self.canvasModel.resize(newCanvasSize, commitUndo, eventDc)
+        self.canvasBackend.endDamage(eventDc, self)
+    # }}}
+    # {{{ undo(self): XXX
+    def undo(self):
+        eventDc = self.canvasBackend.beginDamage()
+        self.canvasModel.undo(eventDc)
+        self.canvasBackend.endDamage(eventDc, self)
+        self.parentFrame.onCanvasUpdate(undoLevel=self.canvasModel.canvasJournal.patchesUndoLevel)
     # }}}
 
     #
-    # __init__(self, parent, parentFrame, defaultCanvasPos, defaultCanvasSize, defaultCellSize): initialisation method
-    def __init__(self, parent, parentFrame, defaultCanvasPos, defaultCanvasSize, defaultCellSize):
+    # __init__(self, parent, parentFrame, defaultCanvasPos, defaultCanvasSize, defaultCellSize, logEnabled=False, cacheEnabled=False): initialisation method
+    def __init__(self, parent, parentFrame, defaultCanvasPos, defaultCanvasSize, defaultCellSize, logEnabled=False, cacheEnabled=False):
         super().__init__(parent, pos=defaultCanvasPos,      \
             size=[w*h for w,h in zip(defaultCanvasSize, defaultCellSize)])
+        self.SetScrollRate(*defaultCellSize)
 
         self.parentFrame = parentFrame
-        self.canvasMap = None
-        self.canvasPos = defaultCanvasPos; self.canvasSize = defaultCanvasSize;
+        self.canvasPos = defaultCanvasPos
         self.defaultCanvasPos = defaultCanvasPos; self.defaultCanvasSize = defaultCanvasSize;
-        self.brushColours = [4, 1]; self.brushPos = [0, 0]; self.brushSize = [1, 1];
-        self.parentFrame.onCanvasUpdate(                    \
-            brushSize=self.brushSize, colours=self.brushColours)
         self.canvasBackend = MiRCARTCanvasBackend(defaultCanvasSize, defaultCellSize)
-        self.canvasJournal = MiRCARTCanvasJournal()
+        self.canvasModel = MiRCARTCanvasModel(defaultCanvasSize, canvasView=self, logEnabled=logEnabled)
+        self.parentFrame.onCanvasUpdate(                    \
+            brushSize=self.canvasModel.brushSize, colours=self.canvasModel.brushColours)
         self.canvasExportStore = MiRCARTCanvasExportStore(parentCanvas=self)
-        self.canvasImportStore = MiRCARTCanvasImportStore(parentCanvas=self)
+        self.canvasImportStore = MiRCARTCanvasImportStore(parentCanvas=self,        \
+            canvasCache=MiRCARTCanvasCache() if cacheEnabled else None)
         self.canvasInterface = MiRCARTCanvasInterface(self, parentFrame)
 
         # Bind event handlers
@@ -23,38 +23,36 @@
 #
 
 from MiRCARTColours import MiRCARTColours
-import wx
+from collections import OrderedDict
+import time, wx
 
 class MiRCARTCanvasBackend():
     """XXX"""
-    _font = _brushes = _pens = None
-    _lastBrush = _lastPen = None
-    canvasBitmap = cellSize = None
+    _clipRect = _damageCells = _font = _fontKey = _brushes = _pens = None
+    _lastBrush = _lastDc = _lastPen = None
+    canvasSize = cellSize = lastRenderTime = None
+    glyphCache = glyphCacheHits = glyphCacheMisses = glyphCacheSize = None
+    tiles = tileMemoryBudget = tileSize = None
+    viewMargin = viewRect = None
 
-    # {{{ _drawBrushPatch(self, eventDc, patch): XXX
-    def _drawBrushPatch(self, eventDc, patch):
+    # {{{ _dropTiles(self, dropFn): destroy and forget tiles for whose (tileX, tileY) dropFn returns True
+    def _dropTiles(self, dropFn):
+        for tileKey in [k for k in self.tiles if dropFn(*k)]:
+            self.tiles.pop(tileKey).Destroy()
+    # }}}
+    # {{{ _drawBrushPatch(self, eventDc, patch, numCols=1): draw numCols blank cells starting at patch w/ single rectangle
+    def _drawBrushPatch(self, eventDc, patch, numCols=1):
         absPoint = self._xlatePoint(patch)
         brushFg = self._brushes[patch[3]]
         brushBg = self._brushes[patch[2]]
         pen = self._pens[patch[3]]
         self._setBrushDc(brushBg, brushFg, eventDc, pen)
-        eventDc.DrawRectangle(*absPoint, *self.cellSize)
+        eventDc.DrawRectangle(*absPoint, self.cellSize[0] * numCols, self.cellSize[1])
     # }}}
     # {{{ _drawCharPatch(self, eventDc, patch): XXX
     def _drawCharPatch(self, eventDc, patch):
         absPoint = self._xlatePoint(patch)
-        brushFg = self._brushes[patch[2]]
-        brushBg = self._brushes[patch[3]]
-        pen = self._pens[patch[3]]
-        fontBitmap = wx.Bitmap(*self.cellSize)
-        fontDc = wx.MemoryDC(); fontDc.SelectObject(fontBitmap);
-        fontDc.SetTextForeground(wx.Colour(MiRCARTColours[patch[2]][0:4]))
-        fontDc.SetTextBackground(wx.Colour(MiRCARTColours[patch[3]][0:4]))
-        fontDc.SetBrush(brushBg); fontDc.SetBackground(brushBg); fontDc.SetPen(pen);
-        fontDc.SetFont(self._font)
-        fontDc.DrawRectangle(0, 0, *self.cellSize)
-        fontDc.DrawText(patch[5], 0, 0)
-        eventDc.Blit(*absPoint, *self.cellSize, fontDc, 0, 0)
+        eventDc.DrawBitmap(self._getGlyphBitmap(patch), *absPoint)
     # }}}
     # {{{ _finiBrushesAndPens(self): XXX
     def _finiBrushesAndPens(self):
@@ -64,7 +62,60 @@ class MiRCARTCanvasBackend():
         for pen in self._pens or []:
             pen.Destroy()
         self._pens = None
-        self._lastBrushBg = self._lastBrushFg = self._lastPen = None;
+        self._lastBrushBg = self._lastBrushFg = self._lastDc = self._lastPen = None;
+    # }}}
+    # {{{ _finiGlyphCache(self): XXX
+    def _finiGlyphCache(self):
+        for glyphBitmap in (self.glyphCache or {}).values():
+            glyphBitmap.Destroy()
+        self.glyphCache = OrderedDict()
+    # }}}
+    # {{{ _getGlyphBitmap(self, patch): return pre-rendered bitmap of single character cell, rendering it on cache miss
+    def _getGlyphBitmap(self, patch):
+        glyphKey = (patch[5], patch[2], patch[3], patch[4], self.cellSize, self._fontKey)
+        glyphBitmap = self.glyphCache.get(glyphKey)
+        if glyphBitmap != None:
+            self.glyphCache.move_to_end(glyphKey)
+            self.glyphCacheHits += 1
+        else:
+            self.glyphCacheMisses += 1
+            brushBg = self._brushes[patch[3]]
+            pen = self._pens[patch[3]]
+            glyphBitmap = wx.Bitmap(*self.cellSize)
+            fontDc = wx.MemoryDC(); fontDc.SelectObject(glyphBitmap);
+            fontDc.SetTextForeground(wx.Colour(MiRCARTColours[patch[2]][0:4]))
+            fontDc.SetTextBackground(wx.Colour(MiRCARTColours[patch[3]][0:4]))
+            fontDc.SetBrush(brushBg); fontDc.SetBackground(brushBg); fontDc.SetPen(pen);
+            fontDc.SetFont(self._font)
+            fontDc.DrawRectangle(0, 0, *self.cellSize)
+            fontDc.DrawText(patch[5], 0, 0)
+            fontDc.SelectObject(wx.NullBitmap)
+            self.glyphCache[glyphKey] = glyphBitmap
+            if len(self.glyphCache) > self.glyphCacheSize:
+                self.glyphCache.popitem(last=False)[1].Destroy()
+        return glyphBitmap
+    # }}}
+    # {{{ _getTileDc(self, eventDc, tileKey): return memory device context drawing into single tile, opening it on first use within eventDc
+    def _getTileDc(self, eventDc, tileKey):
+        tileDc = eventDc.get(tileKey)
+        if tileDc == None:
+            tileDc = wx.MemoryDC(); tileDc.SelectObject(self.tiles[tileKey]);
+            eventDc[tileKey] = tileDc
+        return tileDc
+    # }}}
+    # {{{ _getTileKeys(self, cellRect): return keys of all tiles intersecting [x, y, w, h] cell rectangle
+    def _getTileKeys(self, cellRect):
+        return [(tileX, tileY)                                                                                      \
+                for tileY in range(cellRect[1] // self.tileSize[1], -(-(cellRect[1] + cellRect[3]) // self.tileSize[1]))  \
+                for tileX in range(cellRect[0] // self.tileSize[0], -(-(cellRect[0] + cellRect[2]) // self.tileSize[0]))]
+    # }}}
+    # {{{ _getTileMemoryUsage(self): XXX
+    def _getTileMemoryUsage(self):
+        return len(self.tiles) * self.tileSize[0] * self.cellSize[0] * self.tileSize[1] * self.cellSize[1] * 4
+    # }}}
+    # {{{ _getTileRect(self, tileKey): XXX
+    def _getTileRect(self, tileKey):
+        return [tileKey[0] * self.tileSize[0], tileKey[1] * self.tileSize[1], *self.tileSize]
     # }}}
     # {{{ _initBrushesAndPens(self): XXX
     def _initBrushesAndPens(self):
@@ -75,10 +126,53 @@ class MiRCARTCanvasBackend():
                 wx.Colour(MiRCARTColours[mircColour][0:4]), wx.BRUSHSTYLE_SOLID)
             self._pens[mircColour] = wx.Pen(         \
                 wx.Colour(MiRCARTColours[mircColour][0:4]), 1)
-        self._lastBrushBg = self._lastBrushFg = self._lastPen = None;
+        self._lastBrushBg = self._lastBrushFg = self._lastDc = self._lastPen = None;
+    # }}}
+    # {{{ _mergeDamageRects(self, damageCells): merge damaged cells into [x, y, w, h] cell rectangles
+    def _mergeDamageRects(self, damageCells):
+        damageRows = {}
+        for cellX, cellY in damageCells:
+            damageRows.setdefault(cellY, []).append(cellX)
+        damageRects = []; openRects = {};
+        for cellY in sorted(damageRows):
+            rowRuns = []
+            for cellX in sorted(damageRows[cellY]):
+                if len(rowRuns) and rowRuns[-1][1] == (cellX - 1):
+                    rowRuns[-1][1] = cellX
+                else:
+                    rowRuns.append([cellX, cellX])
+            newOpenRects = {}
+            for runX0, runX1 in rowRuns:
+                rect = openRects.pop((runX0, runX1), None)
+                if rect != None and (rect[1] + rect[3]) == cellY:
+                    rect[3] += 1
+                else:
+                    rect = [runX0, cellY, (runX1 - runX0) + 1, 1]
+                    damageRects.append(rect)
+                newOpenRects[(runX0, runX1)] = rect
+            openRects = newOpenRects
+        if len(damageRects) > 1:
+            boundRect = [min(r[0] for r in damageRects), min(r[1] for r in damageRects),    \
+                         max(r[0] + r[2] for r in damageRects), max(r[1] + r[3] for r in damageRects)]
+            boundRect[2] -= boundRect[0]; boundRect[3] -= boundRect[1];
+            if (boundRect[2] * boundRect[3]) <= (2 * len(damageCells)):
+                damageRects = [boundRect]
+        return damageRects
+    # }}}
+    # {{{ _renderTile(self, canvasMap, tileKey): allocate and render single tile
+    def _renderTile(self, canvasMap, tileKey):
+        tileBitmap = wx.Bitmap(*[a*b for a,b in zip(self.tileSize, self.cellSize)])
+        tileDc = wx.MemoryDC(); tileDc.SelectObject(tileBitmap);
+        self._clipRect = self._getTileRect(tileKey)
+        self.drawCanvas(tileDc, canvasMap)
+        tileDc.SelectObject(wx.NullBitmap)
+        self.tiles[tileKey] = tileBitmap
     # }}}
     # {{{ _setBrushDc(self, brushBg, brushFg, dc, pen): XXX
     def _setBrushDc(self, brushBg, brushFg, dc, pen):
+        if self._lastDc != dc:
+            self._lastBrushBg = self._lastBrushFg = self._lastPen = None;
+            self._lastDc = dc
         if self._lastBrushBg != brushBg:
             dc.SetBackground(brushBg)
             self._lastBrushBg = brushBg
@@ -89,86 +183,173 @@ class MiRCARTCanvasBackend():
             dc.SetPen(pen)
             self._lastPen = pen
     # }}}
-    # {{{ _xlatePoint(self, patch): XXX
+    # {{{ _xlatePoint(self, patch): translate canvas cell coordinates into pixel coordinates relative to _clipRect
     def _xlatePoint(self, patch):
-        return [a*b for a,b in zip(patch[0:2], self.cellSize)]
+        return [(a-b)*c for a,b,c in zip(patch[0:2], self._clipRect, self.cellSize)]
     # }}}
 
-    # {{{ drawPatch(self, eventDc, patch): XXX
+    # {{{ beginDamage(self): return device context drawing into tiles only and start tracking damaged cells
+    def beginDamage(self):
+        self._damageCells = set()
+        return {}
+    # }}}
+    # {{{ drawCanvas(self, eventDc, canvasMap, numRow=0, numRows=None, numCol=0, numCols=None): draw band of rows (and columns) clipped to _clipRect, merging runs of blank cells w/ identical background; returns render time in seconds
+    def drawCanvas(self, eventDc, canvasMap, numRow=0, numRows=None, numCol=0, numCols=None):
+        timeStart = time.perf_counter()
+        rowEnd = min(canvasMap.mapSize[1], self.canvasSize[1], self._clipRect[1] + self._clipRect[3])
+        if numRows != None:
+            rowEnd = min(rowEnd, numRow + numRows)
+        colEnd = min(canvasMap.mapSize[0], self.canvasSize[0], self._clipRect[0] + self._clipRect[2])
+        if numCols != None:
+            colEnd = min(colEnd, numCol + numCols)
+        numCol = max(numCol, self._clipRect[0]); numCols = colEnd - numCol;
+        for curRow in range(max(numRow, self._clipRect[1]), rowEnd):
+            if numCols <= 0:
+                break
+            runPatch = None; runCols = 0;
+            for curCol, cell in enumerate(canvasMap.getRowCells(curRow, numCol, numCols), numCol):
+                if cell[3] == " ":
+                    if runCols and runPatch[3] == cell[1]:
+                        runCols += 1; continue;
+                    elif runCols:
+                        self._drawBrushPatch(eventDc, runPatch, runCols)
+                    runPatch = [curCol, curRow, *cell]; runCols = 1;
+                else:
+                    if runCols:
+                        self._drawBrushPatch(eventDc, runPatch, runCols); runCols = 0;
+                    self._drawCharPatch(eventDc, [curCol, curRow, *cell])
+            if runCols:
+                self._drawBrushPatch(eventDc, runPatch, runCols)
+        self.lastRenderTime = time.perf_counter() - timeStart
+        return self.lastRenderTime
+    # }}}
+    # {{{ drawPatch(self, eventDc, patch): draw single patch into its tile if allocated, returning False if outside of canvas
     def drawPatch(self, eventDc, patch):
         if  patch[0] < self.canvasSize[0]    \
         and patch[0] >= 0                    \
         and patch[1] < self.canvasSize[1]    \
         and patch[1] >= 0:
-            if patch[5] == " ":
-                self._drawBrushPatch(eventDc, patch)
-            else:
-                self._drawCharPatch(eventDc, patch)
+            tileKey = (patch[0] // self.tileSize[0], patch[1] // self.tileSize[1])
+            if tileKey in self.tiles:
+                if self._damageCells != None:
+                    self._damageCells.add((patch[0], patch[1]))
+                tileDc = self._getTileDc(eventDc, tileKey)
+                self._clipRect = self._getTileRect(tileKey)
+                if patch[5] == " ":
+                    self._drawBrushPatch(tileDc, patch)
+                else:
+                    self._drawCharPatch(tileDc, patch)
             return True
         else:
             return False
     # }}}
-    # {{{ drawCursorMaskWithJournal(self, canvasJournal, eventDc): XXX
-    def drawCursorMaskWithJournal(self, canvasJournal, eventDc):
-        for patch in canvasJournal.popCursor():
-            self.drawPatch(eventDc, patch)
+    # {{{ endDamage(self, eventDc, parentWindow): stop tracking damaged cells and repaint merged damaged rectangles at once
+    def endDamage(self, eventDc, parentWindow):
+        for tileDc in eventDc.values():
+            tileDc.SelectObject(wx.NullBitmap)
+        eventDc.clear()
+        damageRects = self._mergeDamageRects(self._damageCells)
+        self._damageCells = None
+        if len(damageRects):
+            for damageRect in damageRects:
+                absRect = [a*b for a,b in zip(damageRect, self.cellSize * 2)]
+                absRect[0:2] = parentWindow.CalcScrolledPosition(*absRect[0:2])
+                parentWindow.RefreshRect(wx.Rect(*absRect), False)
+            parentWindow.Update()
+        return len(damageRects)
     # }}}
-    # {{{ getDeviceContext(self, parentWindow): XXX
-    def getDeviceContext(self, parentWindow):
-        eventDc = wx.BufferedDC(    \
-            wx.ClientDC(parentWindow), self.canvasBitmap)
-        self._lastBrushBg = self._lastBrushFg = self._lastPen = None;
-        return eventDc
+    # {{{ getCanvasBitmap(self, canvasMap): render entire canvas into new bitmap, e.g. for exporting
+    def getCanvasBitmap(self, canvasMap):
+        canvasBitmap = wx.Bitmap(*[a*b for a,b in zip(self.canvasSize, self.cellSize)])
+        canvasDc = wx.MemoryDC(); canvasDc.SelectObject(canvasBitmap);
+        self._clipRect = [0, 0, *self.canvasSize]
+        self.drawCanvas(canvasDc, canvasMap)
+        canvasDc.SelectObject(wx.NullBitmap)
+        return canvasBitmap
     # }}}
-    # {{{ onPanelPaintEvent(self, panelWindow, panelEvent): XXX
+    # {{{ onPanelPaintEvent(self, panelWindow, panelEvent): blit tiles intersecting viewRect
     def onPanelPaintEvent(self, panelWindow, panelEvent):
-        if self.canvasBitmap != None:
-            eventDc = wx.BufferedPaintDC(panelWindow, self.canvasBitmap)
+        eventDc = wx.PaintDC(panelWindow); panelWindow.DoPrepareDC(eventDc);
+        tileDc = wx.MemoryDC()
+        for tileKey in self._getTileKeys(self.viewRect):
+            if tileKey in self.tiles:
+                self.tiles.move_to_end(tileKey)
+                tileRect = self._getTileRect(tileKey)
+                tileRect[2] = min(tileRect[2], self.canvasSize[0] - tileRect[0])
+                tileRect[3] = min(tileRect[3], self.canvasSize[1] - tileRect[1])
+                tileDc.SelectObject(self.tiles[tileKey])
+                eventDc.Blit(*[a*b for a,b in zip(tileRect, self.cellSize * 2)], tileDc, 0, 0)
+        tileDc.SelectObject(wx.NullBitmap)
     # }}}
     # {{{ reset(self, canvasSize, cellSize):
     def reset(self, canvasSize, cellSize):
         self.resize(canvasSize, cellSize)
     # }}}
-    # {{{ resize(self, canvasSize, cellSize):
+    # {{{ resize(self, canvasSize, cellSize): resize canvas, dropping tiles beyond or straddling the old and new edges
     def resize(self, canvasSize, cellSize):
-        winSize = [a*b for a,b in zip(canvasSize, cellSize)]
-        if self.canvasBitmap == None:
-            self.canvasBitmap = wx.Bitmap(winSize)
+        oldCanvasSize = self.canvasSize or [0, 0]
+        self.canvasSize = canvasSize
+        if self.cellSize != tuple(cellSize):
+            self.cellSize = tuple(cellSize)
+            self._font = wx.Font(       \
+                8,                      \
+                wx.FONTFAMILY_TELETYPE, \
+                wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL)
+            self._fontKey = self._font.GetNativeFontInfoDesc()
+            self._finiGlyphCache()
+            self._dropTiles(lambda tileX, tileY: True)
         else:
-            oldDc = wx.MemoryDC()
-            oldDc.SelectObject(self.canvasBitmap)
-            newDc = wx.MemoryDC()
-            newBitmap = wx.Bitmap(winSize)
-            newDc.SelectObject(newBitmap)
-            newDc.Blit(0, 0, *self.canvasBitmap.GetSize(), oldDc, 0, 0)
-            oldDc.SelectObject(wx.NullBitmap)
-            self.canvasBitmap.Destroy(); self.canvasBitmap = newBitmap;
-        self.canvasSize = canvasSize; self.cellSize = cellSize;
-        self._font = wx.Font(       \
-            8,                      \
-            wx.FONTFAMILY_TELETYPE, \
-            wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL)
-    # }}}
-    # {{{ xlateEventPoint(self, event, eventDc): XXX
-    def xlateEventPoint(self, event, eventDc):
-        eventPoint = event.GetLogicalPosition(eventDc)
-        rectX = eventPoint.x - (eventPoint.x % self.cellSize[0])
-        rectY = eventPoint.y - (eventPoint.y % self.cellSize[1])
-        mapX = int(rectX / self.cellSize[0] if rectX else 0)
-        mapY = int(rectY / self.cellSize[1] if rectY else 0)
-        return (mapX, mapY)
+            edgeTiles = [[min(a, b) // c, -(-max(a, b) // c) if a != b else 0]    \
+                         for a,b,c in zip(oldCanvasSize, canvasSize, self.tileSize)]
+            self._dropTiles(lambda tileX, tileY:                                    \
+                (tileX >= edgeTiles[0][0] and tileX < edgeTiles[0][1])              \
+                or (tileY >= edgeTiles[1][0] and tileY < edgeTiles[1][1])           \
+                or (tileX * self.tileSize[0]) >= canvasSize[0]                      \
+                or (tileY * self.tileSize[1]) >= canvasSize[1])
+    # }}}
+    # {{{ updateViewport(self, canvasMap, visibleRect, redraw=False): render missing tiles of visibleRect plus viewMargin and evict invisible tiles beyond tileMemoryBudget; returns True if any tile was rendered
+    def updateViewport(self, canvasMap, visibleRect, redraw=False):
+        if redraw:
+            self._dropTiles(lambda tileX, tileY: True)
+        self.viewRect = list(visibleRect)
+        marginRect = [max(visibleRect[0] - self.viewMargin, 0), max(visibleRect[1] - self.viewMargin, 0)]
+        marginRect += [min(visibleRect[0] + visibleRect[2] + self.viewMargin, self.canvasSize[0]) - marginRect[0],  \
+                       min(visibleRect[1] + visibleRect[3] + self.viewMargin, self.canvasSize[1]) - marginRect[1]]
+        timeStart = time.perf_counter(); viewTiles = self._getTileKeys(marginRect);
+        missingTiles = [k for k in viewTiles if k not in self.tiles]
+        for tileKey in missingTiles:
+            self._renderTile(canvasMap, tileKey)
+        for tileKey in viewTiles:
+            self.tiles.move_to_end(tileKey)
+        viewTiles = set(viewTiles)
+        while self._getTileMemoryUsage() > self.tileMemoryBudget:
+            tileKey = next(iter(self.tiles))
+            if tileKey in viewTiles:
+                break
+            self.tiles.pop(tileKey).Destroy()
+        if len(missingTiles):
+            self.lastRenderTime = time.perf_counter() - timeStart
+        return len(missingTiles) > 0
+    # }}}
+    # {{{ xlateEventPoint(self, event, parentWindow): translate mouse event position into canvas cell coordinates
+    def xlateEventPoint(self, event, parentWindow):
+        eventPoint = parentWindow.CalcUnscrolledPosition(event.GetPosition())
+        return (eventPoint.x // self.cellSize[0], eventPoint.y // self.cellSize[1])
     # }}}
 
     # {{{ __del__(self): destructor method
     def __del__(self):
-        if self.canvasBitmap != None:
-            self.canvasBitmap.Destroy(); self.canvasBitmap = None;
-        self._finiBrushesAndPens()
+        if self.tiles != None:
+            self._dropTiles(lambda tileX, tileY: True)
+        self._finiBrushesAndPens(); self._finiGlyphCache();
     # }}}
 
     #
-    # __init__(self, canvasSize, cellSize): initialisation method
-    def __init__(self, canvasSize, cellSize):
+    # __init__(self, canvasSize, cellSize, glyphCacheSize=4096, tileSize=(32, 16), tileMemoryBudget=(64 * 1024 * 1024), viewMargin=8): initialisation method
+    def __init__(self, canvasSize, cellSize, glyphCacheSize=4096, tileSize=(32, 16), tileMemoryBudget=(64 * 1024 * 1024), viewMargin=8):
+        self.glyphCacheHits = self.glyphCacheMisses = 0; self.glyphCacheSize = glyphCacheSize;
+        self.tiles = OrderedDict(); self.tileMemoryBudget = tileMemoryBudget; self.tileSize = tuple(tileSize);
+        self.viewMargin = viewMargin; self.viewRect = [0, 0, 0, 0];
         self._initBrushesAndPens()
         self.reset(canvasSize, cellSize)
 
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+#
+# MiRCARTCanvasCache.py -- content-hash keyed on-disk cache of parsed canvases
+# Copyright (c) 2018 Lucio Andrés Illanes Albornoz <lucio@lucioillanes.de>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from MiRCARTCanvasMap import MiRCARTCanvasMap
+from array import array
+import hashlib, os, struct, sys, tempfile, time
+
+class MiRCARTCanvasCache():
+    """On-disk cache of parsed canvases keyed by text file content hash (or size and modification time) w/ LRU eviction"""
+    cacheDirName = cacheMaxSize = useHash = None
+
+    #
+    # Cache entry file suffix, header, and version; bump CACHE_VERSION whenever parsing output changes
+    CACHE_SUFFIX = ".bin"
+    CACHE_HEADER = struct.Struct("<8sIII"); CACHE_MAGIC = b"MiRCARTC";
+    CACHE_VERSION = 1
+
+    # {{{ _getEntryPathName(self, pathName, cacheSalt, cacheKey): return pathname of cache entry for text file pathName, hashing it unless cacheKey is given
+    def _getEntryPathName(self, pathName, cacheSalt, cacheKey):
+        if cacheKey == None:
+            cacheKey = self.getKey(pathName, cacheSalt)
+        return os.path.join(self.cacheDirName, cacheKey + self.CACHE_SUFFIX)
+    # }}}
+    # {{{ _writeEntry(self, entryFile, mapSize, rowLens, planeFiles): write header and planes of row lengths rowLens padded to mapSize[0] columns to entry file
+    def _writeEntry(self, entryFile, mapSize, rowLens, planeFiles):
+        entryFile.write(self.CACHE_HEADER.pack(self.CACHE_MAGIC, self.CACHE_VERSION, *mapSize))
+        for planeFile, planeType, planeDefault in zip(planeFiles, ("B", "B", "B", "I"),        \
+                (*MiRCARTCanvasMap.cellDefault[0:3], ord(MiRCARTCanvasMap.cellDefault[3]))):
+            planeFile.seek(0); planePad = array(planeType, [planeDefault]);
+            for rowLen in rowLens:
+                entryFile.write(planeFile.read(rowLen * planePad.itemsize))
+                entryFile.write((planePad * (mapSize[0] - rowLen)).tobytes())
+    # }}}
+
+    # {{{ clear(self): remove all cache entries
+    def clear(self):
+        for entryPathName, entrySize, entryTime in self.getEntries():
+            os.remove(entryPathName)
+    # }}}
+    # {{{ evict(self, maxSize=None): remove least recently used cache entries until total size is at most maxSize (or cacheMaxSize)
+    def evict(self, maxSize=None):
+        maxSize = self.cacheMaxSize if maxSize == None else maxSize
+        cacheEntries = sorted(self.getEntries(), key=lambda entry: entry[2])
+        cacheSize = sum(entry[1] for entry in cacheEntries)
+        for entryPathName, entrySize, entryTime in cacheEntries:
+            if cacheSize <= maxSize:
+                break
+            try:
+                os.remove(entryPathName); cacheSize -= entrySize;
+            except OSError:
+                pass
+    # }}}
+    # {{{ get(self, pathName, cacheSalt="", cacheKey=None): return cached canvas map of text file pathName parsed w/ cacheSalt (or of cacheKey) or None on miss
+    def get(self, pathName, cacheSalt="", cacheKey=None):
+        try:
+            entryPathName = self._getEntryPathName(pathName, cacheSalt, cacheKey)
+            with open(entryPathName, "rb") as entryFile:
+                entryData = entryFile.read()
+            magic, version, mapWidth, mapHeight = self.CACHE_HEADER.unpack_from(entryData)
+            if magic != self.CACHE_MAGIC or version != self.CACHE_VERSION:
+                return None
+            canvasMap = MiRCARTCanvasMap(); canvasMap.mapSize = [mapWidth, mapHeight];
+            numCells = mapWidth * mapHeight; entryOffset = self.CACHE_HEADER.size;
+            for mapName, mapType in (("mapFg", "B"), ("mapBg", "B"), ("mapAttrs", "B"), ("mapChars", "I")):
+                mapArray = array(mapType)
+                mapArray.frombytes(entryData[entryOffset:entryOffset + (numCells * mapArray.itemsize)])
+                if len(mapArray) != numCells:
+                    return None
+                setattr(canvasMap, mapName, mapArray); entryOffset += numCells * mapArray.itemsize;
+            os.utime(entryPathName)
+            return canvasMap
+        except (OSError, struct.error, ValueError):
+            return None
+    # }}}
+    # {{{ getEntries(self): return list of (pathname, size, last use time) of all cache entries
+    def getEntries(self):
+        cacheEntries = []
+        try:
+            for dirEntry in os.scandir(self.cacheDirName):
+                if dirEntry.name.endswith(self.CACHE_SUFFIX) and dirEntry.is_file():
+                    entryStat = dirEntry.stat()
+                    cacheEntries.append((dirEntry.path, entryStat.st_size, entryStat.st_mtime))
+        except OSError:
+            pass
+        return cacheEntries
+    # }}}
+    # {{{ getKey(self, pathName, cacheSalt=""): return cache key of text file pathName parsed w/ cacheSalt, e.g. parser encodings, to be passed on to get(), getSize(), put(), and putBands()
+    def getKey(self, pathName, cacheSalt=""):
+        cacheHash = hashlib.blake2b(digest_size=16)
+        cacheHash.update("{}:{}:".format(self.CACHE_VERSION, cacheSalt).encode())
+        if self.useHash:
+            with open(pathName, "rb") as inFile:
+                for inBlock in iter(lambda: inFile.read(1024 * 1024), b""):
+                    cacheHash.update(inBlock)
+        else:
+            pathStat = os.stat(pathName)
+            cacheHash.update("{}:{}:{}".format(os.path.abspath(pathName), pathStat.st_size, pathStat.st_mtime_ns).encode())
+        return cacheHash.hexdigest()
+    # }}}
+    # {{{ getSize(self, pathName, cacheSalt="", cacheKey=None): return [columns, rows] of cached canvas map w/o reading its cells or None on miss
+    def getSize(self, pathName, cacheSalt="", cacheKey=None):
+        try:
+            entryPathName = self._getEntryPathName(pathName, cacheSalt, cacheKey)
+            with open(entryPathName, "rb") as entryFile:
+                entryHeader = entryFile.read(self.CACHE_HEADER.size)
+            magic, version, mapWidth, mapHeight = self.CACHE_HEADER.unpack(entryHeader)
+            if  magic != self.CACHE_MAGIC or version != self.CACHE_VERSION                                 \
+            or  os.stat(entryPathName).st_size != (self.CACHE_HEADER.size + (mapWidth * mapHeight * 7)):
+                return None
+            return [mapWidth, mapHeight]
+        except (OSError, struct.error):
+            return None
+    # }}}
+    # {{{ put(self, pathName, canvasMap, cacheSalt="", cacheKey=None): store canvas map parsed from text file pathName w/ cacheSalt (or of cacheKey) and evict entries beyond cacheMaxSize; returns False on I/O error
+    def put(self, pathName, canvasMap, cacheSalt="", cacheKey=None):
+        try:
+            entryPathName = self._getEntryPathName(pathName, cacheSalt, cacheKey)
+            os.makedirs(self.cacheDirName, exist_ok=True)
+            with open(entryPathName + ".tmp", "wb") as entryFile:
+                entryFile.write(self.CACHE_HEADER.pack(self.CACHE_MAGIC, self.CACHE_VERSION, *canvasMap.mapSize))
+                for mapArray in (canvasMap.mapFg, canvasMap.mapBg, canvasMap.mapAttrs, canvasMap.mapChars):
+                    entryFile.write(mapArray.tobytes())
+            os.replace(entryPathName + ".tmp", entryPathName)
+        except OSError:
+            return False
+        self.evict()
+        return True
+    # }}}
+    # {{{ putBands(self, pathName, inBands, cacheSalt="", cacheKey=None): pass through (first row number, list of rows) bands parsed from text file pathName, storing them band by band; the entry is only stored once inBands is exhausted
+    def putBands(self, pathName, inBands, cacheSalt="", cacheKey=None):
+        try:
+            entryPathName = self._getEntryPathName(pathName, cacheSalt, cacheKey)
+            os.makedirs(self.cacheDirName, exist_ok=True)
+            planeFiles = [tempfile.TemporaryFile(dir=self.cacheDirName) for numPlane in range(4)]
+        except OSError:
+            yield from inBands; return;
+        try:
+            mapSize = [0, 0]; rowLens = array("I");
+            for numRow, inRows in inBands:
+                if planeFiles != None:
+                    try:
+                        for inRow in inRows:
+                            for planeFile, rowPlane in zip(planeFiles, inRow):
+                                planeFile.write(rowPlane.tobytes())
+                            rowLens.append(len(inRow[0])); mapSize[0] = max(mapSize[0], len(inRow[0]));
+                    except OSError:
+                        for planeFile in planeFiles:
+                            planeFile.close()
+                        planeFiles = None
+                mapSize[1] += len(inRows)
+                yield numRow, inRows
+            if planeFiles != None:
+                try:
+                    with open(entryPathName + ".tmp", "wb") as entryFile:
+                        self._writeEntry(entryFile, mapSize, rowLens, planeFiles)
+                    os.replace(entryPathName + ".tmp", entryPathName)
+                except OSError:
+                    if os.path.exists(entryPathName + ".tmp"):
+                        os.remove(entryPathName + ".tmp")
+                    return
+                self.evict()
+        finally:
+            if planeFiles != None:
+                for planeFile in planeFiles:
+                    planeFile.close()
+    # }}}
+
+    #
+    # __init__(self, cacheDirName=None, cacheMaxSize=(256 * 1024 * 1024), useHash=True): initialisation method
+    def __init__(self, cacheDirName=None, cacheMaxSize=(256 * 1024 * 1024), useHash=True):
+        if cacheDirName == None:
+            cacheDirName = os.path.join(os.environ.get("XDG_CACHE_HOME",    \
+                os.path.join(os.path.expanduser("~"), ".cache")), "MiRCART")
+        self.cacheDirName = cacheDirName; self.cacheMaxSize = cacheMaxSize;
+        self.useHash = useHash
+
+#
+# Entry point
+def main(*argv):
+    canvasCache = MiRCARTCanvasCache(*argv[2:3])
+    if argv[1] == "clear":
+        canvasCache.clear()
+    elif argv[1] == "evict":
+        canvasCache.evict(int(argv[3]) if len(argv) > 3 else None)
+    elif argv[1] == "list":
+        for entryPathName, entrySize, entryTime in sorted(canvasCache.getEntries(), key=lambda entry: entry[2]):
+            print("{}\t{}".format(entrySize, entryPathName))
+    elif argv[1] == "stats":
+        cacheEntries = sorted(canvasCache.getEntries(), key=lambda entry: entry[2])
+        cacheSize = sum(entry[1] for entry in cacheEntries)
+        print("entries:\t{}".format(len(cacheEntries)))
+        print("size:\t\t{} of {} bytes ({:.1f}%)".format(cacheSize, canvasCache.cacheMaxSize,  \
+            100 * cacheSize / max(canvasCache.cacheMaxSize, 1)))
+        if len(cacheEntries):
+            print("largest entry:\t{} bytes".format(max(entry[1] for entry in cacheEntries)))
+            print("oldest use:\t{}".format(time.strftime("%Y/%m/%d %H:%M:%S", time.localtime(cacheEntries[0][2]))))
+            print("newest use:\t{}".format(time.strftime("%Y/%m/%d %H:%M:%S", time.localtime(cacheEntries[-1][2]))))
+    cacheEntries = canvasCache.getEntries()
+    print("{} entries, {} bytes in {}".format(len(cacheEntries),    \
+        sum(entry[1] for entry in cacheEntries), canvasCache.cacheDirName), file=sys.stderr)
+if __name__ == "__main__":
+    if ((len(sys.argv) - 1) < 1)                                    \
+    or ((len(sys.argv) - 1) > 3)                                    \
+    or (sys.argv[1] not in ("clear", "evict", "list", "stats")):
+        print("usage: {} "                                          \
+            "clear|evict|list|stats "                               \
+            "[<cache directory pathname; defaults to ~/.cache/MiRCART>] " \
+            "[<evict: maximum size in bytes>]".format(sys.argv[0]), file=sys.stderr)
+    else:
+        main(*sys.argv)
+
+# vim:expandtab foldmethod=marker sw=4 ts=4 tw=120
@@ -22,7 +22,10 @@
 # SOFTWARE.
 #
 
-import io, os, tempfile
+from MiRCARTCanvasImportStore import MiRCARTCanvasImportStore
+from MiRCARTCanvasMap import MiRCARTCanvasMap
+from MiRCARTColours import MiRCARTColours
+import io, os, sys
 
 try:
     from MiRCARTToPngFile import MiRCARTToPngFile
@@ -31,7 +34,7 @@ except ImportError:
     haveMiRCARTToPngFile = False
 
 try:
-    import base64, json, requests, urllib.request
+    import json, requests, urllib.request
     haveUrllib = True
 except ImportError:
     haveUrllib = False
@@ -40,39 +43,74 @@ class MiRCARTCanvasExportStore():
     """XXX"""
     parentCanvas = None
 
-    # {{{ _exportFileToImgur(self, apiKey, imgName, imgTitle, pathName): upload single PNG file to Imgur
-    def _exportFileToImgur(self, apiKey, imgName, imgTitle, pathName):
-        with open(pathName, "rb") as requestImage:
-            requestImageData = requestImage.read()
+    #
+    # Cell attribute flags and their toggling control codes
+    _attrCodes = (                                                      \
+        (MiRCARTCanvasImportStore._CellState.CS_BOLD,       "\x02"),    \
+        (MiRCARTCanvasImportStore._CellState.CS_ITALIC,     "\x06"),    \
+        (MiRCARTCanvasImportStore._CellState.CS_UNDERLINE,  "\x1f"))
+
+    #
+    # IRC protocol message length limit in bytes incl. source prefix and CRLF
+    ircLineMax = 512
+
+    # {{{ exportBinaryFile(self, canvasMap, canvasSize, outPathName): write binary canvas file, replacing outPathName atomically as it may be memory-mapped
+    def exportBinaryFile(self, canvasMap, canvasSize, outPathName):
+        if list(canvasMap.mapSize) != list(canvasSize):
+            canvasMap = canvasMap.copy(); canvasMap.resize(canvasSize);
+        with open(outPathName + ".tmp", "wb") as outFile:
+            outFile.write(canvasMap.toBinary(MiRCARTColours))
+        os.replace(outPathName + ".tmp", outPathName)
+    # }}}
+    # {{{ exportBitmapToPngFile(self, canvasBitmap, outPathName, outType): XXX
+    def exportBitmapToPngFile(self, canvasBitmap, outPathName, outType):
+        return canvasBitmap.ConvertToImage().SaveFile(outPathName, outType)
+    # }}}
+    # {{{ exportBitmapToImgur(self, apiKey, canvasBitmap, imgName, imgTitle, imgType): encode bitmap into in-memory buffer and upload it to Imgur
+    def exportBitmapToImgur(self, apiKey, canvasBitmap, imgName, imgTitle, imgType):
+        imgFile = io.BytesIO()
+        canvasBitmap.ConvertToImage().SaveFile(imgFile, imgType)
+        imgFile.seek(0)
+        return self.exportFileToImgur(apiKey, imgName, imgTitle, imgFile)
+    # }}}
+    # {{{ exportFile(self, canvasMap, canvasSize, outPathName): write binary canvas or text file, depending on its suffix
+    def exportFile(self, canvasMap, canvasSize, outPathName):
+        if outPathName.endswith(canvasMap.BINARY_SUFFIX):
+            self.exportBinaryFile(canvasMap, canvasSize, outPathName)
+        else:
+            with open(outPathName, "w") as outFile:
+                self.exportTextFile(canvasMap, canvasSize, outFile)
+    # }}}
+    # {{{ exportFileToImgur(self, apiKey, imgName, imgTitle, imgFile): upload single PNG image from binary file object to Imgur as multipart/form-data, returning [200, link] or [HTTP status code, ""]
+    def exportFileToImgur(self, apiKey, imgName, imgTitle, imgFile):
         requestData = {                                     \
-            "image": base64.b64encode(requestImageData),    \
-            "key":   apiKey,                                \
             "name":  imgName,                               \
             "title": imgTitle,                              \
-            "type":  "base64"}
+            "type":  "file"}
+        requestFiles = {"image": (imgName + ".png", imgFile, "image/png")}
         requestHeaders = {"Authorization": "Client-ID " + apiKey}
         responseHttp = requests.post(                       \
             "https://api.imgur.com/3/upload.json",          \
-            data=requestData, headers=requestHeaders)
+            data=requestData, files=requestFiles, headers=requestHeaders)
         responseDict = json.loads(responseHttp.text)
         if responseHttp.status_code == 200:
                 return [200, responseDict.get("data").get("link")]
         else:
                 return [responseHttp.status_code, ""]
     # }}}
-
-    # {{{ exportBitmapToPngFile(self, canvasBitmap, outPathName, outType): XXX
-    def exportBitmapToPngFile(self, canvasBitmap, outPathName, outType):
-        return canvasBitmap.ConvertToImage().SaveFile(outPathName, outType)
-    # }}}
-    # {{{ exportBitmapToImgur(self, apiKey, canvasBitmap, imgName, imgTitle, imgType): XXX
-    def exportBitmapToImgur(self, apiKey, canvasBitmap, imgName, imgTitle, imgType):
-        tmpPathName = tempfile.mkstemp()
-        os.close(tmpPathName[0])
-        canvasBitmap.ConvertToImage().SaveFile(tmpPathName[1], imgType)
-        imgurResult = self._exportFileToImgur(apiKey, imgName, imgTitle, tmpPathName[1])
-        os.remove(tmpPathName[1])
-        return imgurResult
+    # {{{ exportIrcLines(self, canvasMap, canvasSize, lineBudget, trimTrailing=True): return [text, bytes] per row in its cheapest encoding and list of rows exceeding lineBudget bytes
+    def exportIrcLines(self, canvasMap, canvasSize, lineBudget, trimTrailing=True):
+        outLines = []; overBudgetRows = [];
+        for canvasRow in range(canvasSize[1]):
+            rowCells = canvasMap.getRow(canvasRow, 0, canvasSize[0])
+            outText = min((self.exportTextRow(rowCells, blocksAsSpaces, trimTrailing)    \
+                           for blocksAsSpaces in (False, True)), key=lambda text: len(text.encode()))
+            # Servers drop empty messages, which would shift all following rows up
+            outText = outText or " "; outBytes = len(outText.encode());
+            if outBytes > lineBudget:
+                overBudgetRows.append(canvasRow)
+            outLines.append([outText, outBytes])
+        return outLines, overBudgetRows
     # }}}
     # {{{ exportPastebin(self, apiDevKey, canvasMap, canvasSize, pasteName="", pastePrivate=0): XXX
     def exportPastebin(self, apiDevKey, canvasMap, canvasSize, pasteName="", pastePrivate=0):
@@ -105,20 +143,55 @@ class MiRCARTCanvasExportStore():
         else:
             return False
     # }}}
-    # {{{ exportTextFile(self, canvasMap, canvasSize, outFile): XXX
-    def exportTextFile(self, canvasMap, canvasSize, outFile):
+    # {{{ exportTextFile(self, canvasMap, canvasSize, outFile, blocksAsSpaces=False, trimTrailing=False): write canvas as mIRC text, one line per row
+    def exportTextFile(self, canvasMap, canvasSize, outFile, blocksAsSpaces=False, trimTrailing=False):
         for canvasRow in range(canvasSize[1]):
-            canvasLastColours = []
-            for canvasCol in range(canvasSize[0]):
-                canvasColColours = canvasMap[canvasRow][canvasCol][0]
-                canvasColText = canvasMap[canvasRow][canvasCol][2]
-                if canvasColColours != canvasLastColours:
-                    canvasLastColours = canvasColColours
-                    outFile.write("\x03" +          \
-                        str(canvasColColours[0]) +  \
-                        "," + str(canvasColColours[1]))
-                outFile.write(canvasColText)
-            outFile.write("\n")
+            outFile.write(self.exportTextRow(canvasMap.getRow(canvasRow, 0, canvasSize[0]), blocksAsSpaces, trimTrailing) + "\n")
+    # }}}
+    # {{{ exportTextRow(self, canvasRow, blocksAsSpaces=False, trimTrailing=False): return (fg, bg, attrs, codepoints) row as mIRC text w/ minimal control codes, optionally re-encoding solid blocks as spaces and dropping trailing blank cells of the default background colour
+    def exportTextRow(self, canvasRow, blocksAsSpaces=False, trimTrailing=False):
+        outParts = []; lastCell = None;
+        curFg = curBg = None; curAttrs = 0;
+        underlineFlag = MiRCARTCanvasImportStore._CellState.CS_UNDERLINE
+        canvasCells = list(zip(*canvasRow))
+        if trimTrailing:
+            while len(canvasCells)                                              \
+            and   canvasCells[-1][1] == MiRCARTCanvasMap.cellDefault[1]         \
+            and   canvasCells[-1][3] == ord(" ")                                \
+            and   not (canvasCells[-1][2] & underlineFlag):
+                del canvasCells[-1]
+        for cell in canvasCells:
+            if cell == lastCell:
+                outParts.append(outChar); continue;
+            lastCell = cell; fg, bg, attrs, outChar = cell[0], cell[1], cell[2], chr(cell[3]);
+            if  blocksAsSpaces and outChar == "█"          \
+            and not (attrs & underlineFlag):
+                bg, outChar = fg, " "
+            if outChar == " " and not (attrs & underlineFlag):
+                # Foreground colour, bold, and italic are invisible on blank cells
+                fg = curFg if bg == curBg else fg
+                attrs = curAttrs & ~underlineFlag
+            if attrs != curAttrs:
+                outParts += [attrCode for attrFlag, attrCode in self._attrCodes if (attrs ^ curAttrs) & attrFlag]
+                curAttrs = attrs
+            if bg != curBg or (fg != curFg and outChar == ","):
+                outParts.append("\x03{:d},{:{}d}".format(fg, bg, "02" if "0" <= outChar <= "9" else ""))
+                curFg, curBg = fg, bg
+            elif fg != curFg:
+                outParts.append("\x03{:{}d}".format(fg, "02" if "0" <= outChar <= "9" else ""))
+                curFg = fg
+            outParts.append(outChar)
+        return "".join(outParts)
+    # }}}
+
+    # {{{ getIrcLineBudget(self, ircTarget, ircSourceLen=64): return bytes available to text of PRIVMSG to ircTarget as relayed by servers w/ nick!user@host source prefix of up to ircSourceLen bytes
+    def getIrcLineBudget(self, ircTarget, ircSourceLen=64):
+        return self.ircLineMax - len(":{} PRIVMSG {} :\r\n".format("x" * ircSourceLen, ircTarget).encode())
+    # }}}
+    # {{{ getIrcPastePlan(self, outLines, burstLines=5, linesPerSecond=0.5): return [seconds since start, text] per line, sending up to burstLines at once and pacing the rest at linesPerSecond
+    def getIrcPastePlan(self, outLines, burstLines=5, linesPerSecond=0.5):
+        return [[max(numLine - burstLines + 1, 0) / linesPerSecond, outLine[0]]   \
+                for numLine, outLine in enumerate(outLines)]
     # }}}
 
     #
@@ -126,4 +199,31 @@ class MiRCARTCanvasExportStore():
     def __init__(self, parentCanvas):
         self.parentCanvas = parentCanvas
 
+#
+# Entry point
+def main(*argv):
+    canvasExportStore = MiRCARTCanvasExportStore(None)
+    canvasMap = MiRCARTCanvasImportStore(argv[1]).outMap
+    lineBudget = canvasExportStore.getIrcLineBudget(argv[2], *[int(arg) for arg in argv[3:4]])
+    outLines, overBudgetRows = canvasExportStore.exportIrcLines(canvasMap, canvasMap.mapSize, lineBudget)
+    for numRow, outLine in enumerate(outLines):
+        print(outLine[0])
+        print("row {}: {} bytes{}".format(numRow, outLine[1],                           \
+            " exceeds budget of {} bytes".format(lineBudget) if outLine[1] > lineBudget else ""), file=sys.stderr)
+    outPlan = canvasExportStore.getIrcPastePlan(outLines, *[float(arg) for arg in argv[4:6]])
+    print("{} lines, {} bytes, {} row(s) over budget of {} bytes; paste takes {:.1f}s".format(     \
+        len(outLines), sum(outLine[1] for outLine in outLines), len(overBudgetRows),    \
+        lineBudget, outPlan[-1][0] if len(outPlan) else 0), file=sys.stderr)
+if __name__ == "__main__":
+    if ((len(sys.argv) - 1) < 2)                                                \
+    or ((len(sys.argv) - 1) > 5):
+        print("usage: {} "                                                      \
+            "<MiRCART input file pathname> "                                    \
+            "<IRC channel or nick name to paste to> "                           \
+            "[<IRC source prefix length; defaults to 64>] "                     \
+            "[<burst lines; defaults to 5>] "                                   \
+            "[<lines per second after burst; defaults to 0.5>]".format(sys.argv[0]), file=sys.stderr)
+    else:
+        main(*sys.argv)
+
 # vim:expandtab foldmethod=marker sw=4 ts=4 tw=120
@@ -22,9 +22,14 @@
 # SOFTWARE.
 #
 
+from MiRCARTCanvasMap import MiRCARTCanvasMap
+from array import array
+import mmap, os, re, sys
+
 class MiRCARTCanvasImportStore():
     """XXX"""
-    inFile = inSize = outMap = None
+    canvasCache = cacheSalt = _cacheKey = None
+    inEncoding = inFallbackEncoding = inFile = inPalette = inSize = outMap = None
     parentCanvas = None
 
     #
@@ -36,125 +41,231 @@ class MiRCARTCanvasImportStore():
         CS_UNDERLINE        = 0x04
 
     #
-    # _ParseState(): Parsing loop state
-    class _ParseState():
-        PS_CHAR             = 1
-        PS_COLOUR_DIGIT0    = 2
-        PS_COLOUR_DIGIT1    = 3
+    # Tokens: ^C w/ optional <fg>[,<bg>] colour spec, single ^B, ^F, ^O, ^V, or ^_ control code, run of text, or line breaks
+    # (a comma is only part of the colour spec if followed by a digit or if it is the last character of the file)
+    _COLOUR_DIGITS = "(0[0-9]|1[0-5]|[0-9])"
+    _TOKEN_COLOUR = "(\x03)" + _COLOUR_DIGITS + "?(?:(,)(?=[0-9]|\\Z)" + _COLOUR_DIGITS + "?)?"
+    _TOKEN_CODE = "([\x02\x06\x0f\x16\x1f])"
+    _TOKEN_TEXT = "([^\x02\x03\x06\x0f\x16\x1f\r\n]+)"
+    _TOKEN_BREAK = "[\r\n]+"
+    _tokenRegex = re.compile("|".join((_TOKEN_COLOUR, _TOKEN_CODE, _TOKEN_TEXT, _TOKEN_BREAK)))
+    _tokenNonTextRegex = re.compile("|".join((_TOKEN_COLOUR, _TOKEN_CODE, _TOKEN_BREAK)))
+    _tokenRegexBytes = re.compile("|".join((_TOKEN_COLOUR, _TOKEN_CODE, _TOKEN_TEXT, _TOKEN_BREAK)).encode())
+    _tokenNonTextRegexBytes = re.compile("|".join((_TOKEN_COLOUR, _TOKEN_CODE, _TOKEN_BREAK)).encode())
+    _lineBreakRegexBytes = re.compile(b"\r\n?|\n")
+    _tokenAttrs = {"\x02": _CellState.CS_BOLD, "\x06": _CellState.CS_ITALIC, "\x1f": _CellState.CS_UNDERLINE}
+
+    #
+    # Single byte strings of all byte values, repeated for runs of cells sharing colours and attributes
+    _byteValues = [bytes((byteValue,)) for byteValue in range(256)]
+
+    #
+    # Codec encoding text runs as native byte order UCS-4 code points, i.e. array("I") items
+    _charsCodec = "utf-32-le" if sys.byteorder == "little" else "utf-32-be"
 
-    # {{{ _flipCellStateBit(self, cellState, bit): XXX
-    def _flipCellStateBit(self, cellState, bit):
-        if cellState & bit:
-            return cellState & ~bit
+    # {{{ _getCacheKey(self, pathName): return canvasCache key of text file pathName, hashing it only once as long as its size and modification time are unchanged
+    def _getCacheKey(self, pathName):
+        pathStat = os.stat(pathName)
+        cacheKey = (os.path.abspath(pathName), pathStat.st_size, pathStat.st_mtime_ns)
+        if self._cacheKey == None or self._cacheKey[0] != cacheKey:
+            self._cacheKey = (cacheKey, self.canvasCache.getKey(pathName, self.cacheSalt))
+        return self._cacheKey[1]
+    # }}}
+    # {{{ _iterMappedLines(self, inMap): iterate over (start, end) offsets of lines incl. line breaks in memory-mapped file
+    def _iterMappedLines(self, inMap):
+        lineStart = 0
+        for lineBreak in self._lineBreakRegexBytes.finditer(inMap):
+            yield lineStart, lineBreak.end()
+            lineStart = lineBreak.end()
+        if lineStart < len(inMap):
+            yield lineStart, len(inMap)
+    # }}}
+    # {{{ _iterTextFile(self, pathName, numBandRows=256, useMmap=True): parse text file w/o canvasCache, yielding (first row number, list of rows) per band of up to numBandRows parsed rows
+    def _iterTextFile(self, pathName, numBandRows=256, useMmap=True):
+        if useMmap:
+            inMap = self._mapFile(pathName)
+            inLines = (self._parseMappedLine(inMap, lineStart, lineEnd)   \
+                       for lineStart, lineEnd in self._iterMappedLines(inMap))
         else:
-            return cellState | bit
+            self.inFile = open(pathName, "r")
+            inLines = (self._parseLine(inLine) for inLine in self.inFile)
+        try:
+            numRow = 0; inRows = [];
+            for inRow in inLines:
+                inRows.append(inRow)
+                if len(inRows) == numBandRows:
+                    yield numRow, inRows
+                    numRow += len(inRows); inRows = [];
+            if len(inRows):
+                yield numRow, inRows
+        finally:
+            if useMmap:
+                inLines.close()
+                if len(inMap):
+                    inMap.close()
+            else:
+                self.inFile.close()
     # }}}
-    # {{{ _parseCharAsColourSpec(self, colourSpec, curColours): XXX
-    def _parseCharAsColourSpec(self, colourSpec, curColours):
-        if len(colourSpec) > 0:
-            colourSpec = colourSpec.split(",")
-            if  len(colourSpec) == 2                             \
-            and len(colourSpec[1]) > 0:
-                return (int(colourSpec[0] or curColours[0]),    \
-                    int(colourSpec[1]))
-            elif len(colourSpec) == 1                           \
-            or   len(colourSpec[1]) == 0:
-                return (int(colourSpec[0]), curColours[1])
+    # {{{ _mapFile(self, pathName): return read-only memory map of file, or empty bytes if it is empty
+    def _mapFile(self, pathName):
+        with open(pathName, "rb") as inFile:
+            if os.fstat(inFile.fileno()).st_size == 0:
+                return b""
+            else:
+                return mmap.mmap(inFile.fileno(), 0, access=mmap.ACCESS_READ)
+    # }}}
+    # {{{ _parseLine(self, inLine, inEncoding=None, lineStart=0, lineEnd=None): parse single line, or bytes of lineStart..lineEnd w/ text runs decoded from inEncoding, into (fg, bg, attrs, codepoints) arrays
+    def _parseLine(self, inLine, inEncoding=None, lineStart=0, lineEnd=None):
+        inCellState = self._CellState.CS_NONE; inCurColours = (15, 1);
+        rowFg = []; rowBg = []; rowAttrs = []; rowText = [];
+        if inEncoding == None:
+            inTokens = self._tokenRegex.findall(inLine)
         else:
-            return (15, 1)
+            inTokens = self._tokenRegexBytes.findall(inLine, lineStart, len(inLine) if lineEnd == None else lineEnd)
+        for tokenColour, tokenFg, tokenComma, tokenBg, tokenCode, tokenText in inTokens:
+            if tokenText:
+                if inEncoding != None:
+                    tokenText = tokenText.decode(inEncoding)
+                textLen = len(tokenText)
+                rowFg.append(self._byteValues[inCurColours[0]] * textLen)
+                rowBg.append(self._byteValues[inCurColours[1]] * textLen)
+                rowAttrs.append(self._byteValues[inCellState] * textLen)
+                rowText.append(tokenText)
+            elif tokenCode:
+                if inEncoding != None:
+                    tokenCode = tokenCode.decode()
+                if tokenCode == "\x0f":
+                    inCurColours = (15, 1)
+                elif tokenCode == "\x16":
+                    inCurColours = (inCurColours[1], inCurColours[0])
+                else:
+                    inCellState ^= self._tokenAttrs[tokenCode]
+            elif tokenColour:
+                if tokenBg:
+                    inCurColours = (int(tokenFg or inCurColours[0]), int(tokenBg))
+                elif tokenFg:
+                    inCurColours = (int(tokenFg), inCurColours[1])
+                elif not tokenComma:
+                    inCurColours = (15, 1)
+        return (array("B", b"".join(rowFg)), array("B", b"".join(rowBg)),  \
+                array("B", b"".join(rowAttrs)), array("I", "".join(rowText).encode(self._charsCodec)))
+    # }}}
+    # {{{ _parseMappedLine(self, inMap, lineStart, lineEnd): parse single line of memory-mapped file, decoding it from inFallbackEncoding if not valid inEncoding
+    def _parseMappedLine(self, inMap, lineStart, lineEnd):
+        try:
+            return self._parseLine(inMap, self.inEncoding, lineStart, lineEnd)
+        except UnicodeDecodeError:
+            return self._parseLine(inMap, self.inFallbackEncoding, lineStart, lineEnd)
+    # }}}
+    # {{{ _rowsToMap(self, inRows): return canvas map of (fg, bg, attrs, codepoints) rows
+    def _rowsToMap(self, inRows):
+        outMap = MiRCARTCanvasMap((max([len(inRow[0]) for inRow in inRows], default=0), 0))
+        for inRow in inRows:
+            outMap.appendRow(*inRow)
+        return outMap
     # }}}
 
+    # {{{ getTextFileSize(self, pathName, useMmap=True): return [columns, rows] of text file w/o parsing its cells
+    def getTextFileSize(self, pathName, useMmap=True):
+        inSize = [0, 0]
+        cachedSize = self.canvasCache.getSize(pathName, self.cacheSalt, self._getCacheKey(pathName)) if self.canvasCache != None else None
+        if cachedSize != None:
+            inSize = cachedSize
+        elif useMmap:
+            inMap = self._mapFile(pathName)
+            for lineStart, lineEnd in self._iterMappedLines(inMap):
+                inText = self._tokenNonTextRegexBytes.sub(b"", inMap[lineStart:lineEnd])
+                try:
+                    inText = inText.decode(self.inEncoding)
+                except UnicodeDecodeError:
+                    inText = inText.decode(self.inFallbackEncoding)
+                inSize[0] = max(inSize[0], len(inText)); inSize[1] += 1;
+            if len(inMap):
+                inMap.close()
+        else:
+            with open(pathName, "r") as inFile:
+                for inLine in inFile:
+                    inSize[0] = max(inSize[0], len(self._tokenNonTextRegex.sub("", inLine))); inSize[1] += 1;
+        return inSize
+    # }}}
+    # {{{ importBinaryFile(self, pathName, useMmap=True): load binary canvas file, mapping its cell arrays copy-on-write instead of reading them if useMmap
+    def importBinaryFile(self, pathName, useMmap=True):
+        self.inPalette = self.inSize = self.outMap = None
+        with open(pathName, "rb") as inFile:
+            if os.fstat(inFile.fileno()).st_size < MiRCARTCanvasMap.BINARY_HEADER.size:
+                raise ValueError("{}: truncated binary canvas file header".format(pathName))
+            elif useMmap:
+                inData = mmap.mmap(inFile.fileno(), 0, access=mmap.ACCESS_COPY)
+            else:
+                inData = bytearray(inFile.read())
+        magic, version, mapWidth, mapHeight, numColours = MiRCARTCanvasMap.BINARY_HEADER.unpack_from(inData)
+        if magic != MiRCARTCanvasMap.BINARY_MAGIC or version != MiRCARTCanvasMap.BINARY_VERSION:
+            raise ValueError("{}: not a version {} binary canvas file".format(pathName, MiRCARTCanvasMap.BINARY_VERSION))
+        mapOffset = MiRCARTCanvasMap.BINARY_HEADER.size + (numColours * 4)
+        if len(inData) < (mapOffset + (mapWidth * mapHeight * 7)):
+            raise ValueError("{}: truncated binary canvas file; expected {} bytes, got {}".format(   \
+                pathName, mapOffset + (mapWidth * mapHeight * 7), len(inData)))
+        self.inPalette = [list(inData[paletteOffset:paletteOffset + 4])    \
+                          for paletteOffset in range(MiRCARTCanvasMap.BINARY_HEADER.size, mapOffset, 4)]
+        self.outMap = MiRCARTCanvasMap.fromBuffer((mapWidth, mapHeight), inData, mapOffset)
+        self.inSize = [mapWidth, mapHeight]
+    # }}}
+    # {{{ importFileIntoPanel(self, pathName): import binary canvas or text file into panel, depending on its suffix
+    def importFileIntoPanel(self, pathName):
+        if pathName.endswith(MiRCARTCanvasMap.BINARY_SUFFIX):
+            self.importBinaryFile(pathName); self.importIntoPanel();
+        else:
+            self.importTextFileIntoPanel(pathName)
+    # }}}
     # {{{ importIntoPanel(self): XXX
     def importIntoPanel(self):
         self.parentCanvas.onStoreUpdate(self.inSize, self.outMap)
     # }}}
     # {{{ importTextFile(self, pathName): XXX
     def importTextFile(self, pathName):
-        self.inFile = open(pathName, "r")
-        self.inSize = self.outMap = None;
-        inCurColourSpec = ""; inCurRow = -1;
-        inLine = self.inFile.readline()
-        inSize = [0, 0]; outMap = []; inMaxCols = 0;
-        while inLine:
-            inCellState = self._CellState.CS_NONE
-            inParseState = self._ParseState.PS_CHAR
-            inCurCol = 0; inMaxCol = len(inLine);
-            inCurColourDigits = 0; inCurColours = (15, 1); inCurColourSpec = "";
-            inCurRow += 1; outMap.append([]); inRowCols = 0; inSize[1] += 1;
-            while inCurCol < inMaxCol:
-                inChar = inLine[inCurCol]
-                if inChar in set("\r\n"):                                   \
-                    inCurCol += 1
-                elif inParseState == self._ParseState.PS_CHAR:
-                    inCurCol += 1
-                    if inChar == "":
-                        inCellState = self._flipCellStateBit(               \
-                            inCellState, self._CellState.CS_BOLD)
-                    elif inChar == "":
-                        inParseState = self._ParseState.PS_COLOUR_DIGIT0
-                    elif inChar == "":
-                        inCellState = self._flipCellStateBit(               \
-                            inCellState, self._CellState.CS_ITALIC)
-                    elif inChar == "":
-                        inCellState |= self._CellState.CS_NONE
-                        inCurColours = (15, 1)
-                    elif inChar == "":
-                        inCurColours = (inCurColours[1], inCurColours[0])
-                    elif inChar == "":
-                        inCellState = self._flipCellStateBit(               \
-                            inCellState, self._CellState.CS_UNDERLINE)
-                    else:
-                        inRowCols += 1
-                        outMap[inCurRow].append([*inCurColours, inCellState, inChar])
-                elif inParseState == self._ParseState.PS_COLOUR_DIGIT0      \
-                or   inParseState == self._ParseState.PS_COLOUR_DIGIT1:
-                    if  inChar == ","                                       \
-                    and inParseState == self._ParseState.PS_COLOUR_DIGIT0:
-                        if  (inCurCol + 1) < inMaxCol                       \
-                        and not inLine[inCurCol + 1] in set("0123456789"):
-                            inCurColours = self._parseCharAsColourSpec(      \
-                                inCurColourSpec, inCurColours)
-                            inCurColourDigits = 0; inCurColourSpec = "";
-                            inParseState = self._ParseState.PS_CHAR
-                        else:
-                            inCurCol += 1
-                            inCurColourDigits = 0; inCurColourSpec += inChar;
-                            inParseState = self._ParseState.PS_COLOUR_DIGIT1
-                    elif inChar in set("0123456789")                        \
-                    and  inCurColourDigits == 0:
-                        inCurCol += 1
-                        inCurColourDigits += 1; inCurColourSpec += inChar;
-                    elif inChar in set("0123456789")                        \
-                    and  inCurColourDigits == 1                             \
-                    and  inCurColourSpec[-1] == "0":
-                        inCurCol += 1
-                        inCurColourDigits += 1; inCurColourSpec += inChar;
-                    elif inChar in set("012345")                            \
-                    and  inCurColourDigits == 1                             \
-                    and  inCurColourSpec[-1] == "1":
-                        inCurCol += 1
-                        inCurColourDigits += 1; inCurColourSpec += inChar;
-                    else:
-                        inCurColours = self._parseCharAsColourSpec(         \
-                            inCurColourSpec, inCurColours)
-                        inCurColourDigits = 0; inCurColourSpec = "";
-                        inParseState = self._ParseState.PS_CHAR
-            inMaxCols = max(inMaxCols, inRowCols)
-            inLine = self.inFile.readline()
-        inSize[0] = inMaxCols; self.inSize = inSize; self.outMap = outMap;
-        self.inFile.close()
+        self.inSize = self.outMap = None
+        outMap = self.canvasCache.get(pathName, self.cacheSalt, self._getCacheKey(pathName)) if self.canvasCache != None else None
+        if outMap == None:
+            inRows = []
+            for numRow, inBandRows in self._iterTextFile(pathName):
+                inRows += inBandRows
+            outMap = self._rowsToMap(inRows)
+            if self.canvasCache != None:
+                self.canvasCache.put(pathName, outMap, self.cacheSalt, self._getCacheKey(pathName))
+        self.inSize = list(outMap.mapSize); self.outMap = outMap;
+    # }}}
+    # {{{ importTextFileIntoPanel(self, pathName, numBandRows=256): import text file into panel band by band, displaying rows as they are parsed
+    def importTextFileIntoPanel(self, pathName, numBandRows=256):
+        self.inSize = self.outMap = None
+        self.parentCanvas.onStoreUpdate([0, 0])
+        for numRow, inRows in self.iterTextFile(pathName, numBandRows):
+            self.parentCanvas.onStoreRows(inRows)
     # }}}
     # {{{ importNew(self, newCanvasSize=None): XXX
     def importNew(self, newCanvasSize=None):
-        newMap = [[[1, 1, 0, " "]                   \
-                for x in range(newCanvasSize[0])]   \
-                    for y in range(newCanvasSize[1])]
+        newMap = MiRCARTCanvasMap(newCanvasSize)
         self.parentCanvas.onStoreUpdate(newCanvasSize, newMap)
     # }}}
+    # {{{ iterTextFile(self, pathName, numBandRows=256, useMmap=True): parse text file, or load it from canvasCache, yielding (first row number, list of rows) per band of up to numBandRows rows; on cache misses, bands are stored as they are parsed
+    def iterTextFile(self, pathName, numBandRows=256, useMmap=True):
+        cacheKey = self._getCacheKey(pathName) if self.canvasCache != None else None
+        cachedMap = self.canvasCache.get(pathName, self.cacheSalt, cacheKey) if self.canvasCache != None else None
+        if cachedMap != None:
+            for numRow in range(0, cachedMap.mapSize[1], numBandRows):
+                yield numRow, [cachedMap.getRow(curRow)             \
+                               for curRow in range(numRow, min(numRow + numBandRows, cachedMap.mapSize[1]))]
+        elif self.canvasCache != None:
+            yield from self.canvasCache.putBands(pathName,          \
+                self._iterTextFile(pathName, numBandRows, useMmap), self.cacheSalt, cacheKey)
+        else:
+            yield from self._iterTextFile(pathName, numBandRows, useMmap)
+    # }}}
 
     #
-    # __init__(self, inFile=None, parentCanvas=None): initialisation method
-    def __init__(self, inFile=None, parentCanvas=None):
+    # __init__(self, inFile=None, parentCanvas=None, inEncoding="utf-8", inFallbackEncoding="cp437", canvasCache=None): initialisation method
+    def __init__(self, inFile=None, parentCanvas=None, inEncoding="utf-8", inFallbackEncoding="cp437", canvasCache=None):
+        self.inEncoding = inEncoding; self.inFallbackEncoding = inFallbackEncoding;
+        self.canvasCache = canvasCache; self.cacheSalt = "{}:{}".format(inEncoding, inFallbackEncoding);
         self.inFile = inFile; self.inSize = self.outMap = None;
         self.parentCanvas = parentCanvas
         if inFile != None:
@@ -35,6 +35,11 @@ import os, wx
 class MiRCARTCanvasInterface():
     """XXX"""
     parentCanvas = parentFrame = canvasPathName = canvasTool = None
+    _pendingCanvasSize = None
+
+    #
+    # File dialog wildcard of canvas file formats
+    canvasWildcard = "mIRC art files (*.txt)|*.txt|MiRCART binary canvas files (*.mrb)|*.mrb|All files (*.*)|*.*"
 
     # {{{ _dialogSaveChanges(self)
     def _dialogSaveChanges(self):
@@ -45,6 +50,20 @@ class MiRCARTCanvasInterface():
             dialogChoice = dialog.ShowModal()
             return dialogChoice
     # }}}
+    # {{{ _flushCanvasSize(self): apply coalesced canvas size change(s)
+    def _flushCanvasSize(self):
+        newCanvasSize = self._pendingCanvasSize
+        self._pendingCanvasSize = None
+        if newCanvasSize != None:
+            self.parentCanvas.resize(newCanvasSize)
+    # }}}
+    # {{{ _queueCanvasSize(self, deltaSize): coalesce canvas size change w/ those pending until the next idle dispatch
+    def _queueCanvasSize(self, deltaSize):
+        if self._pendingCanvasSize == None:
+            self._pendingCanvasSize = list(self.parentCanvas.canvasModel.canvasSize)
+            wx.CallAfter(self._flushCanvasSize)
+        self._pendingCanvasSize = [max(a + b, 1) for a,b in zip(self._pendingCanvasSize, deltaSize)]
+    # }}}
 
     # {{{ canvasBrushSolid(self, event): XXX
     def canvasBrushSolid(self, event):
@@ -53,10 +72,10 @@ class MiRCARTCanvasInterface():
     # {{{ canvasColour(self, event, numColour): XXX
     def canvasColour(self, event, numColour):
         if event.GetEventType() == wx.wxEVT_TOOL:
-            self.parentCanvas.brushColours[0] = numColour
+            self.parentCanvas.canvasModel.brushColours[0] = numColour
         elif event.GetEventType() == wx.wxEVT_TOOL_RCLICKED:
-            self.parentCanvas.brushColours[1] = numColour
-        self.parentFrame.onCanvasUpdate(colours=self.parentCanvas.brushColours)
+            self.parentCanvas.canvasModel.brushColours[1] = numColour
+        self.parentFrame.onCanvasUpdate(colours=self.parentCanvas.canvasModel.brushColours)
     # }}}
     # {{{ canvasCopy(self, event): XXX
     def canvasCopy(self, event):
@@ -68,9 +87,9 @@ class MiRCARTCanvasInterface():
     # }}}
     # {{{ canvasDecrBrushHeight(self, event): XXX
     def canvasDecrBrushHeight(self, event):
-        if  self.parentCanvas.brushSize[1] > 1:
-            self.parentCanvas.brushSize[1] -= 1
-            self.parentFrame.onCanvasUpdate(brushSize=self.parentCanvas.brushSize)
+        if  self.parentCanvas.canvasModel.brushSize[1] > 1:
+            self.parentCanvas.canvasModel.brushSize[1] -= 1
+            self.parentFrame.onCanvasUpdate(brushSize=self.parentCanvas.canvasModel.brushSize)
     # }}}
     # {{{ canvasDecrBrushHeightWidth(self, event): XXX
     def canvasDecrBrushHeightWidth(self, event):
@@ -79,16 +98,13 @@ class MiRCARTCanvasInterface():
     # }}}
     # {{{ canvasDecrBrushWidth(self, event): XXX
     def canvasDecrBrushWidth(self, event):
-        if  self.parentCanvas.brushSize[0] > 1:
-            self.parentCanvas.brushSize[0] -= 1
-            self.parentFrame.onCanvasUpdate(brushSize=self.parentCanvas.brushSize)
+        if  self.parentCanvas.canvasModel.brushSize[0] > 1:
+            self.parentCanvas.canvasModel.brushSize[0] -= 1
+            self.parentFrame.onCanvasUpdate(brushSize=self.parentCanvas.canvasModel.brushSize)
     # }}}
     # {{{ canvasDecrCanvasHeight(self, event): XXX
     def canvasDecrCanvasHeight(self, event):
-        if self.parentCanvas.canvasSize[1] > 1:
-            self.parentCanvas.resize([                  \
-                    self.parentCanvas.canvasSize[0],    \
-                    self.parentCanvas.canvasSize[1]-1])
+        self._queueCanvasSize([0, -1])
     # }}}
     # {{{ canvasDecrCanvasHeightWidth(self, event): XXX
     def canvasDecrCanvasHeightWidth(self, event):
@@ -97,10 +113,7 @@ class MiRCARTCanvasInterface():
     # }}}
     # {{{ canvasDecrCanvasWidth(self, event): XXX
     def canvasDecrCanvasWidth(self, event):
-        if self.parentCanvas.canvasSize[0] > 1:
-            self.parentCanvas.resize([                  \
-                    self.parentCanvas.canvasSize[0]-1,  \
-                    self.parentCanvas.canvasSize[1]])
+        self._queueCanvasSize([-1, 0])
     # }}}
     # {{{ canvasDelete(self, event): XXX
     def canvasDelete(self, event):
@@ -113,7 +126,7 @@ class MiRCARTCanvasInterface():
             if saveChanges == wx.ID_CANCEL:
                 return
             elif saveChanges == wx.ID_NO:
-                pass
+                self.parentCanvas.canvasModel.discardLog()
             elif saveChanges == wx.ID_YES:
                 self.canvasSave(event)
         self.parentFrame.Close(True)
@@ -128,7 +141,8 @@ class MiRCARTCanvasInterface():
                 outPathName = dialog.GetPath()
                 self.parentCanvas.SetCursor(wx.Cursor(wx.CURSOR_WAIT))
                 self.parentCanvas.canvasExportStore.exportBitmapToPngFile(      \
-                    self.parentCanvas.canvasBackend.canvasBitmap, outPathName,  \
+                    self.parentCanvas.canvasBackend.getCanvasBitmap(            \
+                        self.parentCanvas.canvasModel.canvasMap), outPathName,  \
                         wx.BITMAP_TYPE_PNG)
                 self.parentCanvas.SetCursor(wx.Cursor(wx.NullCursor))
                 return True
@@ -137,8 +151,9 @@ class MiRCARTCanvasInterface():
     def canvasExportImgur(self, event):
         self.parentCanvas.SetCursor(wx.Cursor(wx.CURSOR_WAIT))
         imgurResult = self.parentCanvas.canvasExportStore.exportBitmapToImgur(   \
-            "c9a6efb3d7932fd", self.parentCanvas.canvasBackend.canvasBitmap,    \
-            "", "", wx.BITMAP_TYPE_PNG)
+            "c9a6efb3d7932fd",                                                  \
+            self.parentCanvas.canvasBackend.getCanvasBitmap(                    \
+                self.parentCanvas.canvasModel.canvasMap), "", "", wx.BITMAP_TYPE_PNG)
         self.parentCanvas.SetCursor(wx.Cursor(wx.NullCursor))
         if imgurResult[0] == 200:
             if not wx.TheClipboard.IsOpened():
@@ -157,8 +172,8 @@ class MiRCARTCanvasInterface():
         pasteStatus, pasteResult =                                          \
             self.parentCanvas.canvasExportStore.exportPastebin(             \
                 "253ce2f0a45140ee0a44ca99aa49260",                          \
-                self.parentCanvas.canvasMap,                                \
-                self.parentCanvas.canvasSize)
+                self.parentCanvas.canvasModel.canvasMap,                    \
+                self.parentCanvas.canvasModel.canvasSize)
         self.parentCanvas.SetCursor(wx.Cursor(wx.NullCursor))
         if pasteStatus:
             if not wx.TheClipboard.IsOpened():
@@ -173,8 +188,8 @@ class MiRCARTCanvasInterface():
     # }}}
     # {{{ canvasIncrBrushHeight(self, event): XXX
     def canvasIncrBrushHeight(self, event):
-        self.parentCanvas.brushSize[1] += 1
-        self.parentFrame.onCanvasUpdate(brushSize=self.parentCanvas.brushSize)
+        self.parentCanvas.canvasModel.brushSize[1] += 1
+        self.parentFrame.onCanvasUpdate(brushSize=self.parentCanvas.canvasModel.brushSize)
     # }}}
     # {{{ canvasIncrBrushHeightWidth(self, event): XXX
     def canvasIncrBrushHeightWidth(self, event):
@@ -183,14 +198,12 @@ class MiRCARTCanvasInterface():
     # }}}
     # {{{ canvasIncrBrushWidth(self, event): XXX
     def canvasIncrBrushWidth(self, event):
-        self.parentCanvas.brushSize[0] += 1
-        self.parentFrame.onCanvasUpdate(brushSize=self.parentCanvas.brushSize)
+        self.parentCanvas.canvasModel.brushSize[0] += 1
+        self.parentFrame.onCanvasUpdate(brushSize=self.parentCanvas.canvasModel.brushSize)
     # }}}
     # {{{ canvasIncrCanvasHeight(self, event): XXX
     def canvasIncrCanvasHeight(self, event):
-        self.parentCanvas.resize([              \
-            self.parentCanvas.canvasSize[0],    \
-            self.parentCanvas.canvasSize[1]+1])
+        self._queueCanvasSize([0, 1])
     # }}}
     # {{{ canvasIncrCanvasHeightWidth(self, event): XXX
     def canvasIncrCanvasHeightWidth(self, event):
@@ -199,9 +212,7 @@ class MiRCARTCanvasInterface():
     # }}}
     # {{{ canvasIncrCanvasWidth(self, event): XXX
     def canvasIncrCanvasWidth(self, event):
-        self.parentCanvas.resize([              \
-            self.parentCanvas.canvasSize[0]+1,  \
-            self.parentCanvas.canvasSize[1]])
+        self._queueCanvasSize([1, 0])
     # }}}
     # {{{ canvasNew(self, event, newCanvasSize=None): XXX
     def canvasNew(self, event, newCanvasSize=None):
@@ -210,7 +221,7 @@ class MiRCARTCanvasInterface():
             if saveChanges == wx.ID_CANCEL:
                 return
             elif saveChanges == wx.ID_NO:
-                pass
+                self.parentCanvas.canvasModel.discardLog()
             elif saveChanges == wx.ID_YES:
                 self.canvasSave(event)
         self.parentCanvas.SetCursor(wx.Cursor(wx.CURSOR_WAIT))
@@ -228,21 +239,25 @@ class MiRCARTCanvasInterface():
             if saveChanges == wx.ID_CANCEL:
                 return
             elif saveChanges == wx.ID_NO:
-                pass
+                self.parentCanvas.canvasModel.discardLog()
             elif saveChanges == wx.ID_YES:
                 self.canvasSave(event)
         with wx.FileDialog(self.parentCanvas, "Open", os.getcwd(), "",  \
-                "*.txt", wx.FD_OPEN) as dialog:
+                self.canvasWildcard, wx.FD_OPEN) as dialog:
             if dialog.ShowModal() == wx.ID_CANCEL:
                 return False
             else:
                 self.canvasPathName = dialog.GetPath()
                 self.parentCanvas.SetCursor(wx.Cursor(wx.CURSOR_WAIT))
-                self.parentCanvas.canvasImportStore.importTextFile(self.canvasPathName)
-                self.parentCanvas.canvasImportStore.importIntoPanel()
+                if self.parentCanvas.restoreLog(self.canvasPathName):
+                    undoLevel = self.parentCanvas.canvasModel.canvasJournal.patchesUndoLevel
+                else:
+                    self.parentCanvas.canvasImportStore.importFileIntoPanel(self.canvasPathName)
+                    self.parentCanvas.canvasModel.attachLog(self.canvasPathName)
+                    undoLevel = -1
                 self.parentCanvas.SetCursor(wx.Cursor(wx.NullCursor))
                 self.parentFrame.onCanvasUpdate(                        \
-                    pathName=self.canvasPathName, undoLevel=-1)
+                    pathName=self.canvasPathName, undoLevel=undoLevel)
                 return True
     # }}}
     # {{{ canvasPaste(self, event): XXX
@@ -251,8 +266,7 @@ class MiRCARTCanvasInterface():
     # }}}
     # {{{ canvasRedo(self, event): XXX
     def canvasRedo(self, event):
-        self.parentCanvas._dispatchDeltaPatches(    \
-            self.parentCanvas.canvasJournal.popRedo())
+        self.parentCanvas.redo()
     # }}}
     # {{{ canvasSave(self, event): XXX
     def canvasSave(self, event):
@@ -260,20 +274,20 @@ class MiRCARTCanvasInterface():
             if self.canvasSaveAs(event) == False:
                 return
         try:
-            with open(self.canvasPathName, "w") as outFile:
-                self.parentCanvas.SetCursor(wx.Cursor(wx.CURSOR_WAIT))
-                self.parentCanvas.canvasExportStore.exportTextFile(      \
-                    self.parentCanvas.canvasMap,                         \
-                    self.parentCanvas.canvasSize, outFile)
-                self.parentCanvas.SetCursor(wx.Cursor(wx.NullCursor))
-                return True
+            self.parentCanvas.SetCursor(wx.Cursor(wx.CURSOR_WAIT))
+            self.parentCanvas.canvasExportStore.exportFile(              \
+                self.parentCanvas.canvasModel.canvasMap,                 \
+                self.parentCanvas.canvasModel.canvasSize, self.canvasPathName)
+            self.parentCanvas.SetCursor(wx.Cursor(wx.NullCursor))
         except IOError as error:
             return False
+        self.parentCanvas.canvasModel.attachLog(self.canvasPathName)
+        return True
     # }}}
     # {{{ canvasSaveAs(self, event): XXX
     def canvasSaveAs(self, event):
         with wx.FileDialog(self.parentCanvas, "Save As", os.getcwd(), "",   \
-                "*.txt", wx.FD_SAVE|wx.FD_OVERWRITE_PROMPT) as dialog:
+                self.canvasWildcard, wx.FD_SAVE|wx.FD_OVERWRITE_PROMPT) as dialog:
             if dialog.ShowModal() == wx.ID_CANCEL:
                 return False
             else:
@@ -282,7 +296,7 @@ class MiRCARTCanvasInterface():
     # }}}
     # {{{ canvasToolCircle(self, event): XXX
     def canvasToolCircle(self, event):
-        self.canvasTool = MiRCARTToolCircle(self.parentCanvas)
+        self.canvasTool = MiRCARTToolCircle(self.parentCanvas.canvasModel)
         self.parentFrame.menuItemsById[self.parentFrame.CID_CIRCLE[0]].Check(True)
         toolBar = self.parentFrame.toolBarItemsById[self.parentFrame.CID_CIRCLE[0]].GetToolBar()
         toolBar.ToggleTool(self.parentFrame.CID_CIRCLE[0], True)
@@ -290,7 +304,7 @@ class MiRCARTCanvasInterface():
     # }}}
     # {{{ canvasToolFill(self, event): XXX
     def canvasToolFill(self, event):
-        self.canvasTool = MiRCARTToolFill(self.parentCanvas)
+        self.canvasTool = MiRCARTToolFill(self.parentCanvas.canvasModel)
         self.parentFrame.menuItemsById[self.parentFrame.CID_FILL[0]].Check(True)
         toolBar = self.parentFrame.toolBarItemsById[self.parentFrame.CID_FILL[0]].GetToolBar()
         toolBar.ToggleTool(self.parentFrame.CID_FILL[0], True)
@@ -298,7 +312,7 @@ class MiRCARTCanvasInterface():
     # }}}
     # {{{ canvasToolLine(self, event): XXX
     def canvasToolLine(self, event):
-        self.canvasTool = MiRCARTToolLine(self.parentCanvas)
+        self.canvasTool = MiRCARTToolLine(self.parentCanvas.canvasModel)
         self.parentFrame.menuItemsById[self.parentFrame.CID_LINE[0]].Check(True)
         toolBar = self.parentFrame.toolBarItemsById[self.parentFrame.CID_LINE[0]].GetToolBar()
         toolBar.ToggleTool(self.parentFrame.CID_LINE[0], True)
@@ -306,7 +320,7 @@ class MiRCARTCanvasInterface():
     # }}}
     # {{{ canvasToolSelectClone(self, event): XXX
     def canvasToolSelectClone(self, event):
-        self.canvasTool = MiRCARTToolSelectClone(self.parentCanvas)
+        self.canvasTool = MiRCARTToolSelectClone(self.parentCanvas.canvasModel)
         self.parentFrame.menuItemsById[self.parentFrame.CID_CLONE_SELECT[0]].Check(True)
         toolBar = self.parentFrame.toolBarItemsById[self.parentFrame.CID_CLONE_SELECT[0]].GetToolBar()
         toolBar.ToggleTool(self.parentFrame.CID_CLONE_SELECT[0], True)
@@ -314,7 +328,7 @@ class MiRCARTCanvasInterface():
     # }}}
     # {{{ canvasToolSelectMove(self, event): XXX
     def canvasToolSelectMove(self, event):
-        self.canvasTool = MiRCARTToolSelectMove(self.parentCanvas)
+        self.canvasTool = MiRCARTToolSelectMove(self.parentCanvas.canvasModel)
         self.parentFrame.menuItemsById[self.parentFrame.CID_MOVE_SELECT[0]].Check(True)
         toolBar = self.parentFrame.toolBarItemsById[self.parentFrame.CID_MOVE_SELECT[0]].GetToolBar()
         toolBar.ToggleTool(self.parentFrame.CID_MOVE_SELECT[0], True)
@@ -322,7 +336,7 @@ class MiRCARTCanvasInterface():
     # }}}
     # {{{ canvasToolRect(self, event): XXX
     def canvasToolRect(self, event):
-        self.canvasTool = MiRCARTToolRect(self.parentCanvas)
+        self.canvasTool = MiRCARTToolRect(self.parentCanvas.canvasModel)
         self.parentFrame.menuItemsById[self.parentFrame.CID_RECT[0]].Check(True)
         toolBar = self.parentFrame.toolBarItemsById[self.parentFrame.CID_RECT[0]].GetToolBar()
         toolBar.ToggleTool(self.parentFrame.CID_RECT[0], True)
@@ -330,7 +344,7 @@ class MiRCARTCanvasInterface():
     # }}}
     # {{{ canvasToolText(self, event): XXX
     def canvasToolText(self, event):
-        self.canvasTool = MiRCARTToolText(self.parentCanvas)
+        self.canvasTool = MiRCARTToolText(self.parentCanvas.canvasModel)
         self.parentFrame.menuItemsById[self.parentFrame.CID_TEXT[0]].Check(True)
         toolBar = self.parentFrame.toolBarItemsById[self.parentFrame.CID_TEXT[0]].GetToolBar()
         toolBar.ToggleTool(self.parentFrame.CID_TEXT[0], True)
@@ -338,8 +352,7 @@ class MiRCARTCanvasInterface():
     # }}}
     # {{{ canvasUndo(self, event): XXX
     def canvasUndo(self, event):
-        self.parentCanvas._dispatchDeltaPatches(    \
-            self.parentCanvas.canvasJournal.popUndo())
+        self.parentCanvas.undo()
     # }}}
 
     #
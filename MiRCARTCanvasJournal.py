@@ -22,10 +22,235 @@
 # SOFTWARE.
 #
 
+from MiRCARTCanvasMap import MiRCARTCanvasMap
+from array import array
+from collections import deque
+import os, struct, time
+
 class MiRCARTCanvasJournal():
     """XXX"""
+    _currentCells = _memoryUsage = None
+    logCanvasMap = logCompactInterval = logFile = logGeneration = logPathName = logRecords = None
+    memoryBudget = None
     patchesCursor = patchesUndo = patchesUndoLevel = None
 
+    #
+    # Pseudo-coordinate of patches resizing the canvas to [x, y, width, height, 0, " "]
+    PATCH_RESIZE = -1
+
+    #
+    # Number of packed integers per patch: x, y, fg, bg, attrs, and character code point
+    PATCH_INTS = 6
+
+    #
+    # Write-ahead log and snapshot sidecar file suffixes, headers, and record types
+    LOG_SUFFIX = ".journal"; SNAPSHOT_SUFFIX = ".snapshot";
+    LOG_HEADER = struct.Struct("<8sIq"); LOG_MAGIC = b"MiRCARTJ";
+    LOG_RECORD = struct.Struct("<BI")
+    LOG_PUSH, LOG_CELL, LOG_UNDO, LOG_REDO = range(1, 5)
+    SNAPSHOT_HEADER = struct.Struct("<8sIqqqIIII"); SNAPSHOT_MAGIC = b"MiRCARTS";
+    SNAPSHOT_LEVEL = struct.Struct("<II")
+    LOG_VERSION = 1
+
+    # {{{ _applyPatches(self, patches): apply patches and resize pseudo-patches to logCanvasMap during log replay
+    def _applyPatches(self, patches):
+        for patch in patches:
+            if patch[0] == self.PATCH_RESIZE:
+                self.logCanvasMap.resize(patch[2:4])
+            else:
+                self.logCanvasMap.applyPatch(patch)
+    # }}}
+    # {{{ _evictLevels(self): evict oldest undo levels until within memoryBudget, always keeping the most recent level
+    def _evictLevels(self):
+        while self._memoryUsage > self.memoryBudget     \
+        and   len(self.patchesUndo) > (self.patchesUndoLevel + 1):
+            self._memoryUsage -= self._getLevelSize(self.patchesUndo.popleft())
+    # }}}
+    # {{{ _getLevelSize(self, deltaItem): return size of packed undo level in bytes
+    def _getLevelSize(self, deltaItem):
+        return (len(deltaItem[0]) + len(deltaItem[1])) * deltaItem[0].itemsize
+    # }}}
+    # {{{ _getLogStamp(self, pathName): return (size, modification time) of canvas file, or (0, 0) if it does not exist
+    def _getLogStamp(self, pathName):
+        try:
+            pathStat = os.stat(pathName)
+            return (pathStat.st_size, pathStat.st_mtime_ns)
+        except OSError:
+            return (0, 0)
+    # }}}
+    # {{{ _logRecord(self, recordType, recordInts): append single record to write-ahead log, if any
+    def _logRecord(self, recordType, recordInts):
+        if self.logFile != None:
+            recordInts = array("i", recordInts)
+            self.logFile.write(self.LOG_RECORD.pack(recordType, len(recordInts)))
+            self.logFile.write(recordInts.tobytes())
+            self.logRecords += 1
+    # }}}
+    # {{{ _packCurrentLevel(self): append coalesced patches of current undo level to its packed arrays
+    def _packCurrentLevel(self):
+        if len(self._currentCells):
+            deltaItem = self.patchesUndo[-1]
+            oldSize = self._getLevelSize(deltaItem)
+            for undoPatch, redoPatch in self._currentCells.values():
+                deltaItem[0].extend(self._packPatch(undoPatch))
+                deltaItem[1].extend(self._packPatch(redoPatch))
+            self._currentCells.clear()
+            self._memoryUsage += self._getLevelSize(deltaItem) - oldSize
+            self._evictLevels()
+    # }}}
+    # {{{ _packPatch(self, patch): XXX
+    def _packPatch(self, patch):
+        return (*patch[0:5], ord(patch[5]))
+    # }}}
+    # {{{ _readLog(self, logPathName): replay write-ahead log of current logGeneration, returning size of its valid prefix in bytes
+    def _readLog(self, logPathName):
+        try:
+            with open(logPathName, "rb") as logFile:
+                logData = logFile.read()
+        except OSError:
+            return 0
+        if len(logData) < self.LOG_HEADER.size                                  \
+        or self.LOG_HEADER.unpack_from(logData) != (self.LOG_MAGIC, self.LOG_VERSION, self.logGeneration):
+            return 0
+        logOffset = self.LOG_HEADER.size
+        while (logOffset + self.LOG_RECORD.size) <= len(logData):
+            recordType, recordLen = self.LOG_RECORD.unpack_from(logData, logOffset)
+            recordEnd = logOffset + self.LOG_RECORD.size + (recordLen * 4)
+            if recordEnd > len(logData):
+                break
+            recordInts = array("i", logData[logOffset + self.LOG_RECORD.size:recordEnd])
+            if recordType == self.LOG_PUSH:
+                undoLen = recordInts[0]
+                self.pushDeltas(                                                \
+                    self._unpackPatches(recordInts[1:undoLen + 1]),             \
+                    self._unpackPatches(recordInts[undoLen + 1:]))
+                self._applyPatches(self._unpackPatches(recordInts[undoLen + 1:]))
+            elif recordType == self.LOG_CELL:
+                undoPatch, redoPatch = self._unpackPatches(recordInts)
+                self.updateCurrentDeltas(undoPatch, redoPatch)
+                self._applyPatches([redoPatch])
+            elif recordType == self.LOG_UNDO:
+                self._applyPatches(self.popUndo())
+            elif recordType == self.LOG_REDO:
+                self._applyPatches(self.popRedo())
+            else:
+                break
+            logOffset = recordEnd; self.logRecords += 1;
+        return logOffset
+    # }}}
+    # {{{ _readSnapshot(self, pathName): load canvas map and undo levels from snapshot of pathName, returning False if missing, stale, or corrupt
+    def _readSnapshot(self, pathName):
+        try:
+            with open(pathName + self.SNAPSHOT_SUFFIX, "rb") as snapshotFile:
+                snapshotData = snapshotFile.read()
+            magic, version, logGeneration, fileSize, fileMtime, mapWidth, mapHeight, numLevels, undoLevel = \
+                self.SNAPSHOT_HEADER.unpack_from(snapshotData)
+            if  magic != self.SNAPSHOT_MAGIC or version != self.LOG_VERSION   \
+            or  (fileSize, fileMtime) != self._getLogStamp(pathName):
+                return False
+            numCells = mapWidth * mapHeight; snapshotOffset = self.SNAPSHOT_HEADER.size;
+            canvasMap = MiRCARTCanvasMap(); canvasMap.mapSize = [mapWidth, mapHeight];
+            for mapName, mapType in (("mapFg", "B"), ("mapBg", "B"), ("mapAttrs", "B"), ("mapChars", "I")):
+                mapArray = array(mapType)
+                mapArray.frombytes(snapshotData[snapshotOffset:snapshotOffset + (numCells * mapArray.itemsize)])
+                if len(mapArray) != numCells:
+                    return False
+                setattr(canvasMap, mapName, mapArray); snapshotOffset += numCells * mapArray.itemsize;
+            patchesUndo = deque()
+            for numLevel in range(numLevels):
+                deltaItem = []; deltaLens = self.SNAPSHOT_LEVEL.unpack_from(snapshotData, snapshotOffset);
+                snapshotOffset += self.SNAPSHOT_LEVEL.size
+                for deltaLen in deltaLens:
+                    deltaItem.append(array("i", snapshotData[snapshotOffset:snapshotOffset + (deltaLen * 4)]))
+                    if len(deltaItem[-1]) != deltaLen:
+                        return False
+                    snapshotOffset += deltaLen * 4
+                patchesUndo.append(deltaItem)
+        except (OSError, struct.error, ValueError):
+            return False
+        self.resetUndo()
+        self.logCanvasMap = canvasMap; self.logGeneration = logGeneration;
+        self.patchesUndo = patchesUndo; self.patchesUndoLevel = undoLevel;
+        self._memoryUsage = sum(self._getLevelSize(deltaItem) for deltaItem in patchesUndo)
+        return True
+    # }}}
+    # {{{ _resetLog(self): write snapshot of logCanvasMap and undo levels and start new, empty write-ahead log
+    def _resetLog(self):
+        self._packCurrentLevel()
+        if self.logFile != None:
+            self.logFile.close(); self.logFile = None;
+        self.logGeneration = time.time_ns(); self.logRecords = 0;
+        snapshotPathName = self.logPathName + self.SNAPSHOT_SUFFIX
+        with open(snapshotPathName + ".tmp", "wb") as snapshotFile:
+            snapshotFile.write(self.SNAPSHOT_HEADER.pack(                                   \
+                self.SNAPSHOT_MAGIC, self.LOG_VERSION, self.logGeneration,                  \
+                *self._getLogStamp(self.logPathName), *self.logCanvasMap.mapSize,           \
+                len(self.patchesUndo), self.patchesUndoLevel))
+            for mapArray in (self.logCanvasMap.mapFg, self.logCanvasMap.mapBg,              \
+                             self.logCanvasMap.mapAttrs, self.logCanvasMap.mapChars):
+                snapshotFile.write(mapArray.tobytes())
+            for deltaItem in self.patchesUndo:
+                snapshotFile.write(self.SNAPSHOT_LEVEL.pack(len(deltaItem[0]), len(deltaItem[1])))
+                snapshotFile.write(deltaItem[0].tobytes()); snapshotFile.write(deltaItem[1].tobytes());
+        os.replace(snapshotPathName + ".tmp", snapshotPathName)
+        self.logFile = open(self.logPathName + self.LOG_SUFFIX, "wb")
+        self.logFile.write(self.LOG_HEADER.pack(self.LOG_MAGIC, self.LOG_VERSION, self.logGeneration))
+        self.logFile.flush()
+    # }}}
+    # {{{ _unpackPatches(self, patchesPacked): XXX
+    def _unpackPatches(self, patchesPacked):
+        return [[*patchesPacked[numPatch:numPatch + 5], chr(patchesPacked[numPatch + 5])]  \
+                for numPatch in range(0, len(patchesPacked), self.PATCH_INTS)]
+    # }}}
+
+    # {{{ attachLog(self, pathName, canvasMap): snapshot canvasMap and undo levels next to canvas file pathName and log subsequent changes; returns False on I/O error
+    def attachLog(self, pathName, canvasMap):
+        self.closeLog()
+        self.logCanvasMap = canvasMap; self.logPathName = pathName;
+        try:
+            self._resetLog()
+            return True
+        except OSError:
+            self.closeLog()
+            return False
+    # }}}
+    # {{{ closeLog(self): XXX
+    def closeLog(self):
+        if self.logFile != None:
+            self.logFile.close()
+        self.logCanvasMap = self.logFile = self.logGeneration = self.logPathName = None
+        self.logRecords = 0
+    # }}}
+    # {{{ discardLog(self): close write-ahead log and delete it and its snapshot, e.g. when changes to the canvas file are discarded
+    def discardLog(self):
+        logPathName = self.logPathName
+        self.closeLog()
+        if logPathName != None:
+            for logSuffix in (self.SNAPSHOT_SUFFIX, self.LOG_SUFFIX):
+                try:
+                    os.remove(logPathName + logSuffix)
+                except OSError:
+                    pass
+    # }}}
+    # {{{ flushLog(self): XXX
+    def flushLog(self):
+        if self.logFile != None:
+            self.logFile.flush()
+    # }}}
+    # {{{ getHistory(self): return list of [undo patches, redo patches] of undo levels not undone, oldest first
+    def getHistory(self):
+        self._packCurrentLevel()
+        return [[self._unpackPatches(deltaItem[0]), self._unpackPatches(deltaItem[1])]   \
+                for deltaItem in list(self.patchesUndo)[:len(self.patchesUndo) - self.patchesUndoLevel]]
+    # }}}
+    # {{{ getMemoryUsage(self): return approximate size of undo journal patch data in bytes
+    def getMemoryUsage(self):
+        return self._memoryUsage + (len(self._currentCells) * self.PATCH_INTS * 2 * 4)
+    # }}}
+    # {{{ getResizePatch(self, canvasSize): return pseudo-patch resizing the canvas to canvasSize
+    def getResizePatch(self, canvasSize):
+        return [self.PATCH_RESIZE, self.PATCH_RESIZE, *canvasSize[0:2], 0, " "]
+    # }}}
     # {{{ popCursor(self): XXX
     def popCursor(self):
         if len(self.patchesCursor):
@@ -39,17 +264,20 @@ class MiRCARTCanvasJournal():
     def popRedo(self):
         if self.patchesUndoLevel > 0:
             self.patchesUndoLevel -= 1
-            patches = self.patchesUndo[self.patchesUndoLevel]
-            return patches[1]
+            patches = self.patchesUndo[-1 - self.patchesUndoLevel]
+            self._logRecord(self.LOG_REDO, ()); self.flushLog();
+            return self._unpackPatches(patches[1])
         else:
             return []
     # }}}
     # {{{ popUndo(self): XXX
     def popUndo(self):
-        if self.patchesUndo[self.patchesUndoLevel] != None:
-            patches = self.patchesUndo[self.patchesUndoLevel]
+        self._packCurrentLevel()
+        if self.patchesUndoLevel < len(self.patchesUndo):
+            patches = self.patchesUndo[-1 - self.patchesUndoLevel]
             self.patchesUndoLevel += 1
-            return patches[0]
+            self._logRecord(self.LOG_UNDO, ()); self.flushLog();
+            return self._unpackPatches(patches[0])
         else:
             return []
     # }}}
@@ -57,15 +285,57 @@ class MiRCARTCanvasJournal():
     def pushCursor(self, patches):
         self.patchesCursor.append(patches)
     # }}}
-    # {{{ pushDeltas(self, undoPatches, redoPatches): XXX
+    # {{{ pushDeltas(self, undoPatches, redoPatches): begin new undo level, discarding undone levels
     def pushDeltas(self, undoPatches, redoPatches):
-        if self.patchesUndoLevel > 0:
-            del self.patchesUndo[0:self.patchesUndoLevel]
-            self.patchesUndoLevel = 0
-        deltaItem = [undoPatches, redoPatches]
-        self.patchesUndo.insert(0, deltaItem)
+        self._packCurrentLevel()
+        if  self.logFile != None                                \
+        and self.logRecords >= self.logCompactInterval:
+            self._resetLog()
+        while self.patchesUndoLevel > 0:
+            self._memoryUsage -= self._getLevelSize(self.patchesUndo.pop())
+            self.patchesUndoLevel -= 1
+        deltaItem = [array("i"), array("i")]
+        for patch in undoPatches:
+            deltaItem[0].extend(self._packPatch(patch))
+        for patch in redoPatches:
+            deltaItem[1].extend(self._packPatch(patch))
+        self.patchesUndo.append(deltaItem)
+        self._memoryUsage += self._getLevelSize(deltaItem)
+        self._logRecord(self.LOG_PUSH, array("i", [len(deltaItem[0])]) + deltaItem[0] + deltaItem[1])
+        self.flushLog()
+        self._evictLevels()
         return deltaItem
     # }}}
+    # {{{ restoreLog(self, pathName): restore canvas map and undo levels from snapshot and write-ahead log next to canvas file pathName and keep logging; returns canvas map or None if missing or stale
+    def restoreLog(self, pathName):
+        self.closeLog()
+        if not self._readSnapshot(pathName):
+            self.resetUndo()
+            return None
+        canvasMap = self.logCanvasMap; self.logPathName = pathName;
+        logPathName = pathName + self.LOG_SUFFIX
+        logOffset = self._readLog(logPathName)
+        try:
+            if logOffset > 0:
+                self.logFile = open(logPathName, "r+b")
+                self.logFile.truncate(logOffset); self.logFile.seek(logOffset);
+            else:
+                self._resetLog()
+        except OSError:
+            self.closeLog()
+        return canvasMap
+    # }}}
+    # {{{ readLog(self, pathName): restore canvas map and undo levels from snapshot and write-ahead log next to canvas file pathName w/o modifying or logging to them; returns canvas map or None if missing or stale
+    def readLog(self, pathName):
+        self.closeLog()
+        if not self._readSnapshot(pathName):
+            self.resetUndo()
+            return None
+        canvasMap = self.logCanvasMap
+        self._readLog(pathName + self.LOG_SUFFIX)
+        self.closeLog()
+        return canvasMap
+    # }}}
     # {{{ resetCursor(self): XXX
     def resetCursor(self):
         if self.patchesCursor != None:
@@ -76,22 +346,30 @@ class MiRCARTCanvasJournal():
     def resetUndo(self):
         if self.patchesUndo != None:
             self.patchesUndo.clear()
-        self.patchesUndo = [None]; self.patchesUndoLevel = 0;
+        self._currentCells = {}; self._memoryUsage = 0;
+        self.patchesUndo = deque(); self.patchesUndoLevel = 0;
     # }}}
-    # {{{ updateCurrentDeltas(self, undoPatches, redoPatches): XXX
+    # {{{ updateCurrentDeltas(self, undoPatches, redoPatches): record single cell patch in current undo level, keeping the oldest undo and newest redo patch per cell
     def updateCurrentDeltas(self, undoPatches, redoPatches):
-        self.patchesUndo[0][0].append(undoPatches)
-        self.patchesUndo[0][1].append(redoPatches)
+        cellKey = (undoPatches[0], undoPatches[1])
+        cellDeltas = self._currentCells.get(cellKey)
+        if cellDeltas == None:
+            self._currentCells[cellKey] = [undoPatches, redoPatches]
+        else:
+            cellDeltas[1] = redoPatches
+        self._logRecord(self.LOG_CELL, (*self._packPatch(undoPatches), *self._packPatch(redoPatches)))
     # }}}
 
     # {{{ __del__(self): destructor method
     def __del__(self):
-        self.resetCursor(); self.resetUndo();
+        self.closeLog(); self.resetCursor(); self.resetUndo();
     # }}}
 
     #
-    # __init__(self): initialisation method
-    def __init__(self):
+    # __init__(self, memoryBudget=(16 * 1024 * 1024), logCompactInterval=65536): initialisation method
+    def __init__(self, memoryBudget=(16 * 1024 * 1024), logCompactInterval=65536):
+        self.logCompactInterval = logCompactInterval; self.logRecords = 0;
+        self.memoryBudget = memoryBudget
         self.resetCursor(); self.resetUndo();
 
 # vim:expandtab foldmethod=marker sw=4 ts=4 tw=120
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+#
+# MiRCARTCanvasMap.py -- packed, array-backed store of canvas cells
+# Copyright (c) 2018 Lucio Andrés Illanes Albornoz <lucio@lucioillanes.de>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from array import array
+import struct, sys
+
+class MiRCARTCanvasMap():
+    """Packed, array-backed store of canvas cells w/ nested list-compatible row/cell views"""
+    mapAttrs = mapBg = mapChars = mapFg = None
+    mapSize = None
+
+    #
+    # Binary canvas file suffix, header (magic, version, width, height, number of palette colours), and version;
+    # the header is followed by one RGBA quadruple per palette colour, then the little endian uint32 codepoint
+    # array, and finally the fg, bg, and attrs byte arrays, keeping every array naturally aligned
+    BINARY_SUFFIX = ".mrb"
+    BINARY_HEADER = struct.Struct("<8sIIII"); BINARY_MAGIC = b"MiRCARTB";
+    BINARY_VERSION = 1
+
+    #
+    # Default cell: black on black space w/o attributes
+    cellDefault = (1, 1, 0, " ")
+
+    #
+    # _RowView(): View over single canvas row, indexable like a list of [fg, bg, attrs, char] cells
+    class _RowView():
+        parentMap = numRow = None
+
+        # {{{ __getitem__(self, numCol): XXX
+        def __getitem__(self, numCol):
+            if isinstance(numCol, slice):
+                return [self.parentMap.getCell(curCol, self.numRow)    \
+                        for curCol in range(*numCol.indices(self.parentMap.mapSize[0]))]
+            else:
+                if numCol < 0:
+                    numCol += self.parentMap.mapSize[0]
+                if numCol < 0 or numCol >= self.parentMap.mapSize[0]:
+                    raise IndexError("canvas column index out of range")
+                return self.parentMap.getCell(numCol, self.numRow)
+        # }}}
+        # {{{ __iter__(self): XXX
+        def __iter__(self):
+            for cell in self.parentMap.getRowCells(self.numRow):
+                yield list(cell)
+        # }}}
+        # {{{ __len__(self): XXX
+        def __len__(self):
+            return self.parentMap.mapSize[0]
+        # }}}
+        # {{{ __setitem__(self, numCol, cell): XXX
+        def __setitem__(self, numCol, cell):
+            if numCol < 0:
+                numCol += self.parentMap.mapSize[0]
+            self.parentMap.setCell(numCol, self.numRow, *cell)
+        # }}}
+
+        #
+        # __init__(self, parentMap, numRow): initialisation method
+        def __init__(self, parentMap, numRow):
+            self.parentMap = parentMap; self.numRow = numRow;
+
+    # {{{ _cellRange(self, numRow, numCol=0, numCols=None): XXX
+    def _cellRange(self, numRow, numCol=0, numCols=None):
+        if numCols == None:
+            numCols = self.mapSize[0] - numCol
+        cellOffset = (numRow * self.mapSize[0]) + numCol
+        return slice(cellOffset, cellOffset + numCols)
+    # }}}
+    # {{{ _unmapArrays(self): replace memoryview cell arrays of map loaded by fromBuffer() w/ resizable copies; mapChars is already an array on big endian hosts
+    def _unmapArrays(self):
+        if isinstance(self.mapFg, memoryview):
+            self.mapFg, self.mapBg, self.mapAttrs, self.mapChars =                                          \
+                [array(mapView.format, mapView.tobytes()) if isinstance(mapView, memoryview) else mapView   \
+                 for mapView in (self.mapFg, self.mapBg, self.mapAttrs, self.mapChars)]
+    # }}}
+
+    # {{{ appendRow(self, rowFg, rowBg, rowAttrs, rowChars): append single row of parallel sequences, growing the canvas width as required
+    def appendRow(self, rowFg, rowBg, rowAttrs, rowChars):
+        self._unmapArrays()
+        rowCols = len(rowFg)
+        if rowCols > self.mapSize[0]:
+            self.resize([rowCols, self.mapSize[1]])
+        padCols = self.mapSize[0] - rowCols
+        self.mapFg.extend(rowFg); self.mapFg.extend(array("B", [self.cellDefault[0]]) * padCols);
+        self.mapBg.extend(rowBg); self.mapBg.extend(array("B", [self.cellDefault[1]]) * padCols);
+        self.mapAttrs.extend(rowAttrs); self.mapAttrs.extend(array("B", [self.cellDefault[2]]) * padCols);
+        self.mapChars.extend(rowChars); self.mapChars.extend(array("I", [ord(self.cellDefault[3])]) * padCols);
+        self.mapSize[1] += 1
+    # }}}
+    # {{{ applyPatch(self, patch): apply single [x, y, fg, bg, attrs, char] patch, returning False if out of bounds
+    def applyPatch(self, patch):
+        if  patch[0] >= 0 and patch[0] < self.mapSize[0]    \
+        and patch[1] >= 0 and patch[1] < self.mapSize[1]:
+            self.setCell(*patch)
+            return True
+        else:
+            return False
+    # }}}
+    # {{{ copy(self): XXX
+    def copy(self):
+        newMap = MiRCARTCanvasMap()
+        newMap.mapSize = list(self.mapSize)
+        newMap.mapFg = array("B", self.mapFg); newMap.mapBg = array("B", self.mapBg);
+        newMap.mapAttrs = array("B", self.mapAttrs); newMap.mapChars = array("I", self.mapChars);
+        return newMap
+    # }}}
+    # {{{ fill(self, rect, cell=None): fill [[x0, y0], [x1, y1]] (inclusive) w/ single cell
+    def fill(self, rect, cell=None):
+        cell = cell or self.cellDefault
+        numCol = max(rect[0][0], 0); numCols = min(rect[1][0] + 1, self.mapSize[0]) - numCol;
+        if numCols > 0:
+            for numRow in range(max(rect[0][1], 0), min(rect[1][1] + 1, self.mapSize[1])):
+                cellRange = self._cellRange(numRow, numCol, numCols)
+                self.mapFg[cellRange] = array("B", [cell[0]]) * numCols
+                self.mapBg[cellRange] = array("B", [cell[1]]) * numCols
+                self.mapAttrs[cellRange] = array("B", [cell[2]]) * numCols
+                self.mapChars[cellRange] = array("I", [ord(cell[3])]) * numCols
+    # }}}
+    # {{{ fromBuffer(mapSize, mapBuffer, mapOffset=0): return map whose cell arrays are memoryviews into mapBuffer at mapOffset laid out as in binary canvas files, copying only if byte order differs
+    @staticmethod
+    def fromBuffer(mapSize, mapBuffer, mapOffset=0):
+        newMap = MiRCARTCanvasMap(); newMap.mapSize = list(mapSize);
+        numCells = mapSize[0] * mapSize[1]; mapView = memoryview(mapBuffer)[mapOffset:];
+        if len(mapView) < (numCells * 7):
+            raise ValueError("truncated canvas cell arrays")
+        if sys.byteorder == "little":
+            newMap.mapChars = mapView[:numCells * 4].cast("I")
+        else:
+            newMap.mapChars = array("I", mapView[:numCells * 4]); newMap.mapChars.byteswap();
+        newMap.mapFg = mapView[numCells * 4:numCells * 5]
+        newMap.mapBg = mapView[numCells * 5:numCells * 6]
+        newMap.mapAttrs = mapView[numCells * 6:numCells * 7]
+        return newMap
+    # }}}
+    # {{{ fromList(self, cells): XXX
+    @staticmethod
+    def fromList(cells):
+        newMap = MiRCARTCanvasMap()
+        for cellRow in cells:
+            newMap.appendRow(                           \
+                [cell[0] for cell in cellRow],          \
+                [cell[1] for cell in cellRow],          \
+                [cell[2] for cell in cellRow],          \
+                [ord(cell[3]) for cell in cellRow])
+        return newMap
+    # }}}
+    # {{{ getCell(self, numCol, numRow): XXX
+    def getCell(self, numCol, numRow):
+        cellOffset = (numRow * self.mapSize[0]) + numCol
+        return [self.mapFg[cellOffset], self.mapBg[cellOffset],    \
+                self.mapAttrs[cellOffset], chr(self.mapChars[cellOffset])]
+    # }}}
+    # {{{ getMemoryUsage(self): return size of cell arrays in bytes
+    def getMemoryUsage(self):
+        return sum(a.itemsize * len(a) for a in (self.mapFg, self.mapBg, self.mapAttrs, self.mapChars))
+    # }}}
+    # {{{ getRow(self, numRow, numCol=0, numCols=None): return (fg, bg, attrs, codepoints) array slices of single row
+    def getRow(self, numRow, numCol=0, numCols=None):
+        cellRange = self._cellRange(numRow, numCol, numCols)
+        if isinstance(self.mapFg, memoryview):
+            return tuple(array(mapView.format, mapView[cellRange].tobytes())                    \
+                         if isinstance(mapView, memoryview) else mapView[cellRange]             \
+                         for mapView in (self.mapFg, self.mapBg, self.mapAttrs, self.mapChars))
+        else:
+            return (self.mapFg[cellRange], self.mapBg[cellRange],              \
+                    self.mapAttrs[cellRange], self.mapChars[cellRange])
+    # }}}
+    # {{{ getRowCells(self, numRow, numCol=0, numCols=None): iterate over single row as (fg, bg, attrs, char) tuples
+    def getRowCells(self, numRow, numCol=0, numCols=None):
+        rowFg, rowBg, rowAttrs, rowChars = self.getRow(numRow, numCol, numCols)
+        return zip(rowFg, rowBg, rowAttrs, map(chr, rowChars))
+    # }}}
+    # {{{ resize(self, newSize, atPoint=(0, 0)): resize to newSize, placing old cells at atPoint and filling new cells w/ cellDefault
+    def resize(self, newSize, atPoint=(0, 0)):
+        self._unmapArrays()
+        oldSize = self.mapSize; newSize = list(newSize);
+        if oldSize[0] == newSize[0] and tuple(atPoint) == (0, 0):
+            numCells = newSize[0] * newSize[1]; oldCells = len(self.mapFg);
+            if numCells < oldCells:
+                for mapArray in (self.mapFg, self.mapBg, self.mapAttrs, self.mapChars):
+                    del mapArray[numCells:]
+            elif numCells > oldCells:
+                self.mapFg.extend(array("B", [self.cellDefault[0]]) * (numCells - oldCells))
+                self.mapBg.extend(array("B", [self.cellDefault[1]]) * (numCells - oldCells))
+                self.mapAttrs.extend(array("B", [self.cellDefault[2]]) * (numCells - oldCells))
+                self.mapChars.extend(array("I", [ord(self.cellDefault[3])]) * (numCells - oldCells))
+            self.mapSize = newSize
+        else:
+            newMap = MiRCARTCanvasMap(newSize)
+            srcCol = max(-atPoint[0], 0); dstCol = max(atPoint[0], 0);
+            numCols = min(oldSize[0] - srcCol, newSize[0] - dstCol)
+            if numCols > 0:
+                for srcRow in range(max(-atPoint[1], 0), oldSize[1]):
+                    dstRow = srcRow + atPoint[1]
+                    if dstRow >= newSize[1]:
+                        break
+                    newMap.setRow(dstRow, *self.getRow(srcRow, srcCol, numCols), numCol=dstCol)
+            self.mapFg, self.mapBg, self.mapAttrs, self.mapChars =     \
+                newMap.mapFg, newMap.mapBg, newMap.mapAttrs, newMap.mapChars
+            self.mapSize = newSize
+    # }}}
+    # {{{ setCell(self, numCol, numRow, fg, bg, attrs, char): XXX
+    def setCell(self, numCol, numRow, fg, bg, attrs, char):
+        cellOffset = (numRow * self.mapSize[0]) + numCol
+        self.mapFg[cellOffset] = fg; self.mapBg[cellOffset] = bg;
+        self.mapAttrs[cellOffset] = attrs; self.mapChars[cellOffset] = ord(char);
+    # }}}
+    # {{{ setRow(self, numRow, rowFg, rowBg, rowAttrs, rowChars, numCol=0): overwrite (part of) single row from (fg, bg, attrs, codepoints) arrays
+    def setRow(self, numRow, rowFg, rowBg, rowAttrs, rowChars, numCol=0):
+        cellRange = self._cellRange(numRow, numCol, len(rowFg))
+        self.mapFg[cellRange] = rowFg; self.mapBg[cellRange] = rowBg;
+        self.mapAttrs[cellRange] = rowAttrs; self.mapChars[cellRange] = rowChars;
+    # }}}
+    # {{{ toBinary(self, palette): return binary canvas file contents w/ RGBA palette
+    def toBinary(self, palette):
+        mapChars = array("I", self.mapChars.tobytes())
+        if sys.byteorder != "little":
+            mapChars.byteswap()
+        return b"".join([                                                                                 \
+            self.BINARY_HEADER.pack(self.BINARY_MAGIC, self.BINARY_VERSION, *self.mapSize, len(palette)), \
+            bytes([component for colour in palette for component in colour[0:4]]), mapChars.tobytes(),    \
+            bytes(self.mapFg), bytes(self.mapBg), bytes(self.mapAttrs)])
+    # }}}
+    # {{{ toList(self): XXX
+    def toList(self):
+        return [[list(cell) for cell in self.getRowCells(numRow)]  \
+                for numRow in range(self.mapSize[1])]
+    # }}}
+
+    # {{{ __getitem__(self, numRow): XXX
+    def __getitem__(self, numRow):
+        if numRow < 0:
+            numRow += self.mapSize[1]
+        if numRow < 0 or numRow >= self.mapSize[1]:
+            raise IndexError("canvas row index out of range")
+        return self._RowView(self, numRow)
+    # }}}
+    # {{{ __iter__(self): XXX
+    def __iter__(self):
+        for numRow in range(self.mapSize[1]):
+            yield self._RowView(self, numRow)
+    # }}}
+    # {{{ __len__(self): XXX
+    def __len__(self):
+        return self.mapSize[1]
+    # }}}
+
+    #
+    # __init__(self, mapSize=(0, 0)): initialisation method
+    def __init__(self, mapSize=(0, 0)):
+        self.mapSize = list(mapSize); numCells = self.mapSize[0] * self.mapSize[1];
+        self.mapFg = array("B", [self.cellDefault[0]]) * numCells
+        self.mapBg = array("B", [self.cellDefault[1]]) * numCells
+        self.mapAttrs = array("B", [self.cellDefault[2]]) * numCells
+        self.mapChars = array("I", [ord(self.cellDefault[3])]) * numCells
+
+# vim:expandtab foldmethod=marker sw=4 ts=4 tw=120
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+#
+# MiRCARTCanvasModel.py -- headless canvas model: cell map, journal, and tool dispatch
+# Copyright (c) 2018 Lucio Andrés Illanes Albornoz <lucio@lucioillanes.de>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from MiRCARTCanvasJournal import MiRCARTCanvasJournal
+from MiRCARTCanvasMap import MiRCARTCanvasMap
+
+class MiRCARTCanvasModel():
+    """Canvas cell map, undo journal, and tool dispatch w/o any dependency on wx; drawing is delegated to an optional view"""
+    brushColours = brushPos = brushSize = None
+    canvasDirty = canvasDirtyCursor = None
+    canvasJournal = canvasMap = canvasSize = canvasView = None
+    logEnabled = None
+
+    # {{{ _dispatchPatch(self, eventDc, isCursor, patch): dispatch single patch from tool, committing it to canvasMap and journal unless isCursor
+    def _dispatchPatch(self, eventDc, isCursor, patch):
+        if not self.canvasDirtyCursor:
+            self.restoreCursor(eventDc)
+            self.canvasDirtyCursor = True
+        if  patch[0] >= 0 and patch[0] < self.canvasSize[0]     \
+        and patch[1] >= 0 and patch[1] < self.canvasSize[1]:
+            patchDelta = [*patch[0:2], *self.canvasMap.getCell(patch[0], patch[1])]
+            if isCursor:
+                if self.canvasView != None:
+                    self.canvasJournal.pushCursor(patchDelta)
+                    self.canvasView.drawPatch(eventDc, patch)
+            else:
+                if not self.canvasDirty:
+                    self.canvasJournal.pushDeltas([], [])
+                    self.canvasDirty = True
+                self.canvasJournal.updateCurrentDeltas(patchDelta, patch)
+                self.canvasMap.setCell(*patch)
+                if self.canvasView != None:
+                    self.canvasView.drawPatch(eventDc, patch)
+    # }}}
+
+    # {{{ appendRows(self, inRows): append rows of (fg, bg, attrs, codepoints) sequences w/o journaling them, growing the canvas as required
+    def appendRows(self, inRows):
+        for inRow in inRows:
+            self.canvasMap.appendRow(*inRow)
+        self.canvasSize = list(self.canvasMap.mapSize)
+    # }}}
+    # {{{ applyPatches(self, deltaPatches, eventDc=None): apply patches and resize pseudo-patches w/o journaling them, e.g. from undo or redo
+    def applyPatches(self, deltaPatches, eventDc=None):
+        for patch in deltaPatches:
+            if patch[0] == self.canvasJournal.PATCH_RESIZE:
+                self.resize(patch[2:4], commitUndo=False, eventDc=eventDc)
+            elif self.canvasMap.applyPatch(patch)   \
+            and  self.canvasView != None:
+                self.canvasView.drawPatch(eventDc, patch)
+        return len(deltaPatches) > 0
+    # }}}
+    # {{{ attachLog(self, pathName): log changes to write-ahead log next to canvas file pathName from now on if logEnabled
+    def attachLog(self, pathName):
+        if self.logEnabled:
+            return self.canvasJournal.attachLog(pathName, self.canvasMap)
+        else:
+            return False
+    # }}}
+    # {{{ discardLog(self): stop logging and delete write-ahead log and snapshot next to canvas file, if any
+    def discardLog(self):
+        self.canvasJournal.discardLog()
+    # }}}
+    # {{{ dispatchKeyboardEvent(self, tool, event, keyChar, eventDc=None): dispatch key press at brushPos to tool; returns True if tool ignored it
+    def dispatchKeyboardEvent(self, tool, event, keyChar, eventDc=None):
+        self.canvasDirty = self.canvasDirtyCursor = False
+        doSkip = tool.onKeyboardEvent(                                      \
+            event, self.brushPos, self.brushColours, self.brushSize,        \
+            keyChar, self._dispatchPatch, eventDc)
+        self.canvasJournal.flushLog()
+        return doSkip
+    # }}}
+    # {{{ dispatchMouseEvent(self, tool, event, mapPoint, isDragging=False, isLeftDown=False, isRightDown=False, eventDc=None): dispatch mouse event at mapPoint to tool; returns False if mapPoint is outside of canvas
+    def dispatchMouseEvent(self, tool, event, mapPoint, isDragging=False, isLeftDown=False, isRightDown=False, eventDc=None):
+        self.canvasDirty = self.canvasDirtyCursor = False
+        if  mapPoint[0] >= self.canvasSize[0]                               \
+        or  mapPoint[1] >= self.canvasSize[1]:
+            return False
+        self.brushPos = mapPoint
+        tool.onMouseEvent(                                                  \
+            event, mapPoint, self.brushColours, self.brushSize,             \
+            isDragging, isLeftDown, isRightDown, self._dispatchPatch, eventDc)
+        self.canvasJournal.flushLog()
+        return True
+    # }}}
+    # {{{ redo(self, eventDc=None): XXX
+    def redo(self, eventDc=None):
+        return self.applyPatches(self.canvasJournal.popRedo(), eventDc)
+    # }}}
+    # {{{ reset(self, newCanvasSize, newCanvas=None): reset canvas to newCanvasSize blank cells, adopting newCanvas if of newCanvasSize and copying it otherwise, and reset journal
+    def reset(self, newCanvasSize, newCanvas=None):
+        self.canvasJournal.closeLog()
+        self.canvasJournal.resetCursor(); self.canvasJournal.resetUndo();
+        if  newCanvas != None                                   \
+        and list(newCanvas.mapSize) == list(newCanvasSize):
+            self.canvasMap = newCanvas; self.canvasSize = list(newCanvasSize);
+            return
+        self.canvasMap.resize(newCanvasSize); self.canvasSize = list(newCanvasSize);
+        self.canvasMap.fill([[0, 0], [x - 1 for x in self.canvasSize]])
+        if newCanvas != None:
+            numCols = min(newCanvas.mapSize[0], self.canvasSize[0])
+            for numRow in range(min(newCanvas.mapSize[1], self.canvasSize[1])):
+                self.canvasMap.setRow(numRow, *newCanvas.getRow(numRow, 0, numCols))
+    # }}}
+    # {{{ resize(self, newCanvasSize, commitUndo=True, eventDc=None): resize canvas, recording cropped cells in the journal; returns False if unchanged
+    def resize(self, newCanvasSize, commitUndo=True, eventDc=None):
+        newCanvasSize = list(newCanvasSize)
+        if newCanvasSize == list(self.canvasSize):
+            return False
+        oldCanvasSize = list(self.canvasSize)
+        if commitUndo:
+            undoPatches = [self.canvasJournal.getResizePatch(oldCanvasSize)]
+            for numRow in range(oldCanvasSize[1]):
+                numCol = newCanvasSize[0] if numRow < newCanvasSize[1] else 0
+                for numCropCol, cell in enumerate(                                  \
+                        self.canvasMap.getRowCells(numRow, numCol, oldCanvasSize[0] - numCol), numCol):
+                    undoPatches.append([numCropCol, numRow, *cell])
+            self.canvasJournal.pushDeltas(undoPatches,                              \
+                [self.canvasJournal.getResizePatch(newCanvasSize)])
+        self.restoreCursor(eventDc)
+        self.canvasMap.resize(newCanvasSize); self.canvasSize = newCanvasSize;
+        if self.canvasView != None:
+            self.canvasView.onModelResize(eventDc, newCanvasSize)
+        return True
+    # }}}
+    # {{{ restoreCursor(self, eventDc=None): redraw cells beneath cursor patches
+    def restoreCursor(self, eventDc=None):
+        for patch in self.canvasJournal.popCursor():
+            if self.canvasView != None:
+                self.canvasView.drawPatch(eventDc, patch)
+    # }}}
+    # {{{ restoreLog(self, pathName): restore canvas and undo levels from write-ahead log next to canvas file pathName if logEnabled; returns False if disabled, missing, or stale
+    def restoreLog(self, pathName):
+        if not self.logEnabled:
+            return False
+        newMap = self.canvasJournal.restoreLog(pathName)
+        if newMap != None:
+            self.canvasJournal.resetCursor()
+            self.canvasMap = newMap; self.canvasSize = list(newMap.mapSize);
+            return True
+        else:
+            return False
+    # }}}
+    # {{{ undo(self, eventDc=None): XXX
+    def undo(self, eventDc=None):
+        return self.applyPatches(self.canvasJournal.popUndo(), eventDc)
+    # }}}
+
+    #
+    # __init__(self, canvasSize, canvasView=None, logEnabled=False): initialisation method; canvasView implements drawPatch(eventDc, patch) and onModelResize(eventDc, newCanvasSize); logEnabled enables write-ahead logging of the undo journal next to canvas files
+    def __init__(self, canvasSize, canvasView=None, logEnabled=False):
+        self.brushColours = [4, 1]; self.brushPos = [0, 0]; self.brushSize = [1, 1];
+        self.canvasDirty = self.canvasDirtyCursor = False
+        self.canvasJournal = MiRCARTCanvasJournal()
+        self.canvasMap = MiRCARTCanvasMap(canvasSize); self.canvasSize = list(canvasSize);
+        self.canvasView = canvasView; self.logEnabled = logEnabled;
+
+# vim:expandtab foldmethod=marker sw=4 ts=4 tw=120
@@ -178,7 +178,7 @@ class MiRCARTFrame(MiRCARTGeneralFrame):
         else:
             self.itemsById[eventId][7](self.panelCanvas.canvasInterface, event)
     # }}}
-    # {{{ onCanvasUpdate(self, newBrushSize=None, newCellPos=None, newColours=None, newPathName=None, newSize=None, newToolName=None, newUndoLevel=None): XXX
+    # {{{ onCanvasUpdate(self, newBrushSize=None, newCellPos=None, newColours=None, newPathName=None, newRenderTime=None, newSize=None, newToolName=None, newUndoLevel=None): XXX
     def onCanvasUpdate(self, **kwargs):
         self.lastPanelState.update(kwargs)
         textItems = []
@@ -207,6 +207,9 @@ class MiRCARTFrame(MiRCARTGeneralFrame):
         if "toolName" in self.lastPanelState:
             textItems.append("Current tool: {}".format(                 \
                 self.lastPanelState["toolName"]))
+        if "renderTime" in self.lastPanelState:
+            textItems.append("Rendered in {:.0f} ms".format(            \
+                self.lastPanelState["renderTime"] * 1000))
         self.statusBar.SetStatusText(" | ".join(textItems))
         if "undoLevel" in self.lastPanelState: 
             if self.lastPanelState["undoLevel"] >= 0:
@@ -234,17 +237,17 @@ class MiRCARTFrame(MiRCARTGeneralFrame):
     # }}}
 
     #
-    # __init__(self, parent, appSize=(840, 630), defaultCanvasPos=(0, 75), defaultCanvasSize=(100, 30), defaultCellSize=(7, 14)): initialisation method
-    def __init__(self, parent, appSize=(840, 630), defaultCanvasPos=(0, 75), defaultCanvasSize=(100, 30), defaultCellSize=(7, 14)):
+    # __init__(self, parent, appSize=(840, 630), defaultCanvasPos=(0, 75), defaultCanvasSize=(100, 30), defaultCellSize=(7, 14), logEnabled=False, cacheEnabled=False): initialisation method
+    def __init__(self, parent, appSize=(840, 630), defaultCanvasPos=(0, 75), defaultCanvasSize=(100, 30), defaultCellSize=(7, 14), logEnabled=False, cacheEnabled=False):
         self._initPaletteToolBitmaps()
         self.panelSkin = super().__init__(parent, wx.ID_ANY, "MiRCART", size=appSize)
         self.panelCanvas = MiRCARTCanvas(self.panelSkin, parentFrame=self,      \
             defaultCanvasPos=defaultCanvasPos,                                  \
             defaultCanvasSize=defaultCanvasSize,                                \
-            defaultCellSize=defaultCellSize)
+            defaultCellSize=defaultCellSize, logEnabled=logEnabled, cacheEnabled=cacheEnabled)
         self.panelCanvas.canvasInterface.canvasNew(None)
         self.sizerSkin.AddSpacer(5)
-        self.sizerSkin.Add(self.panelCanvas, 0, wx.ALL|wx.EXPAND, 14)
+        self.sizerSkin.Add(self.panelCanvas, 1, wx.ALL|wx.EXPAND, 14)
         self.panelSkin.SetSizer(self.sizerSkin)
         self.panelSkin.SetAutoLayout(1)
         self.sizerSkin.Fit(self.panelSkin)
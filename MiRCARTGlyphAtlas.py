@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+#
+# MiRCARTGlyphAtlas.py -- process-wide cache of rasterised glyph masks per font and size
+# Copyright (c) 2018 Lucio Andrés Illanes Albornoz <lucio@lucioillanes.de>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from PIL import Image, ImageDraw, ImageFont
+
+try:
+    import numpy
+    haveNumPy = True
+except ImportError:
+    haveNumPy = False
+
+class MiRCARTGlyphAtlas():
+    """Pre-rasterised glyph alpha masks of single TrueType font and size, shared by all renderers in one process"""
+    cellSize = font = fontFilePath = fontSize = None
+    glyphHits = glyphMisses = None
+    _clippedMasks = _glyphMasks = None
+
+    #
+    # Atlases by (font file pathname, font size)
+    _atlases = {}
+
+    # {{{ _getMask(self, inChar): return (alpha mask, offset) of glyph as ImageDraw.text() would draw it
+    def _getMask(self, inChar):
+        if inChar not in self._glyphMasks:
+            glyphMask, glyphOffset = self.font.getmask2(inChar, "L")
+            glyphImg = Image.new("L", glyphMask.size, 0)
+            ImageDraw.Draw(glyphImg).text((-glyphOffset[0], -glyphOffset[1]), inChar, 255, self.font)
+            self._glyphMasks[inChar] = (glyphImg, glyphOffset)
+        return self._glyphMasks[inChar]
+    # }}}
+
+    # {{{ clear(self): drop all glyph masks and reset hit rate
+    def clear(self):
+        self._clippedMasks = {}; self._glyphMasks = {};
+        self.glyphHits = self.glyphMisses = 0
+    # }}}
+    # {{{ get(fontFilePath, fontSize): return shared atlas of font file pathname and size, loading the font on first use
+    @staticmethod
+    def get(fontFilePath, fontSize):
+        atlasKey = (fontFilePath, int(fontSize))
+        if atlasKey not in MiRCARTGlyphAtlas._atlases:
+            MiRCARTGlyphAtlas._atlases[atlasKey] = MiRCARTGlyphAtlas(*atlasKey)
+        return MiRCARTGlyphAtlas._atlases[atlasKey]
+    # }}}
+    # {{{ getClippedMask(self, inChar, isFirstCol, isLastCol, isLastRow, numUses=1): return (alpha mask, offset, cell-sized alpha array or None if reaching outside of cell) of glyph w/o the pixels later cells' rectangles would cover
+    def getClippedMask(self, inChar, isFirstCol, isLastCol, isLastRow, numUses=1):
+        glyphKey = (inChar, isFirstCol, isLastCol, isLastRow)
+        if glyphKey in self._clippedMasks:
+            self.glyphHits += numUses
+        else:
+            self.glyphHits += numUses - 1; self.glyphMisses += 1;
+            glyphImg, glyphOffset = self._getMask(inChar)
+            glyphAlpha = numpy.array(glyphImg)
+            glyphY = numpy.arange(glyphAlpha.shape[0])[:, None] + glyphOffset[1]
+            glyphX = numpy.arange(glyphAlpha.shape[1])[None, :] + glyphOffset[0]
+            if not isLastCol:
+                glyphAlpha[(glyphY >= 0) & (glyphY <= self.cellSize[1]) & (glyphX >= self.cellSize[0])] = 0
+            if not isLastRow:
+                glyphAlpha[(glyphY >= self.cellSize[1])                                 \
+                           & ((glyphX >= 0) | (not isFirstCol))                         \
+                           & ((glyphX <= self.cellSize[0]) | (not isLastCol))] = 0
+            glyphTile = None
+            if not ((glyphAlpha != 0) & ((glyphY < 0) | (glyphY >= self.cellSize[1]) | (glyphX < 0) | (glyphX >= self.cellSize[0]))).any():
+                glyphTile = numpy.zeros(self.cellSize[::-1], numpy.uint8); glyphHeight, glyphWidth = glyphAlpha.shape;
+                glyphTile[max(glyphOffset[1], 0):min(glyphOffset[1] + glyphHeight, self.cellSize[1]),      \
+                          max(glyphOffset[0], 0):min(glyphOffset[0] + glyphWidth, self.cellSize[0])] =     \
+                    glyphAlpha[max(-glyphOffset[1], 0):min(self.cellSize[1] - glyphOffset[1], glyphHeight),   \
+                               max(-glyphOffset[0], 0):min(self.cellSize[0] - glyphOffset[0], glyphWidth)]
+            self._clippedMasks[glyphKey] = (Image.fromarray(glyphAlpha, "L"), glyphOffset, glyphTile)
+        return self._clippedMasks[glyphKey]
+    # }}}
+    # {{{ getMask(self, inChar): return (alpha mask, offset) of glyph as ImageDraw.text() would draw it
+    def getMask(self, inChar):
+        if inChar in self._glyphMasks:
+            self.glyphHits += 1
+        else:
+            self.glyphMisses += 1
+        return self._getMask(inChar)
+    # }}}
+    # {{{ getStats(self): return (hits, misses, number of masks)
+    def getStats(self):
+        return (self.glyphHits, self.glyphMisses, len(self._glyphMasks) + len(self._clippedMasks))
+    # }}}
+
+    #
+    # __init__(self, fontFilePath, fontSize): initialisation method; use get() to share atlases
+    def __init__(self, fontFilePath, fontSize):
+        self.fontFilePath = fontFilePath; self.fontSize = int(fontSize);
+        self.font = ImageFont.truetype(self.fontFilePath, self.fontSize)
+        self.cellSize = [*self.font.getsize(" ")]
+        self.cellSize[1] += 3
+        self.clear()
+
+# vim:expandtab foldmethod=marker sw=4 ts=4 tw=120
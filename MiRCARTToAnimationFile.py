@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+#
+# MiRCARTToAnimationFile.py -- render time-lapse APNG or GIF animation of canvas undo journal history
+# Copyright (c) 2018 Lucio Andrés Illanes Albornoz <lucio@lucioillanes.de>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from MiRCARTCanvasJournal import MiRCARTCanvasJournal
+from MiRCARTToPngFile import MiRCARTToPngFile
+from PIL import Image
+import contextlib, getopt, io, struct, sys, zlib
+
+class MiRCARTToAnimationFile(MiRCARTToPngFile):
+    """Time-lapse animation renderer replaying the undo levels of a canvas journal, re-rendering only the cells each frame changes"""
+    inJournal = None
+    frameDelay = lastFrameDelay = levelsPerFrame = maxFrames = None
+
+    # {{{ _applyPatches(self, canvasMap, patches): apply patches and resize pseudo-patches to canvasMap, returning set of (x, y) of changed cells or None if resized
+    def _applyPatches(self, canvasMap, patches):
+        changedCells = set()
+        for patch in patches:
+            if patch[0] == MiRCARTCanvasJournal.PATCH_RESIZE:
+                if list(patch[2:4]) != list(canvasMap.mapSize):
+                    canvasMap.resize(patch[2:4]); changedCells = None;
+            elif patch[0] >= 0 and patch[0] < canvasMap.mapSize[0]      \
+            and  patch[1] >= 0 and patch[1] < canvasMap.mapSize[1]      \
+            and  canvasMap.getCell(patch[0], patch[1]) != list(patch[2:6]):
+                canvasMap.setCell(*patch)
+                if changedCells != None:
+                    changedCells.add((patch[0], patch[1]))
+        return changedCells
+    # }}}
+    # {{{ _drawCells(self, canvasMap, changedCells, outImg): redraw changed cells and their neighbours, which glyphs may reach into, from canvasMap into outImg, returning [x, y, width, height] pixel rectangle redrawn
+    def _drawCells(self, canvasMap, changedCells, outImg):
+        fontSize = self.outImgFontSize; mapSize = canvasMap.mapSize;
+        drawCells = sorted({(numRow, numCol) for cellX, cellY in changedCells                   \
+                            for numRow in range(max(cellY - 1, 0), min(cellY + 2, mapSize[1]))   \
+                            for numCol in range(max(cellX - 1, 0), min(cellX + 2, mapSize[0]))})
+        drawRuns = []
+        for numRow, numCol in drawCells:
+            if len(drawRuns) and drawRuns[-1][0] == numRow and (drawRuns[-1][1] + drawRuns[-1][2]) == numCol:
+                drawRuns[-1][2] += 1
+            else:
+                drawRuns.append([numRow, numCol, 1])
+        for numRow, numCol, numCols in drawRuns:
+            # Render run w/ the cells surrounding it, as glyphs of the latter may reach into it
+            firstCol = max(numCol - 1, 0); lastCol = min(numCol + numCols + 1, mapSize[0]);
+            firstRow = max(numRow - 1, 0); lastRow = min(numRow + 2, mapSize[1]);
+            runImg = Image.new("RGBA", ((lastCol - firstCol) * fontSize[0], (lastRow - firstRow) * fontSize[1]),  \
+                               (*self._ColourMapNormal[1], 255))
+            self._drawRows([canvasMap.getRow(curRow, firstCol, lastCol - firstCol)               \
+                            for curRow in range(firstRow, lastRow)], [0, 0], runImg)
+            runPos = [(numCol - firstCol) * fontSize[0], (numRow - firstRow) * fontSize[1]]
+            outImg.paste(runImg.crop((*runPos, runPos[0] + (numCols * fontSize[0]), runPos[1] + fontSize[1])),   \
+                         (numCol * fontSize[0], numRow * fontSize[1]))
+        drawRect = [min(drawRun[1] for drawRun in drawRuns), drawRuns[0][0],                   \
+                    max(drawRun[1] + drawRun[2] for drawRun in drawRuns), drawRuns[-1][0] + 1]
+        return [drawRect[0] * fontSize[0], drawRect[1] * fontSize[1],                           \
+                (drawRect[2] - drawRect[0]) * fontSize[0], (drawRect[3] - drawRect[1]) * fontSize[1]]
+    # }}}
+    # {{{ _drawMap(self, canvasMap, outImg): redraw all of canvasMap into outImg, clearing the area outside of it, returning [x, y, width, height] pixel rectangle redrawn
+    def _drawMap(self, canvasMap, outImg):
+        canvasImg = Image.new("RGBA", [a*b for a,b in zip(canvasMap.mapSize, self.outImgFontSize)], (*self._ColourMapNormal[1], 255))
+        self._drawRows([canvasMap.getRow(numRow) for numRow in range(canvasMap.mapSize[1])], [0, 0], canvasImg)
+        outImg.paste((*self._ColourMapNormal[1], 255), (0, 0, *outImg.size)); outImg.paste(canvasImg, (0, 0));
+        return [0, 0, *outImg.size]
+    # }}}
+    # {{{ _getGifImage(self, outImg, outRect): return GIF image descriptor and LZW-encoded image data of outRect of outImg mapped onto _PaletteFixed, as encoded by PIL
+    def _getGifImage(self, outImg, outRect):
+        frameImg = Image.frombytes("P", outRect[2:4], self._getScanlines(                      \
+            outImg.crop((*outRect[0:2], outRect[0] + outRect[2], outRect[1] + outRect[3])), self._PaletteFixed))
+        frameImg.putpalette([outComponent for outColour in self._PaletteFixed for outComponent in outColour])
+        gifFile = io.BytesIO(); frameImg.save(gifFile, "GIF", optimize=False); gifData = gifFile.getvalue();
+        gifOffset = 13 + ((3 << ((gifData[10] & 7) + 1)) if gifData[10] & 0x80 else 0)
+        while gifData[gifOffset] == 0x21:
+            gifOffset += 2
+            while gifData[gifOffset] != 0:
+                gifOffset += gifData[gifOffset] + 1
+            gifOffset += 1
+        imageOffset = gifOffset; gifOffset += 10;
+        if gifData[imageOffset + 9] & 0x80:
+            gifOffset += 3 << ((gifData[imageOffset + 9] & 7) + 1)
+        gifOffset += 1
+        while gifData[gifOffset] != 0:
+            gifOffset += gifData[gifOffset] + 1
+        return b"\x2c" + struct.pack("<HH", *outRect[0:2]) + gifData[imageOffset + 5:gifOffset + 1]
+    # }}}
+    # {{{ _getHistory(self): return (copy of inCanvasMap rewound to before its oldest undo level, list of redo patches per undo level, [width, height] of largest canvas)
+    def _getHistory(self):
+        canvasMap = self.inCanvasMap.copy(); canvasHistory = self.inJournal.getHistory();
+        canvasSize = list(canvasMap.mapSize)
+        for undoPatches, redoPatches in reversed(canvasHistory):
+            self._applyPatches(canvasMap, undoPatches)
+            for patch in undoPatches + redoPatches:
+                if patch[0] == MiRCARTCanvasJournal.PATCH_RESIZE:
+                    canvasSize = [max(canvasSize[0], patch[2]), max(canvasSize[1], patch[3])]
+        return (canvasMap, [redoPatches for undoPatches, redoPatches in canvasHistory], canvasSize)
+    # }}}
+    # {{{ _iterFrames(self): replay undo levels from the oldest one, levelsPerFrame at a time, yielding (frame image, [x, y, width, height] pixel rectangle changed since previous frame) per frame that changes any cells
+    def _iterFrames(self):
+        canvasMap, canvasHistory, canvasSize = self._getHistory()
+        outImg = Image.new("RGBA", [a*b for a,b in zip(canvasSize, self.outImgFontSize)], (*self._ColourMapNormal[1], 255))
+        yield outImg, self._drawMap(canvasMap, outImg)
+        levelsPerFrame = max(self.levelsPerFrame, -(-len(canvasHistory) // self.maxFrames) if self.maxFrames else 1)
+        for numLevel in range(0, len(canvasHistory), levelsPerFrame):
+            changedCells = set()
+            for redoPatches in canvasHistory[numLevel:numLevel + levelsPerFrame]:
+                levelCells = self._applyPatches(canvasMap, redoPatches)
+                changedCells = changedCells | levelCells if changedCells != None and levelCells != None else None
+            if changedCells == None:
+                yield outImg, self._drawMap(canvasMap, outImg)
+            elif len(changedCells):
+                yield outImg, self._drawCells(canvasMap, changedCells, outImg)
+    # }}}
+    # {{{ _writeApng(self, outFile): write animation as APNG image into binary file object outFile, each frame but the first covering the rectangle it changes
+    def _writeApng(self, outFile):
+        outBpp = 1 if self.outMode == "P" else 4; outFrames = [];
+        outPalette = self._PaletteFixed if self.outMode == "P" else None
+        for outImg, outRect in self._iterFrames():
+            outCompressor = zlib.compressobj(self.outCompressLevel, zlib.DEFLATED,             \
+                zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, self._ZlibStrategies[self.outZlibStrategy])
+            outData, outPrevRow = self._filterScanlines(self._getScanlines(                     \
+                outImg.crop((*outRect[0:2], outRect[0] + outRect[2], outRect[1] + outRect[3])), outPalette),  \
+                outRect[2] * outBpp, outBpp, None)
+            outFrames.append((outRect, outCompressor.compress(outData) + outCompressor.flush()))
+            outSize = outImg.size
+        self._writePngHeader(outFile, outSize, outPalette)
+        self._writePngChunk(outFile, b"acTL", struct.pack(">II", len(outFrames), 0))
+        numSequence = 0
+        for numFrame, (outRect, outData) in enumerate(outFrames):
+            self._writePngChunk(outFile, b"fcTL", struct.pack(">IIIIIHHBB", numSequence,       \
+                outRect[2], outRect[3], outRect[0], outRect[1],                                 \
+                self.lastFrameDelay if numFrame == (len(outFrames) - 1) else self.frameDelay, 1000, 0, 0))
+            if numFrame == 0:
+                self._writePngChunk(outFile, b"IDAT", outData); numSequence += 1;
+            else:
+                self._writePngChunk(outFile, b"fdAT", struct.pack(">I", numSequence + 1) + outData); numSequence += 2;
+        self._writePngChunk(outFile, b"IEND", b"")
+    # }}}
+    # {{{ _writeGif(self, outFile): write animation as looping GIF image w/ _PaletteFixed into binary file object outFile, each frame but the first covering the rectangle it changes
+    def _writeGif(self, outFile):
+        outFrames = []
+        for outImg, outRect in self._iterFrames():
+            outFrames.append(self._getGifImage(outImg, outRect)); outSize = outImg.size;
+        outFile.write(b"GIF89a" + struct.pack("<HHBBB", *outSize, 0xf7, 0, 0))
+        outFile.write(bytes(outComponent for outColour in self._PaletteFixed for outComponent in outColour))
+        outFile.write(b"\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00")
+        for numFrame, outData in enumerate(outFrames):
+            frameDelay = self.lastFrameDelay if numFrame == (len(outFrames) - 1) else self.frameDelay
+            outFile.write(struct.pack("<BBBBHBB", 0x21, 0xf9, 4, 1 << 2, (frameDelay + 5) // 10, 0, 0))
+            outFile.write(outData)
+        outFile.write(b"\x3b")
+    # }}}
+
+    # {{{ export(self, outFilePath): render animation into GIF image if file pathname outFilePath ends in .gif and APNG image otherwise, or into binary file object outFilePath as APNG image
+    def export(self, outFilePath):
+        with (open(outFilePath, "wb") if isinstance(outFilePath, str) else contextlib.nullcontext(outFilePath)) as outFile:
+            if isinstance(outFilePath, str) and outFilePath.lower().endswith(".gif"):
+                self._writeGif(outFile)
+            else:
+                self._writeApng(outFile)
+    # }}}
+
+    #
+    # __init__(self, inCanvasMap, inJournal, fontFilePath="DejaVuSansMono.ttf", fontSize=11, outMode="P", compressLevel=6, filterType="none", zlibStrategy="default", frameDelay=100, lastFrameDelay=2000, levelsPerFrame=1, maxFrames=None): initialisation method; delays are in milliseconds, and levelsPerFrame is raised as required to produce at most maxFrames frames
+    def __init__(self, inCanvasMap, inJournal, fontFilePath="DejaVuSansMono.ttf", fontSize=11, outMode="P", compressLevel=6, filterType="none", zlibStrategy="default", frameDelay=100, lastFrameDelay=2000, levelsPerFrame=1, maxFrames=None):
+        super().__init__(inCanvasMap, fontFilePath, fontSize, outMode, compressLevel, filterType, zlibStrategy)
+        self.inJournal = inJournal
+        self.frameDelay = int(frameDelay); self.lastFrameDelay = int(lastFrameDelay);
+        self.levelsPerFrame = max(int(levelsPerFrame), 1); self.maxFrames = int(maxFrames) if maxFrames else None;
+
+#
+# Entry point
+def main(*argv):
+    optList, argv = getopt.getopt(argv[1:], "d:e:f:l:m:n:N:p:s:z:"); optDict = dict(optList);
+    canvasJournal = MiRCARTCanvasJournal(memoryBudget=sys.maxsize)
+    canvasMap = canvasJournal.readLog(argv[0])
+    if canvasMap == None:
+        print("{}: no undo journal up to date w/ canvas file found".format(argv[0]), file=sys.stderr)
+        return 1
+    MiRCARTToAnimationFile(canvasMap, canvasJournal, optDict.get("-f", "DejaVuSansMono.ttf"), optDict.get("-s", 11),   \
+        optDict.get("-m", "P"), optDict.get("-l", 6), optDict.get("-p", "none"), optDict.get("-z", "default"),         \
+        optDict.get("-d", 100), optDict.get("-e", 2000), optDict.get("-n", 1), optDict.get("-N", None)).export(argv[1])
+    return 0
+if __name__ == "__main__":
+    optList, optArgs = getopt.getopt(sys.argv[1:], "d:e:f:l:m:n:N:p:s:z:")
+    if len(optArgs) != 2:
+        print("usage: {} "                                                      \
+            "[-d <frame delay in ms; defaults to 100>] "                        \
+            "[-e <last frame delay in ms; defaults to 2000>] "                  \
+            "[-f <Font file pathname; defaults to DejaVuSansMono.ttf>] "        \
+            "[-l <zlib compression level; defaults to 6>] "                     \
+            "[-m <RGBA or P (8-bit palette) APNG output mode; defaults to P>] " \
+            "[-n <number of undo levels per frame; defaults to 1>] "            \
+            "[-N <maximum number of frames, raising -n as required>] "          \
+            "[-p <none, sub, up, average, paeth, or adaptive PNG filter type; defaults to none>] "  \
+            "[-s <Font size; defaults to 11>] "                                 \
+            "[-z <default, filtered, huffman, rle, or fixed zlib strategy; defaults to default>] "  \
+            "<MiRCART canvas file pathname w/ undo journal> "                   \
+            "<APNG or, if ending in .gif, GIF image output file pathname>".format(sys.argv[0]), file=sys.stderr)
+    else:
+        sys.exit(main(*sys.argv))
+
+# vim:expandtab foldmethod=marker sw=4 ts=4 tw=120
@@ -23,13 +23,30 @@
 #
 
 import MiRCARTCanvasImportStore
-from PIL import Image, ImageDraw, ImageFont
-import sys
+from MiRCARTCanvasCache import MiRCARTCanvasCache
+from MiRCARTCanvasMap import MiRCARTCanvasMap
+from MiRCARTGlyphAtlas import MiRCARTGlyphAtlas
+from PIL import Image, ImageDraw
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import collections, contextlib, getopt, itertools, os, struct, sys, zlib
+
+try:
+    import numpy
+    haveNumPy = True
+except ImportError:
+    haveNumPy = False
 
 class MiRCARTToPngFile:
     """XXX"""
     inFile = inFromTextFile = None
     outFontFilePath = outFontSize = None
+    outCompressLevel = outFilterType = outMode = outZlibStrategy = None
+    glyphAtlas = None
+
+    #
+    # Per-worker process PNG renderer w/ loaded font, set by _initWorker()
+    _workerToPngFile = None
 
     # {{{ _ColourMapBold: mIRC colour number to RGBA map given ^B (bold)
     _ColourMapBold = [
@@ -71,6 +88,136 @@ class MiRCARTToPngFile:
         [187, 187, 187],    # Light Grey
     ]
     # }}}
+    # {{{ _PaletteFixed: 8-bit palette of mIRC colours, 6x6x6 colour cube and grey ramp for streaming palette mode
+    _PaletteFixed = _ColourMapNormal                                                        \
+        + [[r, g, b] for r in range(0, 256, 51) for g in range(0, 256, 51) for b in range(0, 256, 51)]  \
+        + [[v, v, v] for v in range(10, 250, 10)]
+    # }}}
+    # {{{ _PngFilters: PNG scanline filter type names to filter type numbers; adaptive picks the filter per scanline
+    _PngFilters = {"none": 0, "sub": 1, "up": 2, "average": 3, "paeth": 4, "adaptive": None}
+    # }}}
+    # {{{ _ZlibStrategies: zlib strategy names to zlib strategies
+    _ZlibStrategies = {
+        "default": zlib.Z_DEFAULT_STRATEGY, "filtered": zlib.Z_FILTERED, "huffman": zlib.Z_HUFFMAN_ONLY,
+        "rle": zlib.Z_RLE, "fixed": zlib.Z_FIXED}
+    # }}}
+    # {{{ _adler32Combine(adler1, adler2, len2): return Adler-32 checksum of two concatenated byte strings given their checksums and the length of the second
+    @staticmethod
+    def _adler32Combine(adler1, adler2, len2):
+        adlerBase = 65521; len2 %= adlerBase;
+        sum1 = ((adler1 & 0xffff) + (adler2 & 0xffff) + adlerBase - 1) % adlerBase
+        sum2 = ((len2 * (adler1 & 0xffff)) + (adler1 >> 16) + (adler2 >> 16) + adlerBase - len2) % adlerBase
+        return sum1 | (sum2 << 16)
+    # }}}
+    # {{{ _drawRow(self, inRowCells, outCurPos, outImgDraw): draw single row of (fg, bg, attrs, char) cells at outCurPos
+    def _drawRow(self, inRowCells, outCurPos, outImgDraw):
+        outCurPos = list(outCurPos)
+        for inCurCell in inRowCells:
+            outColours = [0, 0]
+            if inCurCell[2] & MiRCARTCanvasImportStore.MiRCARTCanvasImportStore._CellState.CS_BOLD:
+                if inCurCell[3] != " ":
+                    if inCurCell[3] == "█":
+                        outColours[1] = self._ColourMapNormal[inCurCell[0]]
+                    else:
+                        outColours[0] = self._ColourMapBold[inCurCell[0]]
+                        outColours[1] = self._ColourMapNormal[inCurCell[1]]
+                else:
+                    outColours[1] = self._ColourMapNormal[inCurCell[1]]
+            else:
+                if inCurCell[3] != " ":
+                    if inCurCell[3] == "█":
+                        outColours[1] = self._ColourMapNormal[inCurCell[0]]
+                    else:
+                        outColours[0] = self._ColourMapNormal[inCurCell[0]]
+                        outColours[1] = self._ColourMapNormal[inCurCell[1]]
+                else:
+                    outColours[1] = self._ColourMapNormal[inCurCell[1]]
+            outImgDraw.rectangle((*outCurPos,           \
+                outCurPos[0] + self.outImgFontSize[0],  \
+                outCurPos[1] + self.outImgFontSize[1]), \
+                fill=(*outColours[1], 255))
+            if  not inCurCell[3] in " █"                \
+            and outColours[0] != outColours[1]:
+                # XXX implement italic
+                glyphMask, glyphOffset = self.glyphAtlas.getMask(inCurCell[3])
+                outImgDraw.bitmap((outCurPos[0] + glyphOffset[0], outCurPos[1] + glyphOffset[1]),   \
+                    glyphMask, (*outColours[0], 255))
+            if inCurCell[2] & MiRCARTCanvasImportStore.MiRCARTCanvasImportStore._CellState.CS_UNDERLINE:
+                outColours[0] = self._ColourMapNormal[inCurCell[0]]
+                self._drawUnderLine(outCurPos,          \
+                    self.outImgFontSize,                \
+                    outImgDraw, (*outColours[0], 255))
+            outCurPos[0] += self.outImgFontSize[0];
+    # }}}
+    # {{{ _drawRows(self, inRows, outCurPos, outImg): draw rows of (fg, bg, attrs, codepoints) arrays of equal length at outCurPos
+    def _drawRows(self, inRows, outCurPos, outImg):
+        if haveNumPy:
+            self._drawRowsNumPy(inRows, outCurPos, outImg)
+        else:
+            outImgDraw = ImageDraw.Draw(outImg)
+            for numRow, inRow in enumerate(inRows):
+                self._drawRow(zip(inRow[0], inRow[1], inRow[2], map(chr, inRow[3])),     \
+                    [outCurPos[0], outCurPos[1] + (numRow * self.outImgFontSize[1])], outImgDraw)
+    # }}}
+    # {{{ _drawRowsNumPy(self, inRows, outCurPos, outImg): draw rows as _drawRows() does, expanding cell colours to pixels and blending glyphs w/ NumPy
+    def _drawRowsNumPy(self, inRows, outCurPos, outImg):
+        numRows = len(inRows); numCols = len(inRows[0][0]) if numRows else 0;
+        if numCols == 0:
+            return
+        cellState = MiRCARTCanvasImportStore.MiRCARTCanvasImportStore._CellState
+        fontSize = self.outImgFontSize
+        inFg, inBg, inAttrs = [numpy.frombuffer(b"".join(inRow[numArray].tobytes() for inRow in inRows),   \
+                                                numpy.uint8).reshape(numRows, numCols) for numArray in range(3)]
+        inChars = numpy.frombuffer(b"".join(inRow[3].tobytes() for inRow in inRows), numpy.uint32).reshape(numRows, numCols)
+        colourMapBold = numpy.array([[*colour, 255] for colour in self._ColourMapBold], numpy.uint8)
+        colourMapNormal = numpy.array([[*colour, 255] for colour in self._ColourMapNormal], numpy.uint8)
+        isBlock = inChars == ord("█"); isBold = (inAttrs & cellState.CS_BOLD) != 0;
+        outBg = colourMapNormal[numpy.where(isBlock, inFg, inBg)]
+        outFg = numpy.where(isBold[..., None], colourMapBold[inFg], colourMapNormal[inFg])
+        isText = ~isBlock & (inChars != ord(" ")) & (outFg != outBg).any(axis=2)
+        isUnderline = (inAttrs & cellState.CS_UNDERLINE) != 0
+
+        # Glyphs and underlines reaching outside of their cell are drawn last, in cell order, w/ PIL
+        textRows, textCols = numpy.nonzero(isText)
+        glyphKeys, glyphIndices, glyphUses = numpy.unique(                                      \
+            (inChars[textRows, textCols].astype(numpy.int64) << 3) | ((textCols == 0) << 2)     \
+            | ((textCols == (numCols - 1)) << 1) | (textRows == (numRows - 1)), return_inverse=True, return_counts=True)
+        glyphs = [self.glyphAtlas.getClippedMask(chr(glyphKey >> 3),                            \
+                    bool(glyphKey & 4), bool(glyphKey & 2), bool(glyphKey & 1), glyphUse)       \
+                  for glyphKey, glyphUse in zip(glyphKeys.tolist(), glyphUses.tolist())]
+        isOutside = numpy.zeros((numRows, numCols), bool); isOutside[:, -1] = isUnderline[:, -1];
+        isOutside[textRows, textCols] |= numpy.array([glyph[2] is None for glyph in glyphs], bool)[glyphIndices]
+
+        # Blend glyphs inside of their cell as PIL does, i.e. (bg * (255 - alpha) + fg * alpha) / 255 rounded
+        outPixels = outBg.repeat(fontSize[1], axis=0).repeat(fontSize[0], axis=1)
+        outCells = outPixels.reshape(numRows, fontSize[1], numCols, fontSize[0], 4)
+        isInside = ~isOutside[textRows, textCols]; insideRows, insideCols = textRows[isInside], textCols[isInside];
+        if len(insideRows):
+            glyphAlpha = numpy.stack([glyph[2] if glyph[2] is not None else numpy.zeros(fontSize[::-1], numpy.uint8)    \
+                                      for glyph in glyphs])[glyphIndices[isInside]][..., None].astype(numpy.uint16)
+            outBlend = (outBg[insideRows, insideCols][:, None, None, :] * (255 - glyphAlpha))   \
+                     + (outFg[insideRows, insideCols][:, None, None, :] * glyphAlpha) + 128
+            outCells[insideRows, :, insideCols] = ((outBlend >> 8) + outBlend) >> 8
+        underlineRows, underlineCols = numpy.nonzero(isUnderline & ~isOutside)
+        outCells[underlineRows, fontSize[1] - 2, underlineCols] = colourMapNormal[inFg[underlineRows, underlineCols]][:, None, :]
+
+        # Cell rectangles include their right and bottom edges, which only remain visible past the last column and row
+        outPixels = numpy.concatenate((outPixels, outBg[:, -1].repeat(fontSize[1], axis=0)[:, None]), axis=1)
+        outPixels = numpy.concatenate((outPixels, numpy.concatenate((outBg[-1], outBg[-1, -1:]))  \
+                                       .repeat([*[fontSize[0]] * numCols, 1], axis=0)[None]), axis=0)
+        outImg.paste(Image.fromarray(outPixels, "RGBA"), tuple(outCurPos))
+        for numRow, numCol in zip(*numpy.nonzero(isOutside)):
+            outPos = [outCurPos[0] + (numCol * fontSize[0]), outCurPos[1] + (numRow * fontSize[1])]
+            if isText[numRow, numCol]:
+                glyphMask, glyphOffset, glyphAlpha = self.glyphAtlas.getClippedMask(chr(inChars[numRow, numCol]),   \
+                    numCol == 0, numCol == (numCols - 1), numRow == (numRows - 1), 0)
+                outImg.paste(tuple(outFg[numRow, numCol].tolist()),                             \
+                    (outPos[0] + glyphOffset[0], outPos[1] + glyphOffset[1]), glyphMask)
+            if isUnderline[numRow, numCol]:
+                outImg.paste(tuple(colourMapNormal[inFg[numRow, numCol]].tolist()),             \
+                    (outPos[0], outPos[1] + (fontSize[1] - 2),                                  \
+                     outPos[0] + fontSize[0] + (1 if numCol == (numCols - 1) else 0), outPos[1] + (fontSize[1] - 1)))
+    # }}}
     # {{{ _drawUnderline(self, curPos, fontSize, imgDraw, fillColour): XXX
     def _drawUnderLine(self, curPos, fontSize, imgDraw, fillColour):
         imgDraw.line(                                                       \
@@ -78,74 +225,193 @@ class MiRCARTToPngFile:
                 curPos[0] + fontSize[0], curPos[1] + (fontSize[1] - 2)),    \
                 fill=fillColour)
     # }}}
-    # {{{ export(self, outFilePath): XXX
+    # {{{ _encodeBand(inSize, inRows, inMargin): render, filter and raw deflate single band in worker process, returning (deflate data ending on a byte boundary, Adler-32 checksum and length of filtered scanlines)
+    @staticmethod
+    def _encodeBand(inSize, inRows, inMargin):
+        self = MiRCARTToPngFile._workerToPngFile
+        outImg = self._renderBand(inSize, inRows, inMargin)
+        outData, outPrevRow = self._filterScanlines(                                            \
+            self._getScanlines(outImg, self._PaletteFixed if self.outMode == "P" else None),   \
+            outImg.size[0] * (1 if self.outMode == "P" else 4), 1 if self.outMode == "P" else 4, None)
+        outCompressor = zlib.compressobj(self.outCompressLevel, zlib.DEFLATED,                 \
+            -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, self._ZlibStrategies[self.outZlibStrategy])
+        return (outCompressor.compress(outData) + outCompressor.flush(zlib.Z_SYNC_FLUSH), zlib.adler32(outData), len(outData))
+    # }}}
+    # {{{ _filterScanlines(self, outData, outStride, outBpp, outPrevRow): return (scanlines of outData prefixed w/ filter type, last unfiltered scanline) given previous unfiltered scanline or None, in which case the first scanline is filtered w/ at most sub so bands can be filtered independently; filter types other than none fall back to none w/o NumPy
+    def _filterScanlines(self, outData, outStride, outBpp, outPrevRow):
+        if not haveNumPy or self.outFilterType == "none":
+            return (b"".join(b"\x00" + outData[numOffset:numOffset + outStride]        \
+                             for numOffset in range(0, len(outData), outStride)), outData[-outStride:])
+        x = numpy.frombuffer(outData, numpy.uint8).reshape(-1, outStride).astype(numpy.int16)
+        b = numpy.vstack((numpy.frombuffer(outPrevRow or bytes(outStride), numpy.uint8)[None, :], x[:-1]))
+        a = numpy.zeros_like(x); a[:, outBpp:] = x[:, :-outBpp];
+        c = numpy.zeros_like(x); c[:, outBpp:] = b[:, :-outBpp];
+        pa, pb, pc = numpy.abs(b - c), numpy.abs(a - c), numpy.abs(a + b - (2 * c))
+        outFiltered = numpy.stack((x, x - a, x - b, x - ((a + b) >> 1),                        \
+            x - numpy.where((pa <= pb) & (pa <= pc), a, numpy.where(pb <= pc, b, c)))).astype(numpy.uint8)
+        if self._PngFilters[self.outFilterType] != None:
+            outTypes = numpy.full(x.shape[0], self._PngFilters[self.outFilterType], numpy.uint8)
+        else:
+            outTypes = numpy.abs(outFiltered.view(numpy.int8).astype(numpy.int32)).sum(axis=2).argmin(axis=0).astype(numpy.uint8)
+        if outPrevRow == None and len(outTypes):
+            outTypes[0] = min(outTypes[0], 1)
+        outRows = numpy.empty((x.shape[0], outStride + 1), numpy.uint8)
+        outRows[:, 0] = outTypes; outRows[:, 1:] = outFiltered[outTypes, numpy.arange(x.shape[0])];
+        return (outRows.tobytes(), outData[-outStride:])
+    # }}}
+    # {{{ _getScanlines(self, outImg, outPalette): return pixels of RGBA or palette mode outImg, or of RGBA outImg mapped onto outPalette if set
+    def _getScanlines(self, outImg, outPalette):
+        if outImg.mode == "P" or outPalette == None:
+            return outImg.tobytes()
+        else:
+            # PIL matches colours at reduced precision: mIRC colours map onto themselves, antialiased pixels onto a near colour
+            outPaletteImg = Image.new("P", (1, 1))
+            outPaletteImg.putpalette([outComponent for outColour in outPalette for outComponent in outColour])
+            return outImg.convert("RGB").quantize(palette=outPaletteImg, dither=Image.NONE).tobytes()
+    # }}}
+    # {{{ _initWorker(fontFilePath, fontSize, outOptions): load font and glyph state once per worker process
+    @staticmethod
+    def _initWorker(fontFilePath, fontSize, outOptions):
+        MiRCARTToPngFile._workerToPngFile = MiRCARTToPngFile(None, fontFilePath, fontSize, **outOptions)
+    # }}}
+    # {{{ _renderBand(self, inSize, inRows, inMargin): render band of (fg, bg, attrs, codepoints) rows, or a single blank row if empty, into RGBA image of full output width
+    def _renderBand(self, inSize, inRows, inMargin):
+        outCellDefault = (*MiRCARTCanvasMap.cellDefault[0:3], ord(MiRCARTCanvasMap.cellDefault[3]))
+        outImg = Image.new("RGBA",                                                      \
+            ((inSize[0] + (inMargin * 2)) * self.outImgFontSize[0], len(inRows or [None]) * self.outImgFontSize[1]),   \
+            (*self._ColourMapNormal[1], 255))
+        inRows = [tuple(rowArray + array(rowArray.typecode, [cellDefault]) * (inSize[0] - len(rowArray))  \
+                        for rowArray, cellDefault in zip(inRow, outCellDefault)) for inRow in inRows]
+        self._drawRows(inRows, [inMargin * self.outImgFontSize[0], 0], outImg)
+        return outImg
+    # }}}
+    # {{{ _renderBands(self, inSize, inBands, inMargin): render bands of (fg, bg, attrs, codepoints) rows one at a time, yielding RGBA images of full output width
+    def _renderBands(self, inSize, inBands, inMargin):
+        outBlankRows = [(0, [])] * inMargin
+        for numRow, inRows in itertools.chain(outBlankRows, inBands, outBlankRows):
+            yield self._renderBand(inSize, inRows, inMargin)
+    # }}}
+    # {{{ _writeBand(self, outFile, outAdler32, outData, bandAdler32, bandLength): write band deflate data returned by _encodeBand() as IDAT chunk, returning Adler-32 checksum of filtered scanlines so far
+    def _writeBand(self, outFile, outAdler32, outData, bandAdler32, bandLength):
+        self._writePngChunk(outFile, b"IDAT", outData)
+        return self._adler32Combine(outAdler32, bandAdler32, bandLength)
+    # }}}
+    # {{{ _writePng(self, outFilePath, outSize, outImgs, outPalette): write images of full width outImgs top to bottom as one PNG image into file pathname or binary file object outFilePath, in palette mode if outPalette is a list of [r, g, b] colours
+    def _writePng(self, outFilePath, outSize, outImgs, outPalette):
+        outBpp = 1 if outPalette != None else 4; outStride = outSize[0] * outBpp; outPrevRow = None;
+        outCompressor = zlib.compressobj(self.outCompressLevel, zlib.DEFLATED,                 \
+            zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, self._ZlibStrategies[self.outZlibStrategy])
+        with (open(outFilePath, "wb") if isinstance(outFilePath, str) else contextlib.nullcontext(outFilePath)) as outFile:
+            self._writePngHeader(outFile, outSize, outPalette)
+            for outImg in outImgs:
+                outData, outPrevRow = self._filterScanlines(self._getScanlines(outImg, outPalette), outStride, outBpp, outPrevRow)
+                self._writePngChunk(outFile, b"IDAT", outCompressor.compress(outData))
+            self._writePngChunk(outFile, b"IDAT", outCompressor.flush())
+            self._writePngChunk(outFile, b"IEND", b"")
+    # }}}
+    # {{{ _writePngChunk(self, outFile, chunkType, chunkData): XXX
+    def _writePngChunk(self, outFile, chunkType, chunkData):
+        outFile.write(struct.pack(">I", len(chunkData)))
+        outFile.write(chunkType); outFile.write(chunkData);
+        outFile.write(struct.pack(">I", zlib.crc32(chunkType + chunkData) & 0xffffffff))
+    # }}}
+    # {{{ _writePngHeader(self, outFile, outSize, outPalette): write PNG signature, IHDR chunk, and PLTE chunk if outPalette is a list of [r, g, b] colours
+    def _writePngHeader(self, outFile, outSize, outPalette):
+        outFile.write(b"\x89PNG\r\n\x1a\n")
+        self._writePngChunk(outFile, b"IHDR", struct.pack(">IIBBBBB", *outSize, 8, 3 if outPalette != None else 6, 0, 0, 0))
+        if outPalette != None:
+            self._writePngChunk(outFile, b"PLTE", bytes(outComponent for outColour in outPalette for outComponent in outColour))
+    # }}}
+
+    # {{{ export(self, outFilePath): render canvas map into PNG image file pathname or binary file object outFilePath; in palette mode, the palette holds the image's exact colours if there are at most 256 of them, and is _PaletteFixed otherwise
     def export(self, outFilePath):
-        inSize = (len(self.inCanvasMap[0]), len(self.inCanvasMap))
+        inSize = self.inCanvasMap.mapSize
         outSize = [a*b for a,b in zip(inSize, self.outImgFontSize)]
-        outCurPos = [0, 0]
         outImg = Image.new("RGBA", outSize, (*self._ColourMapNormal[1], 255))
-        outImgDraw = ImageDraw.Draw(outImg)
-        for inCurRow in range(len(self.inCanvasMap)):
-            for inCurCol in range(len(self.inCanvasMap[inCurRow])):
-                inCurCell = self.inCanvasMap[inCurRow][inCurCol]
-                outColours = [0, 0]
-                if inCurCell[2] & MiRCARTCanvasImportStore.MiRCARTCanvasImportStore._CellState.CS_BOLD:
-                    if inCurCell[3] != " ":
-                        if inCurCell[3] == "█":
-                            outColours[1] = self._ColourMapNormal[inCurCell[0]]
-                        else:
-                            outColours[0] = self._ColourMapBold[inCurCell[0]]
-                            outColours[1] = self._ColourMapNormal[inCurCell[1]]
-                    else:
-                        outColours[1] = self._ColourMapNormal[inCurCell[1]]
-                else:
-                    if inCurCell[3] != " ":
-                        if inCurCell[3] == "█":
-                            outColours[1] = self._ColourMapNormal[inCurCell[0]]
-                        else:
-                            outColours[0] = self._ColourMapNormal[inCurCell[0]]
-                            outColours[1] = self._ColourMapNormal[inCurCell[1]]
-                    else:
-                        outColours[1] = self._ColourMapNormal[inCurCell[1]]
-                outImgDraw.rectangle((*outCurPos,           \
-                    outCurPos[0] + self.outImgFontSize[0],  \
-                    outCurPos[1] + self.outImgFontSize[1]), \
-                    fill=(*outColours[1], 255))
-                if  not inCurCell[3] in " █"                \
-                and outColours[0] != outColours[1]:
-                    # XXX implement italic
-                    outImgDraw.text(outCurPos,              \
-                        inCurCell[3], (*outColours[0], 255), self.outImgFont)
-                if inCurCell[2] & MiRCARTCanvasImportStore.MiRCARTCanvasImportStore._CellState.CS_UNDERLINE:
-                    outColours[0] = self._ColourMapNormal[inCurCell[0]]
-                    self._drawUnderLine(outCurPos,          \
-                        self.outImgFontSize,                \
-                        outImgDraw, (*outColours[0], 255))
-                outCurPos[0] += self.outImgFontSize[0];
-            outCurPos[0] = 0
-            outCurPos[1] += self.outImgFontSize[1]
-        outImg.save(outFilePath);
+        self._drawRows([self.inCanvasMap.getRow(inCurRow) for inCurRow in range(inSize[1])], [0, 0], outImg)
+        if self.outMode != "P":
+            self._writePng(outFilePath, outSize, [outImg], None)
+        elif outImg.getcolors(256) == None:
+            self._writePng(outFilePath, outSize, [outImg], self._PaletteFixed)
+        else:
+            outImg = outImg.convert("RGB").quantize(256, Image.MEDIANCUT, dither=Image.NONE)
+            outPalette = outImg.getpalette()[:(outImg.getextrema()[1] + 1) * 3]
+            self._writePng(outFilePath, outSize, [outImg],                                          \
+                [outPalette[numOffset:numOffset + 3] for numOffset in range(0, len(outPalette), 3)])
+    # }}}
+    # {{{ exportBands(self, outFilePath, inSize, inBands, inMargin=0): render bands of (fg, bg, attrs, codepoints) rows one at a time, streaming PNG scanlines into file pathname or binary file object outFilePath; inSize and inMargin are in cells; in palette mode, the fixed palette of mIRC colours is used
+    def exportBands(self, outFilePath, inSize, inBands, inMargin=0):
+        self._writePng(outFilePath, [(a + (inMargin * 2)) * b for a,b in zip(inSize, self.outImgFontSize)],   \
+            self._renderBands(inSize, inBands, inMargin), self._PaletteFixed if self.outMode == "P" else None)
+    # }}}
+    # {{{ exportBandsParallel(self, outFilePath, inSize, inBands, inMargin=0, numWorkers=None): render, filter and compress bands as exportBands() does over a pool of numWorkers worker processes, defaulting to the number of CPUs, writing them out in order as they complete
+    def exportBandsParallel(self, outFilePath, inSize, inBands, inMargin=0, numWorkers=None):
+        numWorkers = numWorkers or os.cpu_count() or 1
+        outAdler32 = zlib.adler32(b""); outBlankRows = [(0, [])] * inMargin; outFutures = collections.deque();
+        outOptions = {"outMode": self.outMode, "compressLevel": self.outCompressLevel,      \
+                      "filterType": self.outFilterType, "zlibStrategy": self.outZlibStrategy}
+        with ProcessPoolExecutor(numWorkers, initializer=self._initWorker,                      \
+                initargs=(self.outFontFilePath, self.outFontSize, outOptions)) as executor,     \
+             (open(outFilePath, "wb") if isinstance(outFilePath, str) else contextlib.nullcontext(outFilePath)) as outFile:
+            self._writePngHeader(outFile, [(a + (inMargin * 2)) * b for a,b in zip(inSize, self.outImgFontSize)],  \
+                self._PaletteFixed if self.outMode == "P" else None)
+            self._writePngChunk(outFile, b"IDAT", zlib.compress(b"", self.outCompressLevel)[:2])
+            for numRow, inRows in itertools.chain(outBlankRows, inBands, outBlankRows):
+                outFutures.append(executor.submit(self._encodeBand, inSize, inRows, inMargin))
+                if len(outFutures) > (numWorkers * 2):
+                    outAdler32 = self._writeBand(outFile, outAdler32, *outFutures.popleft().result())
+            while len(outFutures):
+                outAdler32 = self._writeBand(outFile, outAdler32, *outFutures.popleft().result())
+            self._writePngChunk(outFile, b"IDAT", zlib.compressobj(self.outCompressLevel, zlib.DEFLATED, -zlib.MAX_WBITS).flush()  \
+                                + struct.pack(">I", outAdler32))
+            self._writePngChunk(outFile, b"IEND", b"")
     # }}}
 
     #
-    # __init__(self, inCanvasMap, fontFilePath="DejaVuSansMono.ttf", fontSize=11): initialisation method
-    def __init__(self, inCanvasMap, fontFilePath="DejaVuSansMono.ttf", fontSize=11):
+    # __init__(self, inCanvasMap, fontFilePath="DejaVuSansMono.ttf", fontSize=11, outMode="RGBA", compressLevel=6, filterType="none", zlibStrategy="default"): initialisation method; outMode is RGBA or P (8-bit palette)
+    def __init__(self, inCanvasMap, fontFilePath="DejaVuSansMono.ttf", fontSize=11, outMode="RGBA", compressLevel=6, filterType="none", zlibStrategy="default"):
+        if outMode not in ("P", "RGBA"):
+            raise ValueError("unknown output mode {}".format(outMode))
+        elif filterType not in self._PngFilters:
+            raise ValueError("unknown PNG filter type {}".format(filterType))
+        elif zlibStrategy not in self._ZlibStrategies:
+            raise ValueError("unknown zlib strategy {}".format(zlibStrategy))
         self.inCanvasMap = inCanvasMap
+        self.outCompressLevel = int(compressLevel); self.outFilterType = filterType;
+        self.outMode = outMode; self.outZlibStrategy = zlibStrategy;
         self.outFontFilePath = fontFilePath; self.outFontSize = int(fontSize);
-        self.outImgFont = ImageFont.truetype(           \
-            self.outFontFilePath, self.outFontSize)
-        self.outImgFontSize = [*self.outImgFont.getsize(" ")]
-        self.outImgFontSize[1] += 3
+        self.glyphAtlas = MiRCARTGlyphAtlas.get(self.outFontFilePath, self.outFontSize)
+        self.outImgFont = self.glyphAtlas.font; self.outImgFontSize = list(self.glyphAtlas.cellSize);
 
 #
 # Entry point
 def main(*argv):
-    canvasStore = MiRCARTCanvasImportStore.MiRCARTCanvasImportStore(inFile=argv[1])
-    MiRCARTToPngFile(canvasStore.outMap, *argv[3:]).export(argv[2])
+    optList, argv = getopt.getopt(argv[1:], "Cb:j:l:m:p:z:"); optDict = dict(optList);
+    canvasStore = MiRCARTCanvasImportStore.MiRCARTCanvasImportStore(  \
+        canvasCache=MiRCARTCanvasCache() if "-C" in optDict else None)
+    toPngFile = MiRCARTToPngFile(None, *argv[2:], outMode=optDict.get("-m", "RGBA"),   \
+        compressLevel=optDict.get("-l", 6), filterType=optDict.get("-p", "none"),         \
+        zlibStrategy=optDict.get("-z", "default"))
+    inSize = canvasStore.getTextFileSize(argv[0]); inBands = canvasStore.iterTextFile(argv[0], int(optDict.get("-b", 256)));
+    if "-j" in optDict:
+        toPngFile.exportBandsParallel(argv[1], inSize, inBands, numWorkers=int(optDict["-j"]))
+    else:
+        toPngFile.exportBands(argv[1], inSize, inBands)
+        glyphHits, glyphMisses, numGlyphs = toPngFile.glyphAtlas.getStats()
+        print("glyph atlas: {} masks, hit rate {:.1f}% ({} hits, {} misses)".format(    \
+            numGlyphs, 100 * glyphHits / max(glyphHits + glyphMisses, 1), glyphHits, glyphMisses), file=sys.stderr)
 if __name__ == "__main__":
-    if ((len(sys.argv) - 1) < 2)\
-    or ((len(sys.argv) - 1) > 4):
+    optList, optArgs = getopt.getopt(sys.argv[1:], "Cb:j:l:m:p:z:")
+    if (len(optArgs) < 2)   \
+    or (len(optArgs) > 4):
         print("usage: {} "                                              \
+            "[-C] "                                                     \
+            "[-b <number of rows per band; defaults to 256>] "          \
+            "[-j <number of worker processes rendering bands in parallel; defaults to none>] "   \
+            "[-l <zlib compression level; defaults to 6>] "             \
+            "[-m <RGBA or P (8-bit palette) output mode; defaults to RGBA>] "   \
+            "[-p <none, sub, up, average, paeth, or adaptive PNG filter type; defaults to none>] "  \
+            "[-z <default, filtered, huffman, rle, or fixed zlib strategy; defaults to default>] "  \
             "<MiRCART input file pathname> "                            \
             "<PNG image output file pathname> "                         \
             "[<Font file pathname; defaults to DejaVuSansMono.ttf>] "   \
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+#
+# MiRCARTToPngFiles.py -- convert many ASCII files w/ mIRC control codes to PNG in parallel
+# Copyright (c) 2018 Lucio Andrés Illanes Albornoz <lucio@lucioillanes.de>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from MiRCARTCanvasCache import MiRCARTCanvasCache
+from MiRCARTCanvasImportStore import MiRCARTCanvasImportStore
+from MiRCARTToPngFile import MiRCARTToPngFile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import getopt, glob, io, os, sys, time
+
+class MiRCARTToPngFiles():
+    """Batch converter of ASCII files w/ mIRC control codes to PNG images over a pool of worker processes"""
+    fontFilePath = fontSize = numWorkers = outDirName = outOptions = useCache = None
+
+    # {{{ CompareOptions: MiRCARTToPngFile output options compared by compare() by default, starting w/ the defaults
+    CompareOptions = [
+        {"outMode": "RGBA", "compressLevel": 6, "filterType": "none", "zlibStrategy": "default"},
+        {"outMode": "RGBA", "compressLevel": 9, "filterType": "adaptive", "zlibStrategy": "default"},
+        {"outMode": "P", "compressLevel": 1, "filterType": "none", "zlibStrategy": "default"},
+        {"outMode": "P", "compressLevel": 6, "filterType": "none", "zlibStrategy": "default"},
+        {"outMode": "P", "compressLevel": 9, "filterType": "none", "zlibStrategy": "default"},
+        {"outMode": "P", "compressLevel": 6, "filterType": "adaptive", "zlibStrategy": "default"},
+        {"outMode": "P", "compressLevel": 6, "filterType": "none", "zlibStrategy": "rle"},
+    ]
+    # }}}
+
+    #
+    # Per-worker process import store and PNG renderer w/ loaded font, set by _initWorker()
+    _workerStore = _workerToPngFile = None
+
+    # {{{ _convertFile(inPathName, outPathName): convert single file in worker process, returning its number of cells, glyph atlas hits and misses
+    @staticmethod
+    def _convertFile(inPathName, outPathName):
+        glyphHits, glyphMisses, _ = MiRCARTToPngFiles._workerToPngFile.glyphAtlas.getStats()
+        inSize = MiRCARTToPngFiles._workerStore.getTextFileSize(inPathName)
+        try:
+            MiRCARTToPngFiles._workerToPngFile.exportBands(outPathName + ".tmp",   \
+                inSize, MiRCARTToPngFiles._workerStore.iterTextFile(inPathName))
+            os.replace(outPathName + ".tmp", outPathName)
+        finally:
+            if os.path.exists(outPathName + ".tmp"):
+                os.remove(outPathName + ".tmp")
+        numHits, numMisses, _ = MiRCARTToPngFiles._workerToPngFile.glyphAtlas.getStats()
+        return (inSize[0] * inSize[1], numHits - glyphHits, numMisses - glyphMisses)
+    # }}}
+    # {{{ _getPatternDirName(self, inPattern): return leading directory pathname of inPattern w/o glob magic
+    def _getPatternDirName(self, inPattern):
+        inDirName = os.path.dirname(inPattern)
+        while glob.has_magic(inDirName):
+            inDirName = os.path.dirname(inDirName)
+        return inDirName or "."
+    # }}}
+    # {{{ _initWorker(fontFilePath, fontSize, outOptions, useCache): load font and glyph state and open canvas cache if useCache once per worker process
+    @staticmethod
+    def _initWorker(fontFilePath, fontSize, outOptions, useCache):
+        MiRCARTToPngFiles._workerStore = MiRCARTCanvasImportStore(  \
+            canvasCache=MiRCARTCanvasCache() if useCache else None)
+        MiRCARTToPngFiles._workerToPngFile = MiRCARTToPngFile(None, fontFilePath, fontSize, **outOptions)
+    # }}}
+    # {{{ _isUpToDate(self, inPathName, outPathName): return True if outPathName exists and is not older than inPathName
+    def _isUpToDate(self, inPathName, outPathName):
+        try:
+            return os.stat(outPathName).st_mtime_ns >= os.stat(inPathName).st_mtime_ns
+        except OSError:
+            return False
+    # }}}
+
+    # {{{ compare(self, inPatterns, outOptionsList=None): render files matched by inPatterns in memory w/ each of outOptionsList or CompareOptions in this process, returning list of (output options, bytes, seconds)
+    def compare(self, inPatterns, outOptionsList=None):
+        inStore = MiRCARTCanvasImportStore(canvasCache=MiRCARTCanvasCache() if self.useCache else None)
+        outOptionsList = outOptionsList or self.CompareOptions;
+        outResults = [[MiRCARTToPngFile(None, self.fontFilePath, self.fontSize, **outOptions), 0, 0.0]   \
+                      for outOptions in outOptionsList]
+        for inPathName, outPathName in self.getFiles(inPatterns):
+            inSize = inStore.getTextFileSize(inPathName); inBands = list(inStore.iterTextFile(inPathName));
+            for outResult in outResults:
+                outFile = io.BytesIO(); startTime = time.perf_counter();
+                outResult[0].exportBands(outFile, inSize, iter(inBands))
+                outResult[1] += len(outFile.getvalue()); outResult[2] += time.perf_counter() - startTime;
+        return [(outOptions, numBytes, numSeconds)                                              \
+                for outOptions, (toPngFile, numBytes, numSeconds) in zip(outOptionsList, outResults)]
+    # }}}
+    # {{{ convert(self, inPatterns, force=False): convert files matched by inPatterns not up to date unless force, returning (converted, skipped, failed, cells, seconds, glyph atlas hits, glyph atlas misses)
+    def convert(self, inPatterns, force=False):
+        startTime = time.perf_counter()
+        numCells = numFailed = numSkipped = 0; inJobs = [];
+        glyphHits = glyphMisses = 0
+        for inPathName, outPathName in self.getFiles(inPatterns):
+            if not force and self._isUpToDate(inPathName, outPathName):
+                numSkipped += 1
+            else:
+                inJobs.append((inPathName, outPathName))
+        if len(inJobs):
+            with ProcessPoolExecutor(self.numWorkers, initializer=self._initWorker,   \
+                    initargs=(self.fontFilePath, self.fontSize, self.outOptions, self.useCache)) as executor:
+                inFutures = {executor.submit(self._convertFile, *inJob): inJob for inJob in inJobs}
+                for inFuture in as_completed(inFutures):
+                    try:
+                        inCells, inHits, inMisses = inFuture.result()
+                        numCells += inCells; glyphHits += inHits; glyphMisses += inMisses;
+                    except Exception as error:
+                        print("{}: {}".format(inFutures[inFuture][0], error), file=sys.stderr)
+                        numFailed += 1
+        return (len(inJobs) - numFailed, numSkipped, numFailed, numCells, time.perf_counter() - startTime,  \
+                glyphHits, glyphMisses)
+    # }}}
+    # {{{ getFiles(self, inPatterns): return sorted list of (input pathname, output pathname) of .txt files below directories, matching glob patterns, or named in inPatterns; raises ValueError given input files mapping onto the same output pathname
+    def getFiles(self, inPatterns):
+        inFiles = {}
+        for inPattern in inPatterns:
+            if os.path.isdir(inPattern):
+                for dirPathName, dirNames, fileNames in os.walk(inPattern):
+                    for fileName in fileNames:
+                        if fileName.endswith(".txt"):
+                            inPathName = os.path.join(dirPathName, fileName)
+                            inFiles[inPathName] = os.path.relpath(inPathName, inPattern)
+            else:
+                inDirName = self._getPatternDirName(inPattern)
+                for inPathName in (glob.glob(inPattern, recursive=True) or [inPattern]):
+                    inFiles[inPathName] = os.path.relpath(inPathName, inDirName)
+        outFiles = {}
+        for inPathName, outRelPathName in inFiles.items():
+            outPathName = os.path.join(self.outDirName, os.path.splitext(outRelPathName)[0] + ".png")
+            if outPathName in outFiles:
+                raise ValueError("{} and {} both map onto {}".format(outFiles[outPathName], inPathName, outPathName))
+            outFiles[outPathName] = inPathName
+        return sorted((inPathName, outPathName) for outPathName, inPathName in outFiles.items())
+    # }}}
+
+    #
+    # __init__(self, outDirName, fontFilePath="DejaVuSansMono.ttf", fontSize=11, numWorkers=None, outOptions=None, useCache=False): initialisation method; numWorkers defaults to the number of CPUs, outOptions are MiRCARTToPngFile keyword arguments, useCache parses input files through MiRCARTCanvasCache
+    def __init__(self, outDirName, fontFilePath="DejaVuSansMono.ttf", fontSize=11, numWorkers=None, outOptions=None, useCache=False):
+        self.outDirName = outDirName; self.numWorkers = numWorkers; self.outOptions = outOptions or {};
+        self.fontFilePath = fontFilePath; self.fontSize = int(fontSize); self.useCache = useCache;
+
+#
+# Entry point
+def main(*argv):
+    optList, argv = getopt.getopt(argv[1:], "CcFf:j:l:m:p:s:z:"); optDict = dict(optList);
+    outOptions = {"outMode": optDict.get("-m", "RGBA"), "compressLevel": optDict.get("-l", 6),     \
+                  "filterType": optDict.get("-p", "none"), "zlibStrategy": optDict.get("-z", "default")}
+    if "-c" in optDict:
+        batchConverter = MiRCARTToPngFiles(".", optDict.get("-f", "DejaVuSansMono.ttf"), optDict.get("-s", 11),   \
+            useCache=("-C" in optDict))
+        outResults = batchConverter.compare(argv)
+        print("{:<5} {:>5} {:<8} {:<8} {:>12} {:>6} {:>9} {:>6}".format(    \
+            "mode", "level", "filter", "strategy", "bytes", "size", "seconds", "time"))
+        for outOptions, numBytes, numSeconds in outResults:
+            print("{:<5} {:>5} {:<8} {:<8} {:>12} {:>5.0f}% {:>9.3f} {:>5.0f}%".format(    \
+                outOptions["outMode"], outOptions["compressLevel"], outOptions["filterType"], outOptions["zlibStrategy"],   \
+                numBytes, 100 * numBytes / max(outResults[0][1], 1), numSeconds, 100 * numSeconds / max(outResults[0][2], 1e-9)))
+        return 0
+    batchConverter = MiRCARTToPngFiles(argv[0], optDict.get("-f", "DejaVuSansMono.ttf"),  \
+        optDict.get("-s", 11), int(optDict["-j"]) if "-j" in optDict else None, outOptions, "-C" in optDict)
+    for outPathName in {os.path.dirname(outPathName) for inPathName, outPathName in batchConverter.getFiles(argv[1:])}:
+        os.makedirs(outPathName, exist_ok=True)
+    numFiles, numSkipped, numFailed, numCells, numSeconds, glyphHits, glyphMisses =    \
+        batchConverter.convert(argv[1:], force=("-F" in optDict))
+    print("{} files converted, {} up to date, {} failed; "         \
+          "{} cells in {:.2f}s ({:.1f} files/s, {:.0f} cells/s); "  \
+          "glyph atlas hit rate {:.1f}% ({} hits, {} misses)".format(  \
+        numFiles, numSkipped, numFailed, numCells, numSeconds,          \
+        numFiles / max(numSeconds, 1e-9), numCells / max(numSeconds, 1e-9),  \
+        100 * glyphHits / max(glyphHits + glyphMisses, 1), glyphHits, glyphMisses), file=sys.stderr)
+    return 1 if numFailed else 0
+if __name__ == "__main__":
+    if ((len(sys.argv) - 1) < 2):
+        print("usage: {} "                                                      \
+            "[-C] [-F] [-f <Font file pathname; defaults to DejaVuSansMono.ttf>] "   \
+            "[-j <number of worker processes; defaults to number of CPUs>] "    \
+            "[-l <zlib compression level; defaults to 6>] "                     \
+            "[-m <RGBA or P (8-bit palette) output mode; defaults to RGBA>] "   \
+            "[-p <none, sub, up, average, paeth, or adaptive PNG filter type; defaults to none>] "  \
+            "[-s <Font size; defaults to 11>] "                                 \
+            "[-z <default, filtered, huffman, rle, or fixed zlib strategy; defaults to default>] "  \
+            "<PNG image output directory pathname> "                            \
+            "<MiRCART input file, directory, or glob pattern pathname>...\n"    \
+            "       {} -c [-C] [-f <Font file pathname>] [-s <Font size>] "          \
+            "<MiRCART input file, directory, or glob pattern pathname>...".format(sys.argv[0], sys.argv[0]), file=sys.stderr)
+    else:
+        sys.exit(main(*sys.argv))
+
+# vim:expandtab foldmethod=marker sw=4 ts=4 tw=120
@@ -32,13 +32,13 @@ class MiRCARTToolFill(MiRCARTTool):
     # onMouseEvent(self, event, atPoint, brushColours, brushSize, isDragging, isLeftDown, isRightDown, dispatchFn, eventDc): XXX
     def onMouseEvent(self, event, atPoint, brushColours, brushSize, isDragging, isLeftDown, isRightDown, dispatchFn, eventDc):
         pointStack = [list(atPoint)]; pointsDone = [];
-        testColour = self.parentCanvas.canvasMap[atPoint[1]][atPoint[0]][0:2]
+        testColour = self.parentCanvas.canvasMap.getCell(*atPoint)[0:2]
         if isLeftDown or isRightDown:
             if isRightDown:
                 brushColours = [brushColours[1], brushColours[0]]
             while len(pointStack) > 0:
                 point = pointStack.pop()
-                pointCell = self.parentCanvas.canvasMap[point[1]][point[0]]
+                pointCell = self.parentCanvas.canvasMap.getCell(*point)
                 if pointCell[0:2] == testColour:
                     if not point in pointsDone:
                         dispatchFn(eventDc, False, [*point, \
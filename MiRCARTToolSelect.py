@@ -102,7 +102,7 @@ class MiRCARTToolSelect(MiRCARTTool):
                         rectY = self.toolRect[0][1] + numRow
                         rectX = self.toolRect[0][0] + numCol
                         self.toolSelectMap[numRow].append(                      \
-                            self.parentCanvas.canvasMap[rectY][rectX])
+                            self.parentCanvas.canvasMap.getCell(rectX, rectY))
             self._drawSelectRect(self.toolRect, dispatchFn, eventDc)
         elif self.toolState == self.TS_TARGET:
             if isRightDown:
@@ -23,7 +23,10 @@
 #
 
 from MiRCARTTool import MiRCARTTool
-import wx
+try:
+    from wx import MOD_NONE, MOD_SHIFT
+except ImportError:
+    MOD_NONE = 0x0000; MOD_SHIFT = 0x0004;
 
 class MiRCARTToolText(MiRCARTTool):
     """XXX"""
@@ -33,9 +36,9 @@ class MiRCARTToolText(MiRCARTTool):
     #
     # onKeyboardEvent(self, event, atPoint, brushColours, brushSize, keyChar, dispatchFn, eventDc): XXX
     def onKeyboardEvent(self, event, atPoint, brushColours, brushSize, keyChar, dispatchFn, eventDc):
-        keyModifiers = event.GetModifiers()
-        if  keyModifiers != wx.MOD_NONE     \
-        and keyModifiers != wx.MOD_SHIFT:
+        if  event != None                               \
+        and event.GetModifiers() != MOD_NONE            \
+        and event.GetModifiers() != MOD_SHIFT:
             return True
         else:
             if self.textColours == None:
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+#
+# MiRCARTImportBench.py -- compare MiRCARTCanvasImportStore against the reference parser on a corpus and time both
+# Copyright (c) 2018 Lucio Andrés Illanes Albornoz <lucio@lucioillanes.de>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MiRCARTCanvasImportStore import MiRCARTCanvasImportStore
+from MiRCARTCanvasMap import MiRCARTCanvasMap
+from array import array
+import getopt, glob, random, tempfile, time
+
+class MiRCARTImportBench():
+    """Equivalence test and parse benchmark of MiRCARTCanvasImportStore against the original character-at-a-time parser"""
+    benchRows = corpusPathName = numRandomLines = randomSeed = None
+
+    #
+    # Alphabet of random lines: control codes, colour digits and commas, line breaks, and ASCII and non-ASCII text
+    _RandomAlphabet = ["\x02", "\x03", "\x06", "\x0f", "\x16", "\x1f", "\x1d", ",", "0", "1", "2", "5", "6", "9",  \
+                       "a", " ", "é", "█", "\n", "\r", "\r\n"]
+
+    # {{{ _compareFile(self, pathName): return list of mismatching import paths of single file, if any
+    def _compareFile(self, pathName):
+        refSize, refMap = self._importReference(pathName); mismatches = [];
+        canvasStore = MiRCARTCanvasImportStore()
+        canvasStore.importTextFile(pathName)
+        if canvasStore.inSize != refSize or canvasStore.outMap.toList() != refMap.toList():
+            mismatches.append("importTextFile")
+        if canvasStore.getTextFileSize(pathName) != refSize:
+            mismatches.append("getTextFileSize")
+        inRows = [inRow for numRow, inBandRows in canvasStore.iterTextFile(pathName, 7, useMmap=False) for inRow in inBandRows]
+        if canvasStore._rowsToMap(inRows).toList() != refMap.toList():
+            mismatches.append("iterTextFile(useMmap=False)")
+        return mismatches
+    # }}}
+    # {{{ _flipCellStateBit(self, cellState, bit): XXX
+    def _flipCellStateBit(self, cellState, bit):
+        if cellState & bit:
+            return cellState & ~bit
+        else:
+            return cellState | bit
+    # }}}
+    # {{{ _importReference(self, pathName): parse text file w/ the original character-at-a-time parser, returning ([columns, rows], canvas map)
+    def _importReference(self, pathName):
+        inFile = open(pathName, "r", encoding="utf-8")
+        inCurColourSpec = ""; inCurRow = -1;
+        inLine = inFile.readline()
+        inSize = [0, 0]; inRows = []; inMaxCols = 0;
+        while inLine:
+            inCellState = 0x00
+            inParseState = 1
+            inCurCol = 0; inMaxCol = len(inLine);
+            inCurColourDigits = 0; inCurColours = (15, 1); inCurColourSpec = "";
+            inCurRow += 1; inRowCols = 0; inSize[1] += 1;
+            inRow = (array("B"), array("B"), array("B"), array("I")); inRows.append(inRow);
+            while inCurCol < inMaxCol:
+                inChar = inLine[inCurCol]
+                if inChar in set("\r\n"):                                   \
+                    inCurCol += 1
+                elif inParseState == 1:
+                    inCurCol += 1
+                    if inChar == "\x02":
+                        inCellState = self._flipCellStateBit(inCellState, 0x01)
+                    elif inChar == "\x03":
+                        inParseState = 2
+                    elif inChar == "\x06":
+                        inCellState = self._flipCellStateBit(inCellState, 0x02)
+                    elif inChar == "\x0f":
+                        inCellState |= 0x00
+                        inCurColours = (15, 1)
+                    elif inChar == "\x16":
+                        inCurColours = (inCurColours[1], inCurColours[0])
+                    elif inChar == "\x1f":
+                        inCellState = self._flipCellStateBit(inCellState, 0x04)
+                    else:
+                        inRowCols += 1
+                        inRow[0].append(inCurColours[0]); inRow[1].append(inCurColours[1]);
+                        inRow[2].append(inCellState); inRow[3].append(ord(inChar));
+                elif inParseState == 2                                      \
+                or   inParseState == 3:
+                    if  inChar == ","                                       \
+                    and inParseState == 2:
+                        if  (inCurCol + 1) < inMaxCol                       \
+                        and not inLine[inCurCol + 1] in set("0123456789"):
+                            inCurColours = self._parseCharAsColourSpec(inCurColourSpec, inCurColours)
+                            inCurColourDigits = 0; inCurColourSpec = "";
+                            inParseState = 1
+                        else:
+                            inCurCol += 1
+                            inCurColourDigits = 0; inCurColourSpec += inChar;
+                            inParseState = 3
+                    elif inChar in set("0123456789")                        \
+                    and  inCurColourDigits == 0:
+                        inCurCol += 1
+                        inCurColourDigits += 1; inCurColourSpec += inChar;
+                    elif inChar in set("0123456789")                        \
+                    and  inCurColourDigits == 1                             \
+                    and  inCurColourSpec[-1] == "0":
+                        inCurCol += 1
+                        inCurColourDigits += 1; inCurColourSpec += inChar;
+                    elif inChar in set("012345")                            \
+                    and  inCurColourDigits == 1                             \
+                    and  inCurColourSpec[-1] == "1":
+                        inCurCol += 1
+                        inCurColourDigits += 1; inCurColourSpec += inChar;
+                    else:
+                        inCurColours = self._parseCharAsColourSpec(inCurColourSpec, inCurColours)
+                        inCurColourDigits = 0; inCurColourSpec = "";
+                        inParseState = 1
+            inMaxCols = max(inMaxCols, inRowCols)
+            inLine = inFile.readline()
+        inFile.close()
+        outMap = MiRCARTCanvasMap((inMaxCols, 0))
+        for inRow in inRows:
+            outMap.appendRow(*inRow)
+        inSize[0] = inMaxCols
+        return inSize, outMap
+    # }}}
+    # {{{ _parseCharAsColourSpec(self, colourSpec, curColours): XXX
+    def _parseCharAsColourSpec(self, colourSpec, curColours):
+        if len(colourSpec) > 0:
+            colourSpec = colourSpec.split(",")
+            if  len(colourSpec) == 2                            \
+            and len(colourSpec[1]) > 0:
+                return (int(colourSpec[0] or curColours[0]),    \
+                    int(colourSpec[1]))
+            elif len(colourSpec) == 1                           \
+            or   len(colourSpec[1]) == 0:
+                return (int(colourSpec[0]), curColours[1])
+        else:
+            return (15, 1)
+    # }}}
+    # {{{ _writeBenchFile(self, pathName): write benchRows rows of random mIRC art of 80 to 160 columns to pathName
+    def _writeBenchFile(self, pathName):
+        benchRandom = random.Random(self.randomSeed)
+        with open(pathName, "w", encoding="utf-8", newline="") as outFile:
+            for numRow in range(self.benchRows):
+                outLine = []
+                for numRun in range(benchRandom.randint(8, 16)):
+                    outLine.append("\x03{},{}".format(benchRandom.randrange(16), benchRandom.randrange(16)))
+                    if benchRandom.random() < 0.1:
+                        outLine.append(benchRandom.choice("\x02\x06\x16\x1f"))
+                    outLine.append(benchRandom.choice("█▓▒░ #@abc") * benchRandom.randint(1, 20))
+                outFile.write("".join(outLine)[:480] + "\n")
+    # }}}
+
+    # {{{ bench(self): time reference and current parser on generated file of benchRows rows, returning (file size, reference seconds, current seconds)
+    def bench(self):
+        with tempfile.TemporaryDirectory() as tempDirName:
+            benchPathName = os.path.join(tempDirName, "bench.txt")
+            self._writeBenchFile(benchPathName)
+            timeStart = time.perf_counter()
+            refSize, refMap = self._importReference(benchPathName)
+            timeRef = time.perf_counter() - timeStart
+            canvasStore = MiRCARTCanvasImportStore(); timeStart = time.perf_counter();
+            canvasStore.importTextFile(benchPathName)
+            timeCur = time.perf_counter() - timeStart
+            if canvasStore.outMap.toList() != refMap.toList():
+                raise ValueError("{}: output differs from reference parser".format(benchPathName))
+            return os.stat(benchPathName).st_size, timeRef, timeCur
+    # }}}
+    # {{{ compare(self): compare corpus files and numRandomLines random lines, returning list of (description, mismatching import paths)
+    def compare(self):
+        mismatches = []
+        for pathName in sorted(glob.glob(os.path.join(self.corpusPathName, "*.txt"))):
+            fileMismatches = self._compareFile(pathName)
+            if len(fileMismatches):
+                mismatches.append((pathName, fileMismatches))
+        compareRandom = random.Random(self.randomSeed)
+        with tempfile.TemporaryDirectory() as tempDirName:
+            linePathName = os.path.join(tempDirName, "line.txt")
+            for numLine in range(self.numRandomLines):
+                inLine = "".join(compareRandom.choice(self._RandomAlphabet) for numChar in range(compareRandom.randint(0, 60)))
+                with open(linePathName, "w", encoding="utf-8", newline="") as outFile:
+                    outFile.write(inLine)
+                fileMismatches = self._compareFile(linePathName)
+                if len(fileMismatches):
+                    mismatches.append((repr(inLine), fileMismatches))
+        return mismatches
+    # }}}
+
+    #
+    # __init__(self, corpusPathName, numRandomLines=2000, benchRows=20000, randomSeed=1): initialisation method
+    def __init__(self, corpusPathName, numRandomLines=2000, benchRows=20000, randomSeed=1):
+        self.corpusPathName = corpusPathName; self.numRandomLines = numRandomLines;
+        self.benchRows = benchRows; self.randomSeed = randomSeed;
+
+#
+# Entry point
+def main(*argv):
+    optList, argv = getopt.getopt(argv[1:], "n:r:s:"); optDict = dict(optList);
+    corpusPathName = argv[0] if len(argv) else os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+    importBench = MiRCARTImportBench(corpusPathName, int(optDict.get("-n", "2000")),   \
+        int(optDict.get("-r", "20000")), int(optDict.get("-s", "1")))
+    mismatches = importBench.compare()
+    for description, fileMismatches in mismatches:
+        print("mismatch: {}: {}".format(description, ", ".join(fileMismatches)), file=sys.stderr)
+    print("{} corpus files and {} random lines compared, {} mismatching".format(    \
+        len(glob.glob(os.path.join(corpusPathName, "*.txt"))), importBench.numRandomLines, len(mismatches)))
+    if importBench.benchRows > 0:
+        benchSize, timeRef, timeCur = importBench.bench()
+        print("{} rows, {:.1f} MB: reference parser {:.2f}s, MiRCARTCanvasImportStore {:.2f}s ({:.1f}x)".format(   \
+            importBench.benchRows, benchSize / (1024 * 1024), timeRef, timeCur, timeRef / timeCur))
+    return 1 if len(mismatches) else 0
+
+if __name__ == "__main__":
+    optList, optArgs = getopt.getopt(sys.argv[1:], "n:r:s:")
+    if len(optArgs) > 1:
+        print("usage: {} "                                                      \
+            "[-n <number of random lines to compare; defaults to 2000>] "       \
+            "[-r <number of rows of generated benchmark file, or 0; defaults to 20000>] " \
+            "[-s <random seed; defaults to 1>] "                                \
+            "[<corpus directory pathname; defaults to bench/corpus>]".format(sys.argv[0]), file=sys.stderr)
+    else:
+        sys.exit(main(*sys.argv))
+
+# vim:expandtab foldmethod=marker sw=4 ts=4 tw=120
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+#
+# IrcMiRCARTBotFakeServer.py -- run IrcMiRCARTBot against a scripted local fake IRC server
+# Copyright (c) 2018 Lucio Andrés Illanes Albornoz <lucio@lucioillanes.de>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IrcMiRCARTBot
+from MiRCARTCanvasExportStore import MiRCARTCanvasExportStore
+import asyncio, getopt, time
+
+class IrcMiRCARTBotFakeServer():
+    """Scripted fake IRC server checking registration, PING handling during a !pngbot request, and rejoining after KICK"""
+    botNick = serverChannel = None
+    checkResults = None
+    requestPathName = rejoinDelay = uploadDelay = None
+
+    #
+    # _FakeUploadStore(MiRCARTCanvasExportStore): export store whose Imgur upload is replaced by a blocking delay of uploadDelay seconds
+    class _FakeUploadStore(MiRCARTCanvasExportStore):
+        uploadDelay = None
+
+        # {{{ exportFileToImgur(self, apiKey, imgName, imgTitle, imgFile): block for uploadDelay seconds and return fake link w/ image size
+        def exportFileToImgur(self, apiKey, imgName, imgTitle, imgFile):
+            time.sleep(self.uploadDelay)
+            return [200, "fake://{}.png".format(len(imgFile.read()))]
+        # }}}
+
+    # {{{ _check(self, checkName, checkResult): record and print single check result
+    def _check(self, checkName, checkResult):
+        self.checkResults.append((checkName, checkResult))
+        print("{}: {}".format("ok" if checkResult else "FAIL", checkName))
+        return checkResult
+    # }}}
+    # {{{ _readMessage(self, reader, timeout): read single line from bot w/ timeout, returning list of space-separated arguments w/ trailing argument, or None on timeout or EOF
+    async def _readMessage(self, reader, timeout):
+        try:
+            msg = await asyncio.wait_for(reader.readline(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if not len(msg):
+            return None
+        msg = msg.decode("utf-8", errors="replace").rstrip("\r\n").split(" :", 1)
+        return msg[0].split(" ") + msg[1:]
+    # }}}
+    # {{{ _expect(self, reader, command, timeout): read lines from bot until one of command, returning (message, list of messages skipped) or (None, list of messages skipped) on timeout
+    async def _expect(self, reader, command, timeout):
+        timeEnd = time.monotonic() + timeout; skipped = [];
+        while True:
+            msg = await self._readMessage(reader, max(timeEnd - time.monotonic(), 0))
+            if msg == None or msg[0] == command:
+                return msg, skipped
+            skipped.append(msg)
+    # }}}
+    # {{{ _serve(self, reader, writer): serve single bot connection according to script
+    async def _serve(self, reader, writer):
+        sendLine = lambda line: writer.write((line + "\r\n").encode())
+        try:
+            nickMsg, skipped = await self._expect(reader, "NICK", 5)
+            userMsg, skipped = await self._expect(reader, "USER", 5)
+            if  not self._check("registration (NICK and USER)", nickMsg != None and userMsg != None     \
+                                and nickMsg[1] == self.botNick):
+                return
+            sendLine(":fake.server 001 {} :Welcome".format(self.botNick))
+            joinMsg, skipped = await self._expect(reader, "JOIN", 5)
+            if not self._check("JOIN after 001", joinMsg != None and joinMsg[1] == self.serverChannel):
+                return
+            sendLine(":{}!bot@localhost JOIN {}".format(self.botNick, self.serverChannel))
+            sendLine(":fake.server 353 {} = {} :{} @op".format(self.botNick, self.serverChannel, self.botNick))
+
+            sendLine(":op!op@localhost PRIVMSG {} :!pngbot file://{}".format(self.serverChannel, self.requestPathName))
+            await asyncio.sleep(self.uploadDelay / 4)
+            sendLine("PING :during-request"); timePing = time.monotonic();
+            pongMsg, skipped = await self._expect(reader, "PONG", self.uploadDelay)
+            self._check("PONG while request is in flight ({:.3f}s)".format(time.monotonic() - timePing),      \
+                        pongMsg != None and pongMsg[1] == "during-request"                                  \
+                        and not any(msg[0] == "PRIVMSG" for msg in skipped))
+            replyMsg, skipped = await self._expect(reader, "PRIVMSG", self.uploadDelay * 4)
+            self._check("reply to request", replyMsg != None and "Uploaded as: fake://" in replyMsg[2])
+
+            sendLine(":op!op@localhost KICK {} {} :bye".format(self.serverChannel, self.botNick))
+            sendLine(":other!other@localhost JOIN {}".format(self.serverChannel))
+            timeKick = time.monotonic()
+            joinMsg, skipped = await self._expect(reader, "JOIN", self.rejoinDelay * 3)
+            self._check("rejoin after KICK despite JOIN of other user ({:.1f}s)".format(time.monotonic() - timeKick),  \
+                        joinMsg != None and (time.monotonic() - timeKick) >= (self.rejoinDelay * 0.9))
+            sendLine(":{}!bot@localhost JOIN {}".format(self.botNick, self.serverChannel))
+            joinMsg, skipped = await self._expect(reader, "JOIN", self.rejoinDelay * 2)
+            self._check("no further rejoin once joined", joinMsg == None)
+        finally:
+            writer.close()
+    # }}}
+
+    # {{{ run(self): run bot against fake server until it disconnects, returning True if all checks passed
+    async def run(self):
+        fakeServer = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        fakeBot = IrcMiRCARTBot.IrcMiRCARTBot("127.0.0.1", str(fakeServer.sockets[0].getsockname()[1]), self.botNick)
+        fakeBot.clientExportStore = self._FakeUploadStore(None); fakeBot.clientExportStore.uploadDelay = self.uploadDelay;
+        fakeBot.clientRejoinDelay = self.rejoinDelay;
+        if self._check("connect", await fakeBot.connect(5)):
+            await asyncio.wait_for(fakeBot.dispatch(), (self.rejoinDelay * 6) + (self.uploadDelay * 6) + 10)
+            fakeBot.close()
+        fakeServer.close(); await fakeServer.wait_closed();
+        return len(self.checkResults) > 0 and all(checkResult for checkName, checkResult in self.checkResults)
+    # }}}
+
+    #
+    # __init__(self, requestPathName, uploadDelay=2, rejoinDelay=1, botNick="pngbot", serverChannel="#MiRCART"): initialisation method
+    def __init__(self, requestPathName, uploadDelay=2, rejoinDelay=1, botNick="pngbot", serverChannel="#MiRCART"):
+        self.requestPathName = os.path.abspath(requestPathName)
+        self.uploadDelay = uploadDelay; self.rejoinDelay = rejoinDelay;
+        self.botNick = botNick; self.serverChannel = serverChannel;
+        self.checkResults = []
+
+#
+# Entry point
+def main(*argv):
+    optList, argv = getopt.getopt(argv[1:], "r:u:"); optDict = dict(optList);
+    packageDirName = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    requestPathName = argv[0] if len(argv) else os.path.join(packageDirName, "bench", "corpus", "blocks.txt")
+    fakeServer = IrcMiRCARTBotFakeServer(requestPathName,                   \
+        float(optDict.get("-u", "2")), float(optDict.get("-r", "1")))
+    os.chdir(packageDirName)
+    return 0 if asyncio.run(fakeServer.run()) else 1
+
+if __name__ == "__main__":
+    optList, optArgs = getopt.getopt(sys.argv[1:], "r:u:")
+    if len(optArgs) > 1:
+        print("usage: {} "                                                  \
+            "[-r <rejoin delay in seconds; defaults to 1>] "                \
+            "[-u <fake upload delay in seconds; defaults to 2>] "           \
+            "[<MiRCART file pathname to request; defaults to bench/corpus/blocks.txt>]".format(sys.argv[0]), file=sys.stderr)
+    else:
+        sys.exit(main(*sys.argv))
+
+# vim:expandtab foldmethod=marker sw=4 ts=4 tw=120